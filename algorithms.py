@@ -1,31 +1,669 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from PIL import Image
-from tensorflow.keras.models import load_model
+from batching import BatchRunner, BatchStats, batchSizeForBudget, stackBatch
+from pipeline import Pipeline, PipelineStats, Stage
+from raster import asRasterSource
+from resampling import checkQuality, readResized, resizeImage
+from cache import fileIdentity, sourceDigest, FeatureCache
+from backends import InferenceBackend, loadBackend, configuredIdentity, splitSiameseModel, outputList
+from profiling import span
+from classifiers import LinearSVM, DecisionTree, FuzzyARTMAP, pixelFeatures, pseudoLabels, balancedSample
+from constants import (
+    TILE_SIZE,
+    TILE_OVERLAP,
+    PIPELINE_READ_WORKERS,
+    PIPELINE_PREPROCESS_WORKERS,
+    PIPELINE_INFERENCE_WORKERS,
+    PIPELINE_UPSAMPLE_WORKERS,
+    MODELS_DIR,
+    CLASSIFIER_CHUNK_PIXELS,
+    CLASSIFIER_TRAIN_SAMPLES,
+    CLASSIFIER_ARTMAP_TRAIN_SAMPLES,
+    CLASSIFIER_OVERVIEW_SIZE,
+    RESAMPLING_QUALITY,
+    PREPROCESS_CACHE_MEMORY_BUDGET
+)
+
+
+class AlgorithmCancelled(Exception):
+    pass
 
 
 class Algorithm:
+    resampling_quality = RESAMPLING_QUALITY
+
     def getInputSize(self):
+        '''
+            Returns size the pictures are resized to before performImpl,
+            or None if the algorithm works at native resolution pixel by pixel
+        '''
+
         raise NotImplementedError
 
+    def getIdentity(self):
+        '''
+            Returns string which changes whenever results of the algorithm may change,
+            e.g. when its model file is replaced. Used as a part of result cache keys.
+        '''
+
+        return type(self).__name__
+
+    def getResamplingQuality(self):
+        '''
+            Returns quality of downscaling of the pictures to getInputSize(), see resampling.QUALITIES
+        '''
+
+        return self.resampling_quality
+
+    def setResamplingQuality(self, quality):
+        checkQuality(quality)
+        self.resampling_quality = quality
+
+    def warmUp(self):
+        '''
+            Loads whatever the algorithm loads lazily and runs it once on a dummy input,
+            so the first real run isn't slowed down by initialization
+        '''
+
+        pass
+
     def performImpl(self, t1, t2):
+        '''
+            Returns map of change probabilities of the pair quantized to uint8 (see quantizeProbabilities),
+            so results can be thresholded at any sensitivity without running the algorithm again
+        '''
+
         raise NotImplemented
 
+    def performBatchImpl(self, t1_batch, t2_batch):
+        '''
+            Same as performImpl for arrays stacked along the first axis.
+            Algorithms which can process several pairs at once should override it.
+        '''
+
+        return np.array([self.performImpl(t1, t2) for t1, t2 in zip(t1_batch, t2_batch)])
+
+    def encodeBatchImpl(self, batch):
+        '''
+            Per-picture part of the algorithm for pictures resized to getInputSize()
+            and stacked along the first axis. Returns list of feature arrays stacked the same way,
+            which are cached per picture and passed to decodeBatchImpl.
+            By default the resized picture itself is its features.
+        '''
+
+        return [batch]
+
+    def decodeBatchImpl(self, t1_features, t2_features):
+        '''
+            Pairwise part of the algorithm, same as performBatchImpl for features of both pictures
+        '''
+
+        return self.performBatchImpl(t1_features[0], t2_features[0])
+
+
+# throughput of all batched runs in this process
+batch_stats = BatchStats()
+
+# busy time of pipeline stages of all runs in this process
+pipeline_stats = PipelineStats()
+
+# encoder features of pictures, shared by all runs in this process
+feature_cache = FeatureCache()
+# pictures resized to input sizes, shared by all algorithms reading them at the same size
+preprocess_cache = FeatureCache(PREPROCESS_CACHE_MEMORY_BUDGET)
+
+
+def readPreprocessed(pic, size, quality=RESAMPLING_QUALITY):
+    '''
+        Returns read-only uint8 array of picture `pic` resized to `size` by readResized.
+        Arrays are memoized in preprocess_cache by content of the picture, size and quality,
+        so algorithms run on the same pair resize each picture once.
+    '''
+
+    def read():
+        arr = np.array(readResized(asRasterSource(pic), size, quality))
+        arr.flags.writeable = False
+        return [arr]
+
+    key = 'resized:{}:{}:{}'.format(size, quality, sourceDigest(pic))
+    return preprocess_cache.getOrCompute(key, read)[0]
+
+
+def quantizeProbabilities(probabilities):
+    '''
+        Returns uint8 array of round(probability * 255), thresholded by raster.thresholdMask
+    '''
+
+    return np.clip(np.rint(np.asarray(probabilities, dtype=np.float32) * 255), 0, 255).astype(np.uint8)
+
+
+def upsampleResult(algo_result, size):
+    with span('upsample'):
+        res_im = Image.fromarray(np.asarray(algo_result, dtype=np.uint8))
+        return res_im.resize(size, Image.BILINEAR)
+
+
+def _checkCancelled(is_cancelled):
+    if is_cancelled is not None and is_cancelled():
+        raise AlgorithmCancelled
+
+
+def performAlgorithm(algo, t1_pic, t2_pic, progress=None, is_cancelled=None):
+    '''
+        Returns 'L' image of change probabilities * 255 (see quantizeProbabilities) of the size of `t1_pic`.
+        `t1_pic` and `t2_pic` are RasterSource's or PIL images.
+        `progress(done, total)` is called after each step,
+        `is_cancelled()` is polled between steps and if it returns True,
+        AlgorithmCancelled is raised.
+    '''
+
+    if algo.getInputSize() is None:
+        return performAlgorithmPixelwise(algo, t1_pic, t2_pic, progress, is_cancelled)
 
-def performAlgorithm(algo, t1_pic, t2_pic):
     width = t1_pic.width
     height = t1_pic.height
 
-    t1_arr = np.array(t1_pic.resize(algo.getInputSize(), Image.ANTIALIAS))
-    t2_arr = np.array(t2_pic.resize(algo.getInputSize(), Image.ANTIALIAS))
+    t1_features, t2_features = encodePictures(algo, [t1_pic, t2_pic], is_cancelled)
+    _checkCancelled(is_cancelled)
 
-    algo_result = algo.performImpl(t1_arr, t2_arr)
+    with span('inference'):
+        algo_result = algo.decodeBatchImpl(stackBatch([t1_features]), stackBatch([t2_features]))[0]
+    _checkCancelled(is_cancelled)
 
-    res_im = Image.fromarray(algo_result)
-    res_im = res_im.resize((width, height), Image.NEAREST)
+    res_im = upsampleResult(algo_result, (width, height))
+    if progress is not None:
+        progress(1, 1)
     return res_im
 
 
-SNATCHED_MODEL = load_model('best_model.h5')
+def encodePictures(algo, pics, is_cancelled=None, batch_size=None):
+    '''
+        Returns features of each picture of `pics` made by algo.encodeBatchImpl.
+        Features of pictures encoded before are taken from feature_cache,
+        the rest of pictures are resized and encoded in batches, each distinct picture once.
+        Reading and resizing of next pictures overlaps with encoding of previous ones.
+    '''
+
+    keys = [feature_cache.key(algo, pic) for pic in pics]
+    found = {}
+    todo = []
+    for index, key in enumerate(keys):
+        if key in found:
+            continue
+        found[key] = feature_cache.get(key)
+        if found[key] is None:
+            todo.append(index)
+
+    def read(index):
+        return readPreprocessed(pics[index], algo.getInputSize(), algo.getResamplingQuality())
+
+    def encode(batch):
+        with span('encode'):
+            encoded = algo.encodeBatchImpl(np.stack(batch))
+        # copies, so cached features don't keep the whole batch alive
+        return [[np.array(x[i]) for x in encoded] for i in range(len(batch))]
+
+    def indices():
+        for index in todo:
+            _checkCancelled(is_cancelled)
+            yield index
+
+    pipeline = Pipeline([
+        Stage('read', read, PIPELINE_READ_WORKERS),
+        Stage('encode', encode, PIPELINE_INFERENCE_WORKERS, batch_size or batchSizeForBudget),
+    ], stats=pipeline_stats)
+
+    for features, index in zip(pipeline.map(indices()), todo):
+        feature_cache.put(keys[index], features)
+        found[keys[index]] = features
+
+    return [found[key] for key in keys]
+
+
+SERIES_MODES = ('reference', 'sequential')
+
+
+def seriesPairs(count, mode):
+    '''
+        Returns pairs of indices of a time series of `count` pictures compared in `mode`:
+        'reference' - the first picture with each of the next ones,
+        'sequential' - each picture with the next one
+    '''
+
+    if mode == 'reference':
+        return [(0, i) for i in range(1, count)]
+    if mode == 'sequential':
+        return [(i - 1, i) for i in range(1, count)]
+    raise ValueError('seriesPairs: unknown mode ' + repr(mode))
+
+
+def tileOrigins(length, tile_size, stride):
+    '''
+        Returns origins of windows of `tile_size` placed every `stride` pixels
+        along an axis of `length` pixels. The last window is shifted back
+        to the border, so windows always cover the whole axis.
+    '''
+
+    if length <= tile_size:
+        return [0]
+    origins = list(range(0, length - tile_size, stride))
+    origins.append(length - tile_size)
+    return origins
+
+
+def blendingWindow(tile_size, overlap):
+    '''
+        Returns 2D weights of a tile: 1 in the middle and linearly decreasing
+        to the borders within `overlap` pixels, so overlapping tiles fade into each other.
+    '''
+
+    ramp = np.minimum(np.arange(1, tile_size + 1), np.arange(tile_size, 0, -1)) / (overlap + 1)
+    ramp = np.minimum(ramp, 1).astype(np.float32)
+    return np.outer(ramp, ramp)
+
+
+def readTile(source, box):
+    '''
+        Reads window `box` of RasterSource `source`. Parts of the window outside of the raster
+        are filled by mirroring it, so tiles larger than the scene or cut by its border
+        don't show the model black margins.
+    '''
+
+    left, top, right, bottom = box
+    inner = (max(0, left), max(0, top), min(right, source.width), min(bottom, source.height))
+    if inner == tuple(box):
+        return source.readWindow(box)
+
+    arr = np.asarray(source.readWindow(inner))
+    pad = ((inner[1] - top, bottom - inner[3]), (inner[0] - left, right - inner[2])) + ((0, 0),) * (arr.ndim - 2)
+    return Image.fromarray(np.pad(arr, pad, mode='symmetric'))
+
+
+def resizeTile(algo, tile, tile_size):
+    if (tile_size, tile_size) != algo.getInputSize():
+        tile = resizeImage(tile, algo.getInputSize(), algo.getResamplingQuality())
+    return np.array(tile)
+
+
+def upsampleTile(algo_result, tile_size):
+    '''
+        Returns result of algorithm on a tile upsampled to `tile_size`
+        as float array of values in [0, 255]
+    '''
+
+    with span('upsample'):
+        res_im = Image.fromarray(np.asarray(algo_result, dtype=np.float32), 'F')
+        res_im = res_im.resize((tile_size, tile_size), Image.BILINEAR)
+        return np.asarray(res_im)
+
+
+def iterTiledBands(algo, t1_pic, t2_pic, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, stride=None,
+                   progress=None, is_cancelled=None, batch_size=None):
+    '''
+        Runs `algo` on overlapping windows of `tile_size` cut from the native resolution pair
+        and yields stitched probability map as (top, band) where band is uint8 array of full width.
+
+        Tiles are processed row by row and only a band of `tile_size` rows is kept in memory,
+        so memory use doesn't depend on the height of the scene.
+        If `stride` is None, it is `tile_size - overlap`.
+        `progress` and `is_cancelled` are the same as in performAlgorithm, steps are tiles.
+
+        Reading, resizing, inference and upsampling of tiles run concurrently as stages of a Pipeline
+        with PIPELINE_*_WORKERS threads, while this generator stitches finished tiles.
+        Tiles are sent to the model in batches of up to `batch_size` (by default chosen by batchSizeForBudget).
+    '''
+
+    if stride is None:
+        stride = tile_size - overlap
+    if not 0 < stride <= tile_size:
+        raise ValueError('iterTiledBands: stride must be in range (0, tile_size]')
+
+    t1_source = asRasterSource(t1_pic)
+    t2_source = asRasterSource(t2_pic)
+
+    width = t1_pic.width
+    height = t1_pic.height
+
+    xs = tileOrigins(width, tile_size, stride)
+    ys = tileOrigins(height, tile_size, stride)
+    weights = blendingWindow(tile_size, overlap)
+
+    acc = np.zeros((tile_size, width), dtype=np.float32)
+    acc_weights = np.zeros((tile_size, width), dtype=np.float32)
+
+    origins = [(row, x) for row in range(len(ys)) for x in xs]
+
+    def boxes():
+        for row, x in origins:
+            _checkCancelled(is_cancelled)
+            yield x, ys[row], x + tile_size, ys[row] + tile_size
+
+    def read(box):
+        return readTile(t1_source, box), readTile(t2_source, box)
+
+    def preprocess(windows):
+        return tuple(resizeTile(algo, window, tile_size) for window in windows)
+
+    runner = BatchRunner(algo, stats=batch_stats)
+
+    def infer(batch):
+        return runner.run([t1 for t1, t2 in batch], [t2 for t1, t2 in batch])
+
+    def inferBatchSize(pair):
+        return batchSizeForBudget(pair[0])
+
+    pipeline = Pipeline([
+        Stage('read', read, PIPELINE_READ_WORKERS),
+        Stage('preprocess', preprocess, PIPELINE_PREPROCESS_WORKERS),
+        Stage('inference', infer, PIPELINE_INFERENCE_WORKERS, batch_size or inferBatchSize),
+        Stage('upsample', lambda algo_result: upsampleTile(algo_result, tile_size), PIPELINE_UPSAMPLE_WORKERS),
+    ], stats=pipeline_stats)
+
+    tiles_total = len(origins)
+    tiles_done = 0
+
+    for index, tile in enumerate(pipeline.map(boxes())):
+        row, x = origins[index]
+        y = ys[row]
+
+        w = min(tile_size, width - x)
+        acc[:, x:x + w] += tile[:, :w] * weights[:, :w]
+        acc_weights[:, x:x + w] += weights[:, :w]
+
+        tiles_done += 1
+        if progress is not None:
+            progress(tiles_done, tiles_total)
+
+        if x != xs[-1]:
+            continue
+
+        # rows above the next row of tiles won't get any more contributions
+        if row + 1 < len(ys):
+            done = ys[row + 1] - y
+        else:
+            done = min(tile_size, height - y)
+
+        band = acc[:done] / acc_weights[:done]
+        yield y, np.rint(band).astype(np.uint8)
+
+        acc = np.roll(acc, -done, axis=0)
+        acc_weights = np.roll(acc_weights, -done, axis=0)
+        acc[tile_size - done:] = 0
+        acc_weights[tile_size - done:] = 0
+
+
+def performAlgorithmTiled(algo, t1_pic, t2_pic, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, stride=None,
+                          progress=None, is_cancelled=None, batch_size=None):
+    '''
+        Same as performAlgorithm but keeps native resolution:
+        the pair is processed by overlapping tiles which are stitched with blending.
+    '''
+
+    if algo.getInputSize() is None:
+        return performAlgorithmPixelwise(algo, t1_pic, t2_pic, progress, is_cancelled)
+
+    result = np.empty((t1_pic.height, t1_pic.width), dtype=np.uint8)
+    bands = iterTiledBands(algo, t1_pic, t2_pic, tile_size, overlap, stride, progress, is_cancelled, batch_size)
+    for top, band in bands:
+        result[top:top + band.shape[0]] = band
+    return Image.fromarray(result)
+
+
+def performAlgorithmMany(algo, pairs, progress=None, is_cancelled=None, batch_size=None):
+    '''
+        Same as performAlgorithm for each (t1_pic, t2_pic) of `pairs`,
+        but the pairs are sent to the model in batches.
+        Returns list of results in the order of `pairs`.
+    '''
+
+    pairs = list(pairs)
+
+    if algo.getInputSize() is None:
+        results = []
+        for index, (t1_pic, t2_pic) in enumerate(pairs):
+            results.append(performAlgorithmPixelwise(algo, t1_pic, t2_pic, is_cancelled=is_cancelled))
+            if progress is not None:
+                progress(index + 1, len(pairs))
+        return results
+
+    # every distinct picture is encoded once, however many pairs it is in
+    features = encodePictures(algo, [pic for pair in pairs for pic in pair], is_cancelled, batch_size)
+
+    def inputs():
+        for index in range(len(pairs)):
+            _checkCancelled(is_cancelled)
+            yield index, features[2 * index], features[2 * index + 1]
+
+    runner = BatchRunner(algo, batch_size, stats=batch_stats, method=algo.decodeBatchImpl)
+
+    results = []
+    for index, algo_result in runner.map(inputs()):
+        t1_pic = pairs[index][0]
+        results.append(upsampleResult(algo_result, (t1_pic.width, t1_pic.height)))
+        if progress is not None:
+            progress(index + 1, len(pairs))
+    return results
+
+
+def performAlgorithmSeries(algo, pics, mode='reference', progress=None, is_cancelled=None, batch_size=None):
+    '''
+        Change maps of a time series of pictures in one run, pairs are chosen by seriesPairs.
+        Each picture is encoded once, so N pictures take N encoder passes and N - 1 decoder passes.
+        Returns list of (i, j, result) for pairs of indices of `pics`.
+    '''
+
+    pairs = seriesPairs(len(pics), mode)
+    results = performAlgorithmMany(algo, [(pics[i], pics[j]) for i, j in pairs], progress, is_cancelled, batch_size)
+    return [(i, j, result) for (i, j), result in zip(pairs, results)]
+
+
+def performAlgorithms(algos, t1_pic, t2_pic, tiling=None, progress=None, is_cancelled=None, cache=None):
+    '''
+        Results of several algorithms on one pair in the order of `algos`, the same as performAlgorithm
+        (or performAlgorithmTiled with `tiling` = (tile_size, overlap)) of each of them.
+        Algorithms with an input size run in parallel and share resized pictures (see readPreprocessed),
+        per-pixel algorithms run in one pass over the pair next to them (see performAlgorithmsPixelwise).
+        Results found in ResultCache `cache` are taken from it, new ones are stored in it.
+    '''
+
+    func, args = (performAlgorithm, ()) if tiling is None else (performAlgorithmTiled, tuple(tiling))
+    t1_source = asRasterSource(t1_pic)
+    t2_source = asRasterSource(t2_pic)
+
+    results = [None] * len(algos)
+    keys = [None] * len(algos)
+    if cache is not None:
+        for index, algo in enumerate(algos):
+            keys[index] = cache.key(func, algo, t1_source, t2_source, *args)
+            results[index] = cache.get(keys[index])
+    todo = [index for index, result in enumerate(results) if result is None]
+    pixelwise = [index for index in todo if algos[index].getInputSize() is None]
+    scaled = [index for index in todo if algos[index].getInputSize() is not None]
+
+    lock = threading.Lock()
+    done = [len(algos) - len(todo)]
+
+    def finished(indices, outputs):
+        with lock:
+            for index, result in zip(indices, outputs):
+                results[index] = result
+                if cache is not None:
+                    cache.put(keys[index], result)
+            done[0] += len(indices)
+            if progress is not None:
+                progress(done[0], len(algos))
+
+    def runPixelwise():
+        algos_pixelwise = [algos[index] for index in pixelwise]
+        results_pixelwise = performAlgorithmsPixelwise(algos_pixelwise, t1_source, t2_source, is_cancelled=is_cancelled)
+        finished(pixelwise, results_pixelwise)
+
+    def runScaled(index):
+        finished([index], [func(algos[index], t1_source, t2_source, *args, is_cancelled=is_cancelled)])
+
+    if todo:
+        with ThreadPoolExecutor(len(scaled) + 1) as executor:
+            futures = [executor.submit(runScaled, index) for index in scaled]
+            if pixelwise:
+                futures.append(executor.submit(runPixelwise))
+            for future in futures:
+                future.result()
+    elif progress is not None:
+        progress(len(algos), len(algos))
+    return results
+
+
+def ensembleResult(results):
+    '''
+        Soft vote of change maps `results` (probabilities * 255 of the same size): the mean probability
+        of each pixel, so above the threshold are the pixels the algorithms are confident about on the whole
+    '''
+
+    if not results:
+        raise ValueError('ensembleResult: no results')
+    with span('ensemble'):
+        total = np.zeros(np.asarray(results[0]).shape, dtype=np.uint16)
+        for result in results:
+            total += np.asarray(result)
+        return Image.fromarray(((total + len(results) // 2) // len(results)).astype(np.uint8))
+
+
+def warmUpAlgorithms(names=None, progress=None, is_cancelled=None):
+    '''
+        Calls warmUp of the algorithms `names` (all by default), e.g. in background after the GUI is shown.
+        Returns {name: seconds} of each warm-up, loading of the CNN included (see modelLoadSeconds).
+    '''
+
+    names = list(algorithms) if names is None else names
+    seconds = {}
+    for index, name in enumerate(names):
+        _checkCancelled(is_cancelled)
+        start = time.perf_counter()
+        with span('warm_up'):
+            algorithms[name].warmUp()
+        seconds[name] = time.perf_counter() - start
+        if progress is not None:
+            progress(index + 1, len(names))
+    return seconds
+
+
+def performAlgorithmPixelwise(algo, t1_pic, t2_pic, progress=None, is_cancelled=None):
+    '''
+        Runs PixelClassifierAlgorithm at native resolution by bands of rows,
+        so only one band of both pictures is decoded at a time
+    '''
+
+    return performAlgorithmsPixelwise([algo], t1_pic, t2_pic, progress, is_cancelled)[0]
+
+
+def performAlgorithmsPixelwise(algos, t1_pic, t2_pic, progress=None, is_cancelled=None):
+    '''
+        Same as performAlgorithmPixelwise for each of `algos` in one pass:
+        classifiers are fitted in parallel, then every band is decoded
+        and turned into pixelFeatures once and classified by all of them.
+    '''
+
+    t1_source = asRasterSource(t1_pic)
+    t2_source = asRasterSource(t2_pic)
+    if t1_source.size != t2_source.size:
+        raise ValueError('Pictures must have the same size for per-pixel algorithms')
+
+    width, height = t1_source.size
+    with ThreadPoolExecutor(len(algos)) as executor:
+        classifiers = list(executor.map(lambda algo: algo.fitClassifier(t1_source, t2_source), algos))
+        _checkCancelled(is_cancelled)
+
+        results = [np.empty((height, width), dtype=np.uint8) for _ in algos]
+        rows = max(1, CLASSIFIER_CHUNK_PIXELS // width)
+        for top in range(0, height, rows):
+            _checkCancelled(is_cancelled)
+
+            box = (0, top, width, min(top + rows, height))
+            t1 = np.array(t1_source.readWindow(box).convert('RGB'))
+            t2 = np.array(t2_source.readWindow(box).convert('RGB'))
+            features = pixelFeatures(t1, t2)
+
+            def predict(index):
+                with span('inference'):
+                    probabilities = algos[index].predictFeatures(classifiers[index], features)
+                    results[index][box[1]:box[3]] = quantizeProbabilities(probabilities).reshape(t1.shape[:2])
+
+            list(executor.map(predict, range(len(algos))))
+
+            if progress is not None:
+                progress(box[3], height)
+    return [Image.fromarray(result) for result in results]
+
+
+_snatched_model = None
+# identity of the model set by setSnatchedModel instead of the file
+_snatched_model_identity = None
+# (model, encoder, decoder) made by splitSiameseModel
+_split_model = None
+_snatched_model_lock = threading.Lock()
+# seconds taken by loading the CNN, None until it is loaded
+_model_load_seconds = None
+
+
+def getSnatchedModel():
+    '''
+        Loads the CNN by the configured inference backend (see backends.configure) on first use,
+        so algorithms which don't need it don't import any runtime
+    '''
+
+    global _snatched_model, _model_load_seconds
+    with _snatched_model_lock:
+        if _snatched_model is None:
+            start = time.perf_counter()
+            with span('model_load'):
+                _snatched_model = loadBackend()
+            _model_load_seconds = time.perf_counter() - start
+        return _snatched_model
+
+
+def modelLoadSeconds():
+    '''
+        Returns seconds taken by loading the CNN, or None if it isn't loaded yet
+    '''
+
+    return _model_load_seconds
+
+
+def setSnatchedModel(model):
+    '''
+        Replaces the CNN, e.g. by a stand-in model in benchmarks
+    '''
+
+    global _snatched_model, _snatched_model_identity
+    with _snatched_model_lock:
+        _snatched_model = model
+        _snatched_model_identity = '{}@{:x}'.format(type(model).__name__, id(model))
+
+
+def snatchedModelIdentity():
+    return _snatched_model_identity or configuredIdentity()
+
+
+def getSplitModel():
+    '''
+        Returns (encoder, decoder) of the CNN, or (None, None) if it can't be split by splitSiameseModel
+    '''
+
+    global _split_model
+    model = getSnatchedModel()
+    with _snatched_model_lock:
+        if _split_model is None or _split_model[0] is not model:
+            if isinstance(model, InferenceBackend):
+                _split_model = (model,) + model.split()
+            else:
+                _split_model = (model,) + splitSiameseModel(model)
+        return _split_model[1:]
+
+
 OUTPUT_SIZE = 32
 
 
@@ -33,44 +671,125 @@ class DeepLearning(Algorithm):
     def getInputSize(self):
         return (512, 512)
 
+    def getIdentity(self):
+        return type(self).__name__ + ':' + snatchedModelIdentity()
+
+    def warmUp(self):
+        # the runtime allocates its buffers and picks kernels on the first call of each part of the model
+        width, height = self.getInputSize()
+        features = self.encodeBatchImpl(np.zeros((1, height, width, 3), dtype=np.uint8))
+        self.decodeBatchImpl(features, features)
+
     def performImpl(self, t1, t2):
-        result = SNATCHED_MODEL(inputs=[np.array([t1]), np.array([t2])])
-        output = np.asarray(result[0])
-        output = np.round(output) * 255
-        return output.reshape((OUTPUT_SIZE, OUTPUT_SIZE))
+        return self.performBatchImpl(np.array([t1]), np.array([t2]))[0]
 
+    def performBatchImpl(self, t1_batch, t2_batch):
+        result = getSnatchedModel()(inputs=[t1_batch, t2_batch])
+        return self._changeMaps(result, len(t1_batch))
 
-class SVMAlgorithm(Algorithm):
-    def getInputSize(self):
-        return (512, 512)
+    def encodeBatchImpl(self, batch):
+        encoder, decoder = getSplitModel()
+        if encoder is None:
+            return [batch]
+        return [np.asarray(x) for x in outputList(encoder(batch))]
 
-    def performImpl(self, t1, t2):
-        result = SNATCHED_MODEL(inputs=[np.array([t1]), np.array([t2])])
-        output = np.asarray(result[0])
-        output = np.round(output) * 255
-        return output.reshape((OUTPUT_SIZE, OUTPUT_SIZE))
+    def decodeBatchImpl(self, t1_features, t2_features):
+        encoder, decoder = getSplitModel()
+        if decoder is None:
+            return self.performBatchImpl(t1_features[0], t2_features[0])
+        result = decoder(list(t1_features) + list(t2_features))
+        return self._changeMaps(result, len(t1_features[0]))
 
+    @staticmethod
+    def _changeMaps(result, count):
+        return quantizeProbabilities(result).reshape((count, OUTPUT_SIZE, OUTPUT_SIZE))
 
-class DecisionTreeAlgorithm(Algorithm):
-    def getInputSize(self):
-        return (512, 512)
 
-    def performImpl(self, t1, t2):
-        result = SNATCHED_MODEL(inputs=[np.array([t1]), np.array([t2])])
-        output = np.asarray(result[0])
-        output = np.round(output) * 255
-        return output.reshape((OUTPUT_SIZE, OUTPUT_SIZE))
+class PixelClassifierAlgorithm(Algorithm):
+    '''
+        Classifies every pixel of a pair at native resolution.
+        If MODELS_DIR/`model_file` exists, the pretrained classifier is loaded from it,
+        otherwise a classifier is trained for each pair on pseudo labels of its overview.
+    '''
 
+    classifier_class = None
+    model_file = None
+    train_samples = CLASSIFIER_TRAIN_SAMPLES
 
-class FuzzyARTMAPAlgorithm(Algorithm):
     def getInputSize(self):
-        return (512, 512)
+        return None
+
+    def getIdentity(self):
+        path = os.path.join(MODELS_DIR, self.model_file)
+        if os.path.exists(path):
+            return type(self).__name__ + ':' + fileIdentity(path)
+        return type(self).__name__ + ':self-trained'
+
+    def warmUp(self):
+        self.loadClassifier()
+
+    def loadClassifier(self):
+        path = os.path.join(MODELS_DIR, self.model_file)
+        return self.classifier_class.load(path) if os.path.exists(path) else None
+
+    def trainClassifier(self, t1, t2, labels=None):
+        '''
+            Trains a new classifier on a pair of arrays.
+            If `labels` (array of 0/1 of the same height and width) are not given,
+            labels are obtained by change vector analysis.
+        '''
+
+        features = pixelFeatures(t1, t2)
+        labels = pseudoLabels(features, features.shape[1] // 3) if labels is None else labels.reshape(-1)
+        samples = balancedSample(labels, self.train_samples, np.random.default_rng(0))
+        return self.classifier_class().fit(features[samples], labels[samples])
+
+    def fitClassifier(self, t1_source, t2_source):
+        classifier = self.loadClassifier()
+        if classifier is not None:
+            return classifier
+
+        scale = min(1, CLASSIFIER_OVERVIEW_SIZE / max(t1_source.size))
+        size = (max(1, round(t1_source.width * scale)), max(1, round(t1_source.height * scale)))
+        t1, t2 = (
+            np.asarray(Image.fromarray(readPreprocessed(source, size, self.getResamplingQuality())).convert('RGB'))
+            for source in (t1_source, t2_source)
+        )
+        return self.trainClassifier(t1, t2)
+
+    def predict(self, classifier, t1, t2):
+        '''
+            Returns change probabilities of the pixels of a pair of arrays
+        '''
+
+        return self.predictFeatures(classifier, pixelFeatures(t1, t2)).reshape(t1.shape[:2])
+
+    def predictFeatures(self, classifier, features):
+        '''
+            Returns change probabilities of pixels given by their pixelFeatures
+        '''
+
+        return classifier.predict(features)
 
     def performImpl(self, t1, t2):
-        result = SNATCHED_MODEL(inputs=[np.array([t1]), np.array([t2])])
-        output = np.asarray(result[0])
-        output = np.round(output) * 255
-        return output.reshape((OUTPUT_SIZE, OUTPUT_SIZE))
+        classifier = self.loadClassifier() or self.trainClassifier(t1, t2)
+        return quantizeProbabilities(self.predict(classifier, t1, t2))
+
+
+class SVMAlgorithm(PixelClassifierAlgorithm):
+    classifier_class = LinearSVM
+    model_file = 'svm.npz'
+
+
+class DecisionTreeAlgorithm(PixelClassifierAlgorithm):
+    classifier_class = DecisionTree
+    model_file = 'decision_tree.npz'
+
+
+class FuzzyARTMAPAlgorithm(PixelClassifierAlgorithm):
+    classifier_class = FuzzyARTMAP
+    model_file = 'fuzzy_artmap.npz'
+    train_samples = CLASSIFIER_ARTMAP_TRAIN_SAMPLES
 
 
 # format: <visible_algorithm_name, algorithm_class(Algorithm)>
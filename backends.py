@@ -0,0 +1,562 @@
+'''
+    Inference backends of the CNN on CPU.
+
+    The Keras model `best_model.h5` may be exported to TFLite or ONNX, optionally quantized to int8.
+    A quantized model is validated against the float Keras model on calibration pairs
+    and rejected if its change maps differ too much. Every backend takes the numbers of
+    intra-op and inter-op threads, so the fastest setup for a machine can be picked
+    with `benchmark.py --backends`.
+
+    Example:
+        python backends.py --format tflite --quantize --calibration 2019.tif 2021.tif 2018.tif 2020.tif
+        python cli.py --backend tflite --model best_model.int8.tflite --t1-dir 2019 --t2-dir 2021 --output-dir changes
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+from multiprocessing import shared_memory
+import numpy as np
+from cache import fileIdentity
+from constants import (
+    MODEL_PATH,
+    INFERENCE_BACKEND,
+    INFERENCE_INTRA_OP_THREADS,
+    INFERENCE_INTER_OP_THREADS,
+    INFERENCE_SERVER_SOCKET,
+    QUANTIZATION_MIN_AGREEMENT
+)
+
+
+def outputList(outputs):
+    return list(outputs) if isinstance(outputs, (list, tuple)) else [outputs]
+
+
+def _setTensorFlowThreads(intra_op_threads, inter_op_threads):
+    import tensorflow as tf
+
+    try:
+        if intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError:
+        # the runtime was already initialized, threads can't be changed anymore
+        pass
+
+
+def splitSiameseModel(model):
+    '''
+        Splits a functional Keras model with two inputs into an encoder applied to each picture
+        and a decoder of the pair. Both branches must go through the same (shared) layers
+        until they are merged. Encoder outputs are all tensors of the branch of the first input
+        used by layers depending on both inputs, e.g. features of several levels for skip connections.
+
+        Returns (encoder, decoder), where decoder takes encoder outputs of the first picture
+        followed by encoder outputs of the second one, or (None, None) if the model can't be split
+        or the split model gives different results.
+    '''
+
+    try:
+        import tensorflow as tf
+
+        inputs = model.inputs
+        if len(inputs) != 2:
+            return None, None
+        input_layers = [tensor._keras_history.layer for tensor in inputs]
+
+        # inputs of the model every node depends on, parents go before children
+        depends = {}
+        for depth in sorted(model._nodes_by_depth, reverse=True):
+            for node in model._nodes_by_depth[depth]:
+                if node.is_input:
+                    depends[id(node)] = {input_layers.index(node.layer)}
+                else:
+                    depends[id(node)] = set().union(*(depends[id(parent)] for parent in node.parent_nodes))
+
+        def producer(tensor):
+            layer, node_index, tensor_index = tensor._keras_history
+            return layer, layer._inbound_nodes[node_index], tensor_index
+
+        # tensors of single branches consumed where the branches are merged
+        cut = ([], [])
+        for nodes in model._nodes_by_depth.values():
+            for node in nodes:
+                if depends[id(node)] != {0, 1}:
+                    continue
+                for tensor in tf.nest.flatten(node.keras_inputs):
+                    layer, parent, index = producer(tensor)
+                    branch = depends[id(parent)]
+                    if len(branch) == 1 and not any(tensor is t for t in cut[min(branch)]):
+                        cut[min(branch)].append(tensor)
+
+        def counterpart(tensor):
+            layer, node, index = producer(tensor)
+            if node.is_input:
+                return inputs[1]
+            twins = [twin for twin in layer._inbound_nodes if depends.get(id(twin)) == {1}]
+            if len(twins) != 1:
+                raise ValueError('layer {} is not shared by both branches'.format(layer.name))
+            return tf.nest.flatten(twins[0].outputs)[index]
+
+        encoder_outputs = cut[0]
+        second_outputs = [counterpart(tensor) for tensor in encoder_outputs]
+        if len(second_outputs) != len(cut[1]) or any(all(t is not o for o in second_outputs) for t in cut[1]):
+            return None, None
+        if all(tensor is inputs[0] for tensor in encoder_outputs):
+            # the pictures are merged right away, there is nothing to reuse
+            return None, None
+
+        encoder = tf.keras.Model(inputs[0], encoder_outputs)
+        decoder = tf.keras.Model(encoder_outputs + second_outputs, model.outputs)
+
+        # results must not change, so the split is checked on a random pair
+        shape = [1] + [dim or 64 for dim in inputs[0].shape[1:]]
+        rng = np.random.default_rng(0)
+        t1, t2 = (rng.uniform(0, 255, shape).astype(np.float32) for _ in range(2))
+        expected = np.asarray(model([t1, t2]))
+        actual = np.asarray(decoder(outputList(encoder(t1)) + outputList(encoder(t2))))
+        if not np.allclose(actual, expected, atol=1e-4):
+            return None, None
+        return encoder, decoder
+    except (ImportError, AttributeError, KeyError, IndexError, TypeError, ValueError):
+        return None, None
+
+
+class InferenceBackend:
+    '''
+        Model with two inputs loaded from `path`, called as backend(inputs=[t1_batch, t2_batch]).
+        Threads numbers equal to 0 leave the choice to the runtime.
+    '''
+
+    name = None
+    extension = None
+    # path used instead of MODEL_PATH with the extension
+    default_path = None
+
+    def __init__(self, path, intra_op_threads=0, inter_op_threads=0):
+        self.path = path
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self._load()
+
+    def _load(self):
+        raise NotImplementedError
+
+    def __call__(self, inputs):
+        raise NotImplementedError
+
+    def split(self):
+        '''
+            Returns (encoder, decoder) like splitSiameseModel or (None, None)
+        '''
+
+        return None, None
+
+    @classmethod
+    def modelIdentity(cls, path):
+        '''
+            Returns string which changes whenever the model at `path` changes, without loading it
+        '''
+
+        return cls.name + ':' + fileIdentity(path)
+
+
+class KerasBackend(InferenceBackend):
+
+    name = 'keras'
+    extension = '.h5'
+
+    def _load(self):
+        import tensorflow as tf
+
+        _setTensorFlowThreads(self.intra_op_threads, self.inter_op_threads)
+        self.model = tf.keras.models.load_model(self.path)
+
+    def __call__(self, inputs):
+        return self.model(inputs=inputs)
+
+    def split(self):
+        return splitSiameseModel(self.model)
+
+
+def _quantize(x, detail):
+    if detail['dtype'] in (np.int8, np.uint8):
+        scale, zero_point = detail['quantization']
+        info = np.iinfo(detail['dtype'])
+        return np.clip(np.round(x / scale + zero_point), info.min, info.max).astype(detail['dtype'])
+    return np.asarray(x, dtype=detail['dtype'])
+
+
+def _dequantize(x, detail):
+    if detail['dtype'] in (np.int8, np.uint8):
+        scale, zero_point = detail['quantization']
+        return (x.astype(np.float32) - zero_point) * scale
+    return x
+
+
+class TFLiteBackend(InferenceBackend):
+    '''
+        TFLite interpreter from tflite_runtime if it is installed, otherwise from TensorFlow.
+        Inputs are matched to the Keras inputs by the order of their tensors, in which the converter
+        writes the inputs of the Keras model, not by names (which may sort in another order).
+        The interpreter isn't thread safe, so calls are serialized.
+    '''
+
+    name = 'tflite'
+    extension = '.tflite'
+
+    def _load(self):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.interpreter = Interpreter(model_path=self.path, num_threads=self.intra_op_threads or None)
+        self.interpreter.allocate_tensors()
+        self._lock = threading.Lock()
+        self._updateDetails()
+
+    def _updateDetails(self):
+        self._inputs = sorted(self.interpreter.get_input_details(), key=lambda detail: detail['index'])
+        self._outputs = self.interpreter.get_output_details()
+
+    def __call__(self, inputs):
+        inputs = [np.asarray(x) for x in inputs]
+        with self._lock:
+            resized = False
+            for detail, x in zip(self._inputs, inputs):
+                if tuple(detail['shape']) != x.shape:
+                    self.interpreter.resize_tensor_input(detail['index'], x.shape)
+                    resized = True
+            if resized:
+                self.interpreter.allocate_tensors()
+                self._updateDetails()
+
+            for detail, x in zip(self._inputs, inputs):
+                self.interpreter.set_tensor(detail['index'], _quantize(x, detail))
+            self.interpreter.invoke()
+            outputs = [_dequantize(self.interpreter.get_tensor(detail['index']), detail) for detail in self._outputs]
+        return outputs[0] if len(outputs) == 1 else outputs
+
+
+class OnnxBackend(InferenceBackend):
+
+    name = 'onnx'
+    extension = '.onnx'
+
+    def _load(self):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if self.intra_op_threads:
+            options.intra_op_num_threads = self.intra_op_threads
+        if self.inter_op_threads:
+            options.inter_op_num_threads = self.inter_op_threads
+            options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+        self.session = onnxruntime.InferenceSession(self.path, options, providers=['CPUExecutionProvider'])
+        self._input_names = [node.name for node in self.session.get_inputs()]
+
+    def __call__(self, inputs):
+        feed = {name: np.asarray(x, dtype=np.float32) for name, x in zip(self._input_names, inputs)}
+        outputs = self.session.run(None, feed)
+        return outputs[0] if len(outputs) == 1 else outputs
+
+
+class RemoteBackend(InferenceBackend):
+    '''
+        Client of inference_server.py listening on the Unix socket `path`.
+        Inputs are passed through a shared memory buffer of the client, so one warm model
+        is shared by all processes of the host and their requests are batched together.
+        Thread numbers are set when the server is started.
+    '''
+
+    name = 'remote'
+    default_path = INFERENCE_SERVER_SOCKET
+
+    # socket path -> identity of the model served there, refreshed on every new connection
+    _identities = {}
+
+    def _load(self):
+        from multiprocessing.connection import Client
+
+        self._connection = Client(self.path, family='AF_UNIX')
+        self._lock = threading.Lock()
+        self._buffer = None
+        # the server may have been restarted with another model
+        RemoteBackend._identities[self.path] = self._request(('identity',))
+
+    def _request(self, message):
+        self._connection.send(message)
+        status, value = self._connection.recv()
+        if status != 'ok':
+            raise RuntimeError('inference server: ' + value)
+        return value
+
+    def __call__(self, inputs):
+        inputs = [np.ascontiguousarray(x) for x in inputs]
+        size = sum(x.nbytes for x in inputs)
+        with self._lock:
+            if self._buffer is None or self._buffer.size < size:
+                self._releaseBuffer()
+                self._buffer = shared_memory.SharedMemory(create=True, size=max(1, size))
+
+            layout = []
+            offset = 0
+            for x in inputs:
+                np.ndarray(x.shape, x.dtype, buffer=self._buffer.buf, offset=offset)[...] = x
+                layout.append((x.shape, x.dtype.str, offset))
+                offset += x.nbytes
+            outputs = self._request(('infer', self._buffer.name, layout))
+        return outputs[0] if len(outputs) == 1 else outputs
+
+    def _releaseBuffer(self):
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer.unlink()
+            self._buffer = None
+
+    def close(self):
+        with self._lock:
+            self._releaseBuffer()
+            self._connection.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except (AttributeError, OSError):
+            pass
+
+    @classmethod
+    def modelIdentity(cls, path):
+        '''
+            Asks the server only if no connection to `path` was made yet, not for every cache key
+        '''
+
+        identity = cls._identities.get(path)
+        if identity is None:
+            from multiprocessing.connection import Client
+
+            with Client(path, family='AF_UNIX') as connection:
+                connection.send(('identity',))
+                status, identity = connection.recv()
+            if status != 'ok':
+                raise RuntimeError('inference server: ' + identity)
+            cls._identities[path] = identity
+        return cls.name + ':' + identity
+
+
+BACKENDS = {backend.name: backend for backend in (KerasBackend, TFLiteBackend, OnnxBackend, RemoteBackend)}
+
+# backend used by algorithms, see configure
+_config = {
+    'name': INFERENCE_BACKEND,
+    'path': None,
+    'intra_op_threads': INFERENCE_INTRA_OP_THREADS,
+    'inter_op_threads': INFERENCE_INTER_OP_THREADS,
+}
+
+
+def defaultModelPath(name, quantized=False):
+    '''
+        Returns MODEL_PATH with the extension of the backend, e.g. best_model.int8.tflite,
+        or default_path of the backend, e.g. the socket of the inference server
+    '''
+
+    if BACKENDS[name].default_path is not None:
+        return BACKENDS[name].default_path
+    root = os.path.splitext(MODEL_PATH)[0]
+    return root + ('.int8' if quantized else '') + BACKENDS[name].extension
+
+
+def configure(name=None, path=None, intra_op_threads=None, inter_op_threads=None):
+    '''
+        Chooses the backend loaded by loadBackend, arguments which are None are not changed.
+        Must be called before the first inference in the process.
+    '''
+
+    if name is not None:
+        if name not in BACKENDS:
+            raise ValueError('configure: unknown backend ' + repr(name))
+        _config['name'] = name
+    for key, value in (('path', path), ('intra_op_threads', intra_op_threads), ('inter_op_threads', inter_op_threads)):
+        if value is not None:
+            _config[key] = value
+
+
+def configuredPath():
+    return _config['path'] or defaultModelPath(_config['name'])
+
+
+def configuredIdentity():
+    return BACKENDS[_config['name']].modelIdentity(configuredPath())
+
+
+def loadBackend():
+    return BACKENDS[_config['name']](configuredPath(), _config['intra_op_threads'], _config['inter_op_threads'])
+
+
+def calibrationPairs(paths, size):
+    '''
+        Reads consecutive pictures of `paths` as pairs of uint8 arrays resized to `size` like the pipeline does
+    '''
+
+    from algorithms import readResized
+    from raster import openRaster
+
+    if len(paths) < 2 or len(paths) % 2:
+        raise ValueError('calibrationPairs: even number of pictures is required')
+    pictures = []
+    for path in paths:
+        source = openRaster(path)
+        try:
+            pictures.append(np.array(readResized(source, size).convert('RGB')))
+        finally:
+            source.close()
+    return list(zip(pictures[0::2], pictures[1::2]))
+
+
+def changeMapsAgreement(reference, candidate, pairs):
+    '''
+        Returns (fraction of equal pixels of change maps, max absolute difference of raw outputs)
+        of two models over `pairs`
+    '''
+
+    equal = total = 0
+    max_difference = 0.0
+    for t1, t2 in pairs:
+        inputs = [t1[None].astype(np.float32), t2[None].astype(np.float32)]
+        expected = np.asarray(outputList(reference(inputs=inputs))[0], dtype=np.float32)
+        actual = np.asarray(outputList(candidate(inputs=inputs))[0], dtype=np.float32).reshape(expected.shape)
+        equal += np.count_nonzero(np.round(expected) == np.round(actual))
+        total += expected.size
+        max_difference = max(max_difference, float(np.abs(expected - actual).max()))
+    return equal / total, max_difference
+
+
+def _representativeDataset(pairs):
+    def dataset():
+        for t1, t2 in pairs:
+            yield [t1[None].astype(np.float32), t2[None].astype(np.float32)]
+    return dataset
+
+
+def exportTFLite(model, output_path, calibration=None):
+    '''
+        Converts Keras `model` to TFLite, to int8 if `calibration` pairs are given.
+        Inputs and outputs stay float, so the backend is called the same way.
+    '''
+
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if calibration is not None:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = _representativeDataset(calibration)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+
+
+def exportOnnx(model, output_path, calibration=None):
+    '''
+        Converts Keras `model` to ONNX with float32 inputs, then statically quantizes it
+        to int8 (QDQ format) if `calibration` pairs are given
+    '''
+
+    import tensorflow as tf
+    import tf2onnx
+
+    signature = [tf.TensorSpec((None,) + tuple(x.shape[1:]), tf.float32, name=x.name.split(':')[0])
+                 for x in model.inputs]
+    if calibration is None:
+        tf2onnx.convert.from_keras(model, input_signature=signature, output_path=output_path)
+        return
+
+    from onnxruntime.quantization import quantize_static, CalibrationDataReader, QuantFormat, QuantType
+
+    class PairsReader(CalibrationDataReader):
+
+        def __init__(self, names):
+            self._feeds = iter(
+                {names[0]: t1[None].astype(np.float32), names[1]: t2[None].astype(np.float32)}
+                for t1, t2 in calibration
+            )
+
+        def get_next(self):
+            return next(self._feeds, None)
+
+    with tempfile.TemporaryDirectory() as directory:
+        float_path = os.path.join(directory, 'float.onnx')
+        onnx_model, _ = tf2onnx.convert.from_keras(model, input_signature=signature, output_path=float_path)
+        names = [node.name for node in onnx_model.graph.input]
+        quantize_static(float_path, output_path, PairsReader(names), quant_format=QuantFormat.QDQ,
+                        activation_type=QuantType.QInt8, weight_type=QuantType.QInt8)
+
+
+EXPORTERS = {'tflite': exportTFLite, 'onnx': exportOnnx}
+
+
+def exportModel(name, output_path=None, calibration=None, quantize=False,
+                min_agreement=QUANTIZATION_MIN_AGREEMENT):
+    '''
+        Exports MODEL_PATH for backend `name` and returns (path, agreement) where agreement
+        of change maps with the Keras model is measured on `calibration` pairs (None without them).
+        A quantized model is removed and ValueError is raised if the agreement is below `min_agreement`.
+    '''
+
+    if name not in EXPORTERS:
+        raise ValueError('exportModel: cannot export to ' + repr(name))
+    if quantize and not calibration:
+        raise ValueError('exportModel: quantization requires calibration pairs')
+
+    output_path = output_path or defaultModelPath(name, quantize)
+    keras_backend = KerasBackend(MODEL_PATH)
+    EXPORTERS[name](keras_backend.model, output_path, calibration if quantize else None)
+    if not calibration:
+        return output_path, None
+
+    agreement, max_difference = changeMapsAgreement(keras_backend, BACKENDS[name](output_path), calibration)
+    if quantize and agreement < min_agreement:
+        os.remove(output_path)
+        raise ValueError('exportModel: change maps of the quantized model agree with the float model '
+                         'in {:.2%} of pixels, required {:.2%}'.format(agreement, min_agreement))
+    return output_path, agreement
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export ' + MODEL_PATH + ' for CPU inference backends.')
+    parser.add_argument('--format', choices=sorted(EXPORTERS), required=True)
+    parser.add_argument('--output', help='exported model (default: next to ' + MODEL_PATH + ')')
+    parser.add_argument('--quantize', action='store_true', help='quantize weights and activations to int8')
+    parser.add_argument('--calibration', nargs='+', metavar='PICTURE',
+                        help='pairs of pictures (t1 t2 t1 t2 ...) to calibrate and validate the exported model')
+    parser.add_argument('--min-agreement', type=float, default=QUANTIZATION_MIN_AGREEMENT,
+                        help='required fraction of equal pixels of change maps of the quantized and float models')
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    if args.quantize and not args.calibration:
+        parser.error('--quantize requires --calibration')
+
+    calibration = None
+    if args.calibration:
+        from algorithms import DeepLearning
+        calibration = calibrationPairs(args.calibration, DeepLearning().getInputSize())
+
+    try:
+        path, agreement = exportModel(args.format, args.output, calibration, args.quantize, args.min_agreement)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    print('exported ' + path, file=sys.stderr)
+    if agreement is not None:
+        print('change maps agree with the Keras model in {:.2%} of pixels'.format(agreement), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+import threading
+import time
+import numpy as np
+from profiling import span
+from constants import BATCH_MEMORY_BUDGET, BATCH_MAX_SIZE, BATCH_ACTIVATION_FACTOR
+
+
+class BatchStats:
+    '''
+        Thread safe counters of processed pairs and time spent in batched model calls
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pairs = 0
+        self.batches = 0
+        self.seconds = 0.0
+
+    def add(self, pairs, seconds):
+        with self._lock:
+            self.pairs += pairs
+            self.batches += 1
+            self.seconds += seconds
+
+    def pairsPerSecond(self):
+        with self._lock:
+            return self.pairs / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self):
+        return '{} pairs in {} batches, {:.2f} pairs/sec'.format(self.pairs, self.batches, self.pairsPerSecond())
+
+
+def batchSizeForBudget(t1, memory_budget=BATCH_MEMORY_BUDGET, max_batch_size=BATCH_MAX_SIZE):
+    '''
+        Returns how many pairs of arrays shaped like `t1` fit into `memory_budget` bytes,
+        counting float32 copies of both inputs and model activations.
+        `t1` may be a list of arrays (features of a picture).
+    '''
+
+    size = sum(x.size for x in t1) if isinstance(t1, list) else t1.size
+    pair_bytes = 2 * size * np.dtype(np.float32).itemsize * BATCH_ACTIVATION_FACTOR
+    return int(max(1, min(max_batch_size, memory_budget // pair_bytes)))
+
+
+def stackBatch(items):
+    '''
+        Stacks arrays along a new first axis, lists of arrays are stacked element-wise
+    '''
+
+    if isinstance(items[0], list):
+        return [np.stack(parts) for parts in zip(*items)]
+    return np.stack(items)
+
+
+class BatchRunner:
+    '''
+        Gathers (t1, t2) pairs into batches and runs `method` on them,
+        `algo.performBatchImpl` by default.
+
+        If `batch_size` is None, it is chosen by batchSizeForBudget from the first pair.
+        All pairs in a batch must have the same shape.
+    '''
+
+    def __init__(self, algo, batch_size=None, memory_budget=BATCH_MEMORY_BUDGET, stats=None, method=None):
+        self.algo = algo
+        self.batch_size = batch_size
+        self.memory_budget = memory_budget
+        self.stats = stats if stats is not None else BatchStats()
+        self.method = method if method is not None else algo.performBatchImpl
+
+    def map(self, items):
+        '''
+            `items` - iterable of (key, t1, t2).
+            Yields (key, result) in the same order, pulling at most one batch ahead of the caller.
+        '''
+
+        keys, t1_batch, t2_batch = [], [], []
+        for key, t1, t2 in items:
+            if self.batch_size is None:
+                self.batch_size = batchSizeForBudget(t1, self.memory_budget)
+
+            keys.append(key)
+            t1_batch.append(t1)
+            t2_batch.append(t2)
+
+            if len(keys) == self.batch_size:
+                yield from zip(keys, self.run(t1_batch, t2_batch))
+                keys, t1_batch, t2_batch = [], [], []
+
+        if keys:
+            yield from zip(keys, self.run(t1_batch, t2_batch))
+
+    def run(self, t1_batch, t2_batch):
+        '''
+            Runs `method` on lists of arrays of one batch, returns list of results
+        '''
+
+        start = time.perf_counter()
+        with span('inference'):
+            results = self.method(stackBatch(t1_batch), stackBatch(t2_batch))
+        self.stats.add(len(t1_batch), time.perf_counter() - start)
+        return list(results)
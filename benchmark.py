@@ -0,0 +1,289 @@
+'''
+    Benchmarks of the detection pipeline with a deterministic stand-in for the CNN,
+    so neither TensorFlow nor best_model.h5 is needed.
+
+    Each stage of performAlgorithm (decode, resize of both pictures, performImpl, upsample)
+    is timed separately for every scene size, then the tiled mode for every tile size
+    and the batch CLI for every number of workers. Results are written as JSON;
+    with --compare, stages which got slower than in the previous results are reported.
+    With --backends, one call of the real model is timed for every exported format
+    and number of threads (see backends.py).
+
+    Example:
+        python benchmark.py --sizes 1024 4096 --tile-sizes 256 512 --workers 1 4 --output bench.json
+        python benchmark.py --backends keras tflite onnx --threads 1 2 4 --sizes --tile-sizes --workers
+'''
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+from PIL import Image
+import PIL
+
+OUTPUT_SIZE = 32
+REGRESSION_THRESHOLD = 1.2
+
+
+class StubModel:
+    '''
+        Deterministic stand-in for the CNN with the same inputs and outputs:
+        mean absolute difference of the pair pooled to OUTPUT_SIZE x OUTPUT_SIZE and thresholded
+    '''
+
+    def __call__(self, inputs):
+        t1, t2 = (np.asarray(x, dtype=np.float32) for x in inputs)
+        diff = np.abs(t1 - t2)
+        if diff.ndim == 4:
+            diff = diff.mean(axis=3)
+        n, h, w = diff.shape
+        diff = diff[:, :h - h % OUTPUT_SIZE, :w - w % OUTPUT_SIZE]
+        pooled = diff.reshape(n, OUTPUT_SIZE, h // OUTPUT_SIZE, OUTPUT_SIZE, w // OUTPUT_SIZE).mean(axis=(2, 4))
+        return (pooled > 16).astype(np.float32).reshape(n, OUTPUT_SIZE * OUTPUT_SIZE)
+
+
+def installStubModel():
+    import algorithms
+    algorithms.setSnatchedModel(StubModel())
+
+
+def makeScenePair(directory, size, seed=0):
+    '''
+        Writes a pair of synthetic RGB scenes of `size` x `size` with a few changed rectangles
+    '''
+
+    rng = np.random.default_rng(seed)
+    t1 = rng.integers(0, 128, (size, size, 3), dtype=np.uint8)
+    t2 = t1.copy()
+    for _ in range(8):
+        x, y = rng.integers(0, size, 2)
+        w, h = rng.integers(size // 32, size // 8, 2)
+        t2[y:y + h, x:x + w] = rng.integers(128, 256, 3)
+
+    paths = []
+    for name, arr in (('t1', t1), ('t2', t2)):
+        path = os.path.join(directory, '{}_{}.png'.format(name, size))
+        Image.fromarray(arr).save(path, compress_level=1)
+        paths.append(path)
+    return paths
+
+
+def timeIt(func, repeat):
+    '''
+        Returns (times in seconds, result of the last call)
+    '''
+
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return times, result
+
+
+def record(results, stage, times, **params):
+    entry = dict(params, stage=stage, min=min(times), median=statistics.median(times), repeat=len(times))
+    results.append(entry)
+    print('{:<12} {:<40} min {:8.4f} s  median {:8.4f} s'.format(
+        stage, ' '.join('{}={}'.format(k, v) for k, v in params.items()), entry['min'], entry['median']),
+        file=sys.stderr)
+
+
+def benchStages(results, algo, t1_path, t2_path, size, repeat):
+    from algorithms import readResized, upsampleResult
+    from raster import openRaster
+    from resampling import QUALITIES
+
+    def decode():
+        t1_source, t2_source = openRaster(t1_path), openRaster(t2_path)
+        t1_source.readImage()
+        t2_source.readImage()
+        return t1_source, t2_source
+
+    times, (t1_source, t2_source) = timeIt(decode, repeat)
+    record(results, 'decode', times, size=size)
+
+    # from the file, so decoding at reduced resolution is measured too
+    jpeg_path = os.path.splitext(t1_path)[0] + '.jpg'
+    t1_source.readImage().save(jpeg_path, quality=90)
+    for path in (t1_path, jpeg_path):
+        for quality in QUALITIES:
+            times, _ = timeIt(lambda: readResized(openRaster(path), algo.getInputSize(), quality), repeat)
+            record(results, 'resize', times, size=size, format=os.path.splitext(path)[1][1:], quality=quality)
+
+    times, t1_arr = timeIt(lambda: np.array(readResized(t1_source, algo.getInputSize())), repeat)
+    record(results, 'resize_t1', times, size=size)
+    times, t2_arr = timeIt(lambda: np.array(readResized(t2_source, algo.getInputSize())), repeat)
+    record(results, 'resize_t2', times, size=size)
+
+    times, algo_result = timeIt(lambda: algo.performImpl(t1_arr, t2_arr), repeat)
+    record(results, 'performImpl', times, size=size)
+
+    times, _ = timeIt(lambda: upsampleResult(algo_result, (size, size)), repeat)
+    record(results, 'upsample', times, size=size)
+
+
+def benchTiled(results, algo, t1_path, t2_path, size, tile_size, repeat):
+    from algorithms import performAlgorithmTiled, pipeline_stats
+    from raster import openRaster
+
+    overlap = tile_size // 8
+    pipeline_stats.reset()
+    times, _ = timeIt(
+        lambda: performAlgorithmTiled(algo, openRaster(t1_path), openRaster(t2_path), tile_size, overlap), repeat
+    )
+    record(results, 'tiled', times, size=size, tile_size=tile_size)
+    # wall-clock time of the pipeline should be close to the busiest stage
+    print('{:<12} {}'.format('', pipeline_stats), file=sys.stderr)
+
+
+def benchWorkers(results, algorithm_name, t1_path, t2_path, size, workers, pairs, repeat):
+    '''
+        Times processing of `pairs` copies of the pair by the CLI worker function on `workers` processes
+    '''
+
+    from cli import processPair
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=installStubModel) as executor:
+            # warm up worker processes, so their start-up isn't measured
+            list(executor.map(_noop, range(workers)))
+
+            def run():
+                futures = [
+                    executor.submit(processPair, algorithm_name, t1_path, t2_path,
+                                    os.path.join(output_dir, '{}.png'.format(i)), False, 0, 0, None, None)
+                    for i in range(pairs)
+                ]
+                for future in futures:
+                    future.result()
+
+            times, _ = timeIt(run, repeat)
+    record(results, 'workers', times, size=size, workers=workers, pairs=pairs)
+
+
+def benchBackends(results, names, threads, repeat):
+    '''
+        Times the model on a pair of the input size for every backend, float and int8 model
+        and number of intra-op threads. Models which weren't exported are skipped.
+        TensorFlow takes the number of threads only once per process, so for keras it is the first one.
+    '''
+
+    import backends
+    from algorithms import DeepLearning
+
+    width, height = DeepLearning().getInputSize()
+    rng = np.random.default_rng(0)
+    inputs = [rng.integers(0, 256, (1, height, width, 3)).astype(np.float32) for _ in range(2)]
+    for name in names:
+        for quantized in (False, True):
+            if quantized and backends.BACKENDS[name].default_path is not None:
+                continue
+            path = backends.defaultModelPath(name, quantized)
+            if not os.path.exists(path):
+                continue
+            for count in threads:
+                backend = backends.BACKENDS[name](path, count, 0)
+                # the first call allocates buffers
+                backend(inputs=inputs)
+                times, _ = timeIt(lambda: backend(inputs=inputs), repeat)
+                record(results, 'backend', times, backend=name, quantized=quantized, threads=count)
+
+
+def _noop(_):
+    return None
+
+
+def gitRevision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous_path):
+    '''
+        Prints stages whose min time grew more than REGRESSION_THRESHOLD times, returns their number
+    '''
+
+    with open(previous_path) as f:
+        previous = json.load(f)
+
+    def key(entry):
+        return tuple(sorted((k, v) for k, v in entry.items() if k not in ('min', 'median', 'repeat')))
+
+    old = {key(entry): entry for entry in previous['results']}
+    regressions = 0
+    for entry in results:
+        before = old.get(key(entry))
+        if before is not None and entry['min'] > before['min'] * REGRESSION_THRESHOLD:
+            regressions += 1
+            print('REGRESSION {}: {:.4f} s -> {:.4f} s'.format(dict(key(entry)), before['min'], entry['min']),
+                  file=sys.stderr)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the change detection pipeline with a stub model.')
+    parser.add_argument('--sizes', type=int, nargs='*', default=[1024, 2048, 4096])
+    parser.add_argument('--tile-sizes', type=int, nargs='*', default=[256, 512])
+    parser.add_argument('--workers', type=int, nargs='*', default=[1, 2, 4])
+    parser.add_argument('--pairs', type=int, default=4, help='pairs processed in the workers benchmark')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--algorithm', default='CNN Algorithm')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='previous results to check for regressions')
+    parser.add_argument('--backends', nargs='+', default=[], help='inference backends to time with the real model')
+    parser.add_argument('--threads', type=int, nargs='+', default=[0], help='intra-op threads of backends, 0 - default')
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    installStubModel()
+    from algorithms import algorithms
+    algo = algorithms[args.algorithm]
+
+    results = []
+    benchBackends(results, args.backends, args.threads, args.repeat)
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            t1_path, t2_path = makeScenePair(directory, size)
+            if algo.getInputSize() is not None:
+                benchStages(results, algo, t1_path, t2_path, size, args.repeat)
+            for tile_size in args.tile_sizes:
+                benchTiled(results, algo, t1_path, t2_path, size, tile_size, args.repeat)
+            for workers in args.workers:
+                benchWorkers(results, args.algorithm, t1_path, t2_path, size, workers, args.pairs, args.repeat)
+
+    report = {
+        'revision': gitRevision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pillow': PIL.__version__,
+        'cpu_count': os.cpu_count(),
+        'algorithm': args.algorithm,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('results written to ' + args.output, file=sys.stderr)
+
+    if args.compare:
+        return 1 if compare(results, args.compare) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,321 @@
+import hashlib
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from collections.abc import Hashable
+import numpy as np
+from PIL import Image
+from raster import PackedMaskRasterSource, ThresholdRasterSource, isBinaryMask
+from constants import (
+    RESULT_CACHE_MEMORY_BUDGET,
+    RESULT_CACHE_DISK_BUDGET,
+    RESULT_CACHE_DIR,
+    FEATURE_CACHE_MEMORY_BUDGET
+)
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# results are change probabilities * 255, entries of older versions held thresholded masks
+RESULT_FORMAT = 'probabilities'
+
+_digests = weakref.WeakKeyDictionary()
+_file_digests = {}
+_digests_lock = threading.Lock()
+
+
+def fileIdentity(path):
+    '''
+        Cheap identity of a file which changes when the file is rewritten
+    '''
+
+    stat = os.stat(path)
+    return '{}:{}:{}'.format(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def fileDigest(path):
+    '''
+        sha256 of the file content, memoized while the file isn't modified
+    '''
+
+    identity = fileIdentity(path)
+    with _digests_lock:
+        if identity in _file_digests:
+            return _file_digests[identity]
+
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            h.update(block)
+    digest = h.hexdigest()
+
+    with _digests_lock:
+        _file_digests[identity] = digest
+    return digest
+
+
+def sourceDigest(source):
+    '''
+        Content hash of a RasterSource or PIL image: hash of the file if the raster
+        was opened from a file, hash of the pixels otherwise. Memoized per RasterSource,
+        PIL images aren't hashable, so pixels of in-memory ones are hashed on every call.
+        Pixels of a ThresholdRasterSource change with its threshold, so its hash is made
+        of the hash of its probability map and the current threshold.
+    '''
+
+    if isinstance(source, ThresholdRasterSource):
+        return hashlib.sha256('{}:{!r}'.format(sourceDigest(source.source), source.threshold).encode()).hexdigest()
+
+    memoized = isinstance(source, Hashable)
+    if memoized:
+        with _digests_lock:
+            if source in _digests:
+                return _digests[source]
+
+    path = getattr(source, 'path', None) or getattr(source, 'filename', None)
+    if path:
+        digest = fileDigest(path)
+    else:
+        image = source.readImage() if hasattr(source, 'readImage') else source
+        h = hashlib.sha256()
+        h.update('{}:{}:{}'.format(image.mode, image.width, image.height).encode())
+        h.update(image.tobytes())
+        digest = h.hexdigest()
+
+    if memoized:
+        with _digests_lock:
+            _digests[source] = digest
+    return digest
+
+
+class CacheStats:
+
+    def __init__(self):
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def hits(self):
+        return self.memory_hits + self.disk_hits
+
+    def __str__(self):
+        return '{} hits ({} memory, {} disk), {} misses'.format(self.hits(), self.memory_hits, self.disk_hits,
+                                                                self.misses)
+
+
+class ResultCache:
+    '''
+        Two-tier cache of algorithm results keyed by content of both inputs,
+        the algorithm identity (including its model file) and run parameters.
+
+        Memory tier keeps up to `memory_budget` bytes of arrays in LRU order,
+        0/255 masks are kept bit-packed.
+        Disk tier keeps up to `disk_budget` bytes of PNG files in `disk_dir`,
+        the least recently used files (by mtime) are removed first.
+        If `disk_dir` is None, only memory tier is used.
+    '''
+
+    def __init__(self, memory_budget=RESULT_CACHE_MEMORY_BUDGET, disk_dir=RESULT_CACHE_DIR,
+                 disk_budget=RESULT_CACHE_DISK_BUDGET):
+        self.memory_budget = memory_budget
+        self.disk_dir = disk_dir
+        self.disk_budget = disk_budget
+        self.stats = CacheStats()
+
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+
+    def key(self, func, algo, t1_pic, t2_pic, *args, **kwargs):
+        h = hashlib.sha256()
+        for part in (RESULT_FORMAT, func.__name__, algo.getIdentity(), algo.getResamplingQuality(),
+                     sourceDigest(t1_pic), sourceDigest(t2_pic),
+                     repr(args), repr(sorted(kwargs.items()))):
+            h.update(part.encode())
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.stats.memory_hits += 1
+        if isinstance(entry, PackedMaskRasterSource):
+            return entry.readImage()
+        if entry is not None:
+            return Image.fromarray(entry.copy())
+
+        path = self._diskPath(key)
+        if path is not None and os.path.exists(path):
+            try:
+                with Image.open(path) as image:
+                    arr = np.array(image.convert('L') if image.mode == '1' else image)
+                os.utime(path)
+            except OSError:
+                arr = None
+            if arr is not None:
+                with self._lock:
+                    self.stats.disk_hits += 1
+                self._putMemory(key, arr)
+                return Image.fromarray(arr.copy())
+
+        with self._lock:
+            self.stats.misses += 1
+        return None
+
+    def put(self, key, image):
+        arr = np.array(image)
+        entry = PackedMaskRasterSource.fromArray(arr) if isBinaryMask(arr) else arr
+        self._putMemory(key, entry)
+
+        path = self._diskPath(key)
+        if path is not None and entry.nbytes <= self.disk_budget:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            tmp_path = path + '.part'
+            if isinstance(entry, PackedMaskRasterSource):
+                # 1-bit PNG, rows of mode '1' are packed like numpy.packbits
+                picture = Image.frombytes('1', entry.size, entry.bits.tobytes())
+            else:
+                picture = Image.fromarray(arr)
+            picture.save(tmp_path, format='PNG', compress_level=1)
+            os.replace(tmp_path, path)
+            self._evictDisk()
+
+    def perform(self, func, algo, t1_pic, t2_pic, *args, progress=None, is_cancelled=None, **kwargs):
+        '''
+            Returns func(algo, t1_pic, t2_pic, *args, **kwargs) from the cache
+            or calls it and stores the result
+        '''
+
+        key = self.key(func, algo, t1_pic, t2_pic, *args, **kwargs)
+        result = self.get(key)
+        if result is not None:
+            if progress is not None:
+                progress(1, 1)
+            return result
+
+        result = func(algo, t1_pic, t2_pic, *args, progress=progress, is_cancelled=is_cancelled, **kwargs)
+        self.put(key, result)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+        if self.disk_dir is not None and os.path.isdir(self.disk_dir):
+            for name in os.listdir(self.disk_dir):
+                if name.endswith('.png'):
+                    os.remove(os.path.join(self.disk_dir, name))
+
+    def _diskPath(self, key):
+        return None if self.disk_dir is None else os.path.join(self.disk_dir, key + '.png')
+
+    def _putMemory(self, key, arr):
+        if isinstance(arr, np.ndarray) and isBinaryMask(arr):
+            arr = PackedMaskRasterSource.fromArray(arr)
+        if arr.nbytes > self.memory_budget:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_size -= self._memory.pop(key).nbytes
+            self._memory[key] = arr
+            self._memory_size += arr.nbytes
+            while self._memory_size > self.memory_budget:
+                self._memory_size -= self._memory.popitem(last=False)[1].nbytes
+
+    def _evictDisk(self):
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if name.endswith('.png'):
+                stat = os.stat(os.path.join(self.disk_dir, name))
+                files.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for mtime, size, name in files)
+        for mtime, size, name in sorted(files):
+            if total <= self.disk_budget:
+                break
+            try:
+                os.remove(os.path.join(self.disk_dir, name))
+            except OSError:
+                pass
+            total -= size
+
+
+class FeatureCache:
+    '''
+        Memory cache of per-picture features (lists of arrays) in LRU order,
+        keyed by content of the picture and the algorithm identity.
+        Keeps up to `memory_budget` bytes.
+    '''
+
+    def __init__(self, memory_budget=FEATURE_CACHE_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.stats = CacheStats()
+
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        # events of keys being computed by getOrCompute
+        self._pending = {}
+
+    def key(self, algo, pic):
+        return '{}:{}:{}:{}'.format(algo.getIdentity(), algo.getInputSize(), algo.getResamplingQuality(),
+                                    sourceDigest(pic))
+
+    def get(self, key):
+        with self._lock:
+            features = self._memory.get(key)
+            if features is None:
+                self.stats.misses += 1
+            else:
+                self._memory.move_to_end(key)
+                self.stats.memory_hits += 1
+            return features
+
+    def getOrCompute(self, key, compute):
+        '''
+            Returns features of `key`, calling `compute()` on a miss and storing its result.
+            Concurrent calls with the same key wait for one computation instead of repeating it.
+        '''
+
+        while True:
+            with self._lock:
+                features = self._memory.get(key)
+                if features is not None:
+                    self._memory.move_to_end(key)
+                    self.stats.memory_hits += 1
+                    return features
+                pending = self._pending.get(key)
+                if pending is None:
+                    self.stats.misses += 1
+                    pending = self._pending[key] = threading.Event()
+                    break
+            # if the result is too large to be kept, or its computation failed, it is computed here again
+            pending.wait()
+
+        try:
+            features = compute()
+            self.put(key, features)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+        return features
+
+    def put(self, key, features):
+        nbytes = sum(x.nbytes for x in features)
+        if nbytes > self.memory_budget:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_size -= sum(x.nbytes for x in self._memory.pop(key))
+            self._memory[key] = features
+            self._memory_size += nbytes
+            while self._memory_size > self.memory_budget:
+                self._memory_size -= sum(x.nbytes for x in self._memory.popitem(last=False)[1])
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
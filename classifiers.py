@@ -0,0 +1,339 @@
+'''
+    Per-pixel change classifiers implemented with NumPy.
+
+    Features of a pixel are its bands at both dates and their absolute difference, scaled to [0, 1].
+    Every classifier has fit(features, labels), predict(features) returning change probabilities
+    in [0, 1], and save/load to .npz files. Prediction is vectorized over chunks of pixels.
+'''
+
+import numpy as np
+from constants import CLASSIFIER_CHUNK_PIXELS
+
+
+def pixelFeatures(t1, t2):
+    '''
+        Returns float32 array (pixels, features) for a pair of uint8 arrays of the same shape
+    '''
+
+    if t1.shape != t2.shape:
+        raise ValueError('pixelFeatures: shapes of pictures differ: {} and {}'.format(t1.shape, t2.shape))
+    t1 = t1.reshape(-1, 1 if t1.ndim == 2 else t1.shape[-1]).astype(np.float32) / 255
+    t2 = t2.reshape(t1.shape).astype(np.float32) / 255
+    return np.concatenate([t1, t2, np.abs(t1 - t2)], axis=1)
+
+
+def otsuThreshold(values, bins=256):
+    hist, edges = np.histogram(values, bins=bins)
+    hist = hist.astype(np.float64)
+    centers = (edges[:-1] + edges[1:]) / 2
+
+    w0 = np.cumsum(hist)
+    w1 = w0[-1] - w0
+    m0 = np.cumsum(hist * centers) / np.maximum(w0, 1)
+    m1 = ((hist * centers).sum() - np.cumsum(hist * centers)) / np.maximum(w1, 1)
+    return centers[np.argmax(w0 * w1 * (m0 - m1) ** 2)]
+
+
+def pseudoLabels(features, bands):
+    '''
+        Labels pixels by change vector analysis: the magnitude of the difference
+        of all bands is thresholded by Otsu's method. Used to train classifiers
+        on the pair itself when there is no pretrained model.
+    '''
+
+    magnitude = np.linalg.norm(features[:, 2 * bands:], axis=1)
+    return (magnitude > otsuThreshold(magnitude)).astype(np.int8)
+
+
+def balancedSample(labels, count, rng):
+    '''
+        Returns indices of up to `count` samples, half of them of each class when possible
+    '''
+
+    indices = []
+    for label in (0, 1):
+        candidates = np.flatnonzero(labels == label)
+        n = min(len(candidates), count // 2)
+        indices.append(rng.choice(candidates, n, replace=False))
+    return np.concatenate(indices)
+
+
+def _chunks(n):
+    for start in range(0, n, CLASSIFIER_CHUNK_PIXELS):
+        yield slice(start, min(start + CLASSIFIER_CHUNK_PIXELS, n))
+
+
+class PixelClassifier:
+
+    kind = None
+
+    def fit(self, features, labels):
+        raise NotImplementedError
+
+    def predict(self, features):
+        '''
+            Returns float32 change probabilities for rows of `features`
+        '''
+
+        result = np.empty(len(features), dtype=np.float32)
+        for chunk in _chunks(len(features)):
+            result[chunk] = self._predictChunk(features[chunk])
+        return result
+
+    def _predictChunk(self, features):
+        raise NotImplementedError
+
+    def params(self):
+        raise NotImplementedError
+
+    def setParams(self, params):
+        raise NotImplementedError
+
+    def save(self, path):
+        np.savez(path, kind=self.kind, **self.params())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if str(data['kind']) != cls.kind:
+                raise ValueError('{}.load: {} contains {} model'.format(cls.__name__, path, data['kind']))
+            classifier = cls()
+            classifier.setParams({key: data[key] for key in data.files if key != 'kind'})
+        return classifier
+
+
+class LinearSVM(PixelClassifier):
+    '''
+        Linear SVM trained by Pegasos (stochastic subgradient descent on hinge loss)
+        on standardized features
+    '''
+
+    kind = 'linear_svm'
+
+    def __init__(self, regularization=1e-3, epochs=20, batch_size=256, seed=0):
+        self.regularization = regularization
+        self.epochs = epochs
+        self.batch_size = batch_size
+        self.seed = seed
+
+    def fit(self, features, labels):
+        rng = np.random.default_rng(self.seed)
+        self.mean = features.mean(axis=0)
+        self.std = features.std(axis=0) + 1e-6
+        x = (features - self.mean) / self.std
+        y = np.where(labels > 0, 1.0, -1.0).astype(np.float32)
+
+        w = np.zeros(x.shape[1], dtype=np.float32)
+        b = 0.0
+        w_avg = np.zeros_like(w)
+        b_avg = 0.0
+        step = 0
+        for epoch in range(self.epochs):
+            order = rng.permutation(len(x))
+            for start in range(0, len(x), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                step += 1
+                eta = 1 / (self.regularization * (step + 1 / self.regularization))
+                violated = y[batch] * (x[batch] @ w + b) < 1
+                yv = y[batch][violated]
+                w = (1 - eta * self.regularization) * w + eta * (yv @ x[batch][violated]) / len(batch)
+                b += eta * yv.sum() / len(batch)
+                # averaging of iterates makes the result stable
+                w_avg += (w - w_avg) / step
+                b_avg += (b - b_avg) / step
+
+        self.weights = w_avg
+        self.bias = np.float32(b_avg)
+        return self
+
+    def _predictChunk(self, features):
+        decision = ((features - self.mean) / self.std) @ self.weights + self.bias
+        return 1 / (1 + np.exp(-2 * decision))
+
+    def params(self):
+        return {'mean': self.mean, 'std': self.std, 'weights': self.weights, 'bias': self.bias}
+
+    def setParams(self, params):
+        self.mean, self.std = params['mean'], params['std']
+        self.weights, self.bias = params['weights'], params['bias']
+
+
+class DecisionTree(PixelClassifier):
+    '''
+        CART tree with Gini impurity. Split thresholds are searched among
+        `thresholds` quantiles of each feature. The tree is stored in flat arrays,
+        so prediction descends all pixels of a chunk at once.
+    '''
+
+    kind = 'decision_tree'
+
+    def __init__(self, max_depth=8, min_samples_leaf=20, thresholds=32):
+        self.max_depth = max_depth
+        self.min_samples_leaf = min_samples_leaf
+        self.thresholds = thresholds
+
+    def fit(self, features, labels):
+        self._feature, self._threshold, self._left, self._right, self._value = [], [], [], [], []
+        self._build(features, labels.astype(np.float32), 0)
+
+        self.feature = np.array(self._feature, dtype=np.int32)
+        self.threshold = np.array(self._threshold, dtype=np.float32)
+        self.left = np.array(self._left, dtype=np.int32)
+        self.right = np.array(self._right, dtype=np.int32)
+        self.value = np.array(self._value, dtype=np.float32)
+        del self._feature, self._threshold, self._left, self._right, self._value
+        return self
+
+    def _addNode(self, value):
+        self._feature.append(-1)
+        self._threshold.append(0.0)
+        self._left.append(-1)
+        self._right.append(-1)
+        self._value.append(value)
+        return len(self._value) - 1
+
+    def _build(self, x, y, depth):
+        node = self._addNode(y.mean() if len(y) else 0.0)
+        if depth >= self.max_depth or len(y) < 2 * self.min_samples_leaf or y.min() == y.max():
+            return node
+
+        split = self._bestSplit(x, y)
+        if split is None:
+            return node
+
+        feature, threshold = split
+        mask = x[:, feature] <= threshold
+        self._feature[node] = feature
+        self._threshold[node] = threshold
+        self._left[node] = self._build(x[mask], y[mask], depth + 1)
+        self._right[node] = self._build(x[~mask], y[~mask], depth + 1)
+        return node
+
+    def _bestSplit(self, x, y):
+        n = len(y)
+        best = None
+        best_impurity = None
+        for feature in range(x.shape[1]):
+            thresholds = np.unique(np.quantile(x[:, feature], np.linspace(0, 1, self.thresholds + 2)[1:-1]))
+            left = x[:, feature, None] <= thresholds
+            n_left = left.sum(axis=0)
+            n_right = n - n_left
+            valid = (n_left >= self.min_samples_leaf) & (n_right >= self.min_samples_leaf)
+            if not valid.any():
+                continue
+
+            pos_left = y @ left
+            pos_right = y.sum() - pos_left
+            p_left = pos_left / np.maximum(n_left, 1)
+            p_right = pos_right / np.maximum(n_right, 1)
+            # weighted Gini impurity of both children
+            impurity = n_left * p_left * (1 - p_left) + n_right * p_right * (1 - p_right)
+            impurity[~valid] = np.inf
+
+            i = np.argmin(impurity)
+            if best_impurity is None or impurity[i] < best_impurity:
+                best_impurity = impurity[i]
+                best = (feature, float(thresholds[i]))
+        return best
+
+    def _predictChunk(self, features):
+        node = np.zeros(len(features), dtype=np.int32)
+        for _ in range(self.depth()):
+            inner = self.feature[node] >= 0
+            if not inner.any():
+                break
+            idx = np.flatnonzero(inner)
+            n = node[idx]
+            go_left = features[idx, self.feature[n]] <= self.threshold[n]
+            node[idx] = np.where(go_left, self.left[n], self.right[n])
+        return self.value[node]
+
+    def depth(self):
+        depths = np.zeros(len(self.feature), dtype=np.int32)
+        for node in range(len(self.feature)):
+            for child in (self.left[node], self.right[node]):
+                if child >= 0:
+                    depths[child] = depths[node] + 1
+        return int(depths.max()) if len(depths) else 0
+
+    def params(self):
+        return {'feature': self.feature, 'threshold': self.threshold, 'left': self.left,
+                'right': self.right, 'value': self.value}
+
+    def setParams(self, params):
+        for key in ('feature', 'threshold', 'left', 'right', 'value'):
+            setattr(self, key, params[key])
+
+
+class FuzzyARTMAP(PixelClassifier):
+    '''
+        Simplified Fuzzy ARTMAP with complement coding, fast learning and match tracking.
+        Prediction picks the category with the highest choice function for all pixels of a chunk at once.
+    '''
+
+    kind = 'fuzzy_artmap'
+
+    def __init__(self, vigilance=0.5, alpha=0.001, beta=1.0, max_categories=500, seed=0):
+        self.vigilance = vigilance
+        self.alpha = alpha
+        self.beta = beta
+        self.max_categories = max_categories
+        self.seed = seed
+
+    @staticmethod
+    def _complementCode(features):
+        features = np.clip(features, 0, 1)
+        return np.concatenate([features, 1 - features], axis=1)
+
+    def fit(self, features, labels):
+        rng = np.random.default_rng(self.seed)
+        inputs = self._complementCode(features)
+        dims = features.shape[1]
+
+        weights = np.empty((0, inputs.shape[1]), dtype=np.float32)
+        categories = []
+        for i in rng.permutation(len(inputs)):
+            x, label = inputs[i], labels[i]
+            resonance = False
+            if categories:
+                overlap = np.minimum(x, weights).sum(axis=1)
+                choice = overlap / (self.alpha + weights.sum(axis=1))
+                vigilance = self.vigilance
+                for j in np.argsort(-choice):
+                    match = overlap[j] / dims
+                    if match < vigilance:
+                        continue
+                    if categories[j] == label:
+                        weights[j] = self.beta * np.minimum(x, weights[j]) + (1 - self.beta) * weights[j]
+                        resonance = True
+                        break
+                    # match tracking: raise vigilance just above the category of the wrong class
+                    vigilance = match + 1e-6
+
+            if not resonance and len(categories) < self.max_categories:
+                weights = np.vstack([weights, x])
+                categories.append(label)
+
+        self.weights = weights.astype(np.float32)
+        self.categories = np.array(categories, dtype=np.float32)
+        return self
+
+    def predict(self, features):
+        # memory of the choice function is (pixels, categories, inputs), so chunks are smaller
+        result = np.empty(len(features), dtype=np.float32)
+        step = max(1, CLASSIFIER_CHUNK_PIXELS // max(1, self.weights.size))
+        for start in range(0, len(features), step):
+            result[start:start + step] = self._predictChunk(features[start:start + step])
+        return result
+
+    def _predictChunk(self, features):
+        inputs = self._complementCode(features)
+        overlap = np.minimum(inputs[:, None, :], self.weights[None, :, :]).sum(axis=2)
+        choice = overlap / (self.alpha + self.weights.sum(axis=1))
+        return self.categories[np.argmax(choice, axis=1)]
+
+    def params(self):
+        return {'weights': self.weights, 'categories': self.categories}
+
+    def setParams(self, params):
+        self.weights, self.categories = params['weights'], params['categories']
@@ -0,0 +1,268 @@
+'''
+    Headless batch change detection.
+
+    Pairs are given either by a CSV manifest with rows `t1,t2,output`
+    or by two directories, where acquisitions with the same file name are matched.
+    A time series of acquisitions is compared with its first acquisition or sequentially in one run,
+    every acquisition is encoded by the model only once.
+    Existing outputs are skipped, so an interrupted run can be restarted with the same arguments.
+
+    Example:
+        python cli.py --t1-dir 2019 --t2-dir 2021 --output-dir changes --algorithm 'CNN Algorithm' --workers 4
+        python cli.py --series 2017.tif 2018.tif 2019.tif --series-mode sequential --output-dir changes
+'''
+
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from constants import TILE_SIZE, TILE_OVERLAP, INFERENCE_BACKEND, CHANGE_THRESHOLD
+from raster import openRaster, asMaskRasterSource, ThresholdRasterSource, thresholdMask
+from export import exportBands, exportRaster
+from resampling import QUALITIES
+import backends
+
+OUTPUT_EXTENSION = '.png'
+
+
+def readManifest(path):
+    '''
+        Returns list of (t1_path, t2_path, output_path) from CSV manifest.
+        Relative paths are resolved against the directory of the manifest.
+    '''
+
+    base = os.path.dirname(os.path.abspath(path))
+    pairs = []
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith('#') or row[0].strip() == 't1':
+                continue
+            if len(row) != 3:
+                raise ValueError('readManifest: expected rows `t1,t2,output`, got ' + ','.join(row))
+            pairs.append(tuple(os.path.join(base, column.strip()) for column in row))
+    return pairs
+
+
+def matchDirectories(t1_dir, t2_dir, output_dir):
+    '''
+        Returns list of (t1_path, t2_path, output_path) for files present in both directories.
+    '''
+
+    t2_names = set(os.listdir(t2_dir))
+    pairs = []
+    for name in sorted(os.listdir(t1_dir)):
+        if name in t2_names and os.path.isfile(os.path.join(t1_dir, name)):
+            output_name = os.path.splitext(name)[0] + OUTPUT_EXTENSION
+            pairs.append((os.path.join(t1_dir, name), os.path.join(t2_dir, name),
+                          os.path.join(output_dir, output_name)))
+    return pairs
+
+
+def processPair(algorithm_name, t1_path, t2_path, output_path, tiled, tile_size, overlap, batch_size, resampling,
+                threshold=CHANGE_THRESHOLD):
+    '''
+        Runs in a worker process. The result is written to a temporary file first
+        and renamed at the end, so outputs of interrupted runs are never taken as done.
+        Tiled results are written band by band while they are computed.
+        If `threshold` is None, change probabilities * 255 are written instead of the mask.
+    '''
+
+    from algorithms import algorithms, performAlgorithm, iterTiledBands
+
+    algo = algorithms[algorithm_name]
+    if resampling is not None:
+        algo.setResamplingQuality(resampling)
+    start = time.perf_counter()
+    t1_source = openRaster(t1_path)
+    t2_source = openRaster(t2_path)
+    try:
+        if tiled and algo.getInputSize() is not None:
+            makeOutputDir(output_path)
+            bands = (band for top, band in
+                     iterTiledBands(algo, t1_source, t2_source, tile_size, overlap, batch_size=batch_size))
+            if threshold is not None:
+                bands = (thresholdMask(band, threshold) for band in bands)
+            exportBands(bands, output_path, t1_source.width, t1_source.height, 'L',
+                        t1_path, bilevel=threshold is not None)
+        else:
+            writeResult(performAlgorithm(algo, t1_source, t2_source), output_path, t1_path, threshold)
+    finally:
+        t1_source.close()
+        t2_source.close()
+
+    return time.perf_counter() - start
+
+
+def makeOutputDir(output_path):
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+
+def writeResult(res_im, output_path, reference_path=None, threshold=CHANGE_THRESHOLD):
+    '''
+        Writes change map of probabilities `res_im` thresholded by `threshold` (as is if it is None)
+        with georeferencing of the scene `reference_path`, see export.exportRaster.
+        Like tiled results, it is written to a temporary file and renamed when complete.
+    '''
+
+    makeOutputDir(output_path)
+    source = asMaskRasterSource(res_im)
+    if threshold is not None:
+        source = ThresholdRasterSource(source, threshold)
+    exportRaster(source, output_path, reference_path)
+
+
+def seriesOutputPath(output_dir, paths, i, j):
+    '''
+        Returns path of the change map of acquisitions `i` and `j` of the series `paths`, e.g. 000-002__2017__2019.png.
+        Indices keep names unique when acquisitions in different directories have the same file name.
+    '''
+
+    names = [os.path.splitext(os.path.basename(paths[index]))[0] for index in (i, j)]
+    return os.path.join(output_dir, '{:03d}-{:03d}__{}'.format(i, j, '__'.join(names)) + OUTPUT_EXTENSION)
+
+
+def processSeries(algorithm_name, paths, mode, output_dir, overwrite, batch_size, resampling,
+                  threshold=CHANGE_THRESHOLD):
+    '''
+        Compares acquisitions of a time series in this process, so features
+        of every acquisition are computed once and shared by all its pairs
+    '''
+
+    from algorithms import algorithms, performAlgorithmMany, seriesPairs
+
+    algo = algorithms[algorithm_name]
+    if resampling is not None:
+        algo.setResamplingQuality(resampling)
+    pairs = [(i, j) for i, j in seriesPairs(len(paths), mode)
+             if overwrite or not os.path.exists(seriesOutputPath(output_dir, paths, i, j))]
+    print('{} pairs, {} already done'.format(len(paths) - 1, len(paths) - 1 - len(pairs)), file=sys.stderr)
+
+    start = time.perf_counter()
+    sources = [openRaster(path) for path in paths]
+    try:
+        results = performAlgorithmMany(algo, [(sources[i], sources[j]) for i, j in pairs], batch_size=batch_size)
+    finally:
+        for source in sources:
+            source.close()
+
+    for (i, j), res_im in zip(pairs, results):
+        output_path = seriesOutputPath(output_dir, paths, i, j)
+        writeResult(res_im, output_path, paths[i], threshold)
+        print(output_path, file=sys.stderr)
+    print('done in {:.1f} s'.format(time.perf_counter() - start), file=sys.stderr)
+    return 0
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description='Run change detection over pairs of scenes without GUI.')
+
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--manifest', help='CSV file with rows `t1,t2,output`')
+    source.add_argument('--t1-dir', help='directory with the first acquisitions')
+    source.add_argument('--series', nargs='+', metavar='PICTURE',
+                        help='time series of acquisitions in chronological order, compared in one process')
+    parser.add_argument('--t2-dir', help='directory with the second acquisitions, matched by file name')
+    parser.add_argument('--output-dir', help='directory for change maps when --t1-dir/--t2-dir or --series are used')
+    parser.add_argument('--series-mode', choices=('reference', 'sequential'), default='reference',
+                        help='compare the first acquisition with each next one or every acquisition with the next one')
+
+    parser.add_argument('--algorithm', default='CNN Algorithm', help='name of the algorithm (see --list)')
+    parser.add_argument('--list', action='store_true', help='print available algorithms and exit')
+    parser.add_argument('--tiled', action='store_true', help='process pairs at full resolution by tiles')
+    parser.add_argument('--tile-size', type=int, default=TILE_SIZE)
+    parser.add_argument('--overlap', type=int, default=TILE_OVERLAP)
+    parser.add_argument('--batch-size', type=int, default=None, help='tiles per model call (default: by memory budget)')
+    parser.add_argument('--resampling', choices=QUALITIES, default=None,
+                        help='quality of downscaling to the input size of the algorithm (default: per algorithm)')
+    parser.add_argument('--threshold', type=float, default=CHANGE_THRESHOLD,
+                        help='change probability above which pixels are changes (default: %(default)s)')
+    parser.add_argument('--probabilities', action='store_true',
+                        help='write change probabilities * 255 instead of thresholded masks')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--backend', choices=sorted(backends.BACKENDS), default=INFERENCE_BACKEND,
+                        help='inference runtime of the CNN (see backends.py)')
+    parser.add_argument('--model', help='model file of the backend (default: best_model with its extension)')
+    parser.add_argument('--intra-op-threads', type=int, default=None, help='threads used by one operation')
+    parser.add_argument('--inter-op-threads', type=int, default=None, help='operations run in parallel')
+    parser.add_argument('--overwrite', action='store_true', help='process pairs even if the output exists')
+
+    args = parser.parse_args(argv)
+    if args.list:
+        return parser, args
+    if not (args.manifest or args.t1_dir or args.series):
+        parser.error('one of --manifest, --t1-dir or --series is required')
+    if args.t1_dir and not (args.t2_dir and args.output_dir):
+        parser.error('--t1-dir requires --t2-dir and --output-dir')
+    if args.series and (len(args.series) < 2 or not args.output_dir):
+        parser.error('--series requires at least 2 pictures and --output-dir')
+    if args.series and args.tiled:
+        parser.error('--tiled is not supported with --series')
+    if args.workers < 1:
+        parser.error('--workers must be positive')
+    if not 0 <= args.overlap < args.tile_size:
+        parser.error('--overlap must be in [0, --tile-size)')
+    if not 0 <= args.threshold <= 1:
+        parser.error('--threshold must be in [0, 1]')
+    return parser, args
+
+
+def main(argv=None):
+    parser, args = parseArgs(sys.argv[1:] if argv is None else argv)
+
+    from algorithms import algorithms
+
+    if args.list:
+        for name in algorithms:
+            print(name)
+        return 0
+    if args.algorithm not in algorithms:
+        parser.error('unknown algorithm ' + repr(args.algorithm) + ', use --list')
+
+    inference = (args.backend, args.model, args.intra_op_threads, args.inter_op_threads)
+    backends.configure(*inference)
+    threshold = None if args.probabilities else args.threshold
+
+    if args.series:
+        return processSeries(args.algorithm, args.series, args.series_mode, args.output_dir,
+                             args.overwrite, args.batch_size, args.resampling, threshold)
+
+    if args.manifest:
+        pairs = readManifest(args.manifest)
+    else:
+        pairs = matchDirectories(args.t1_dir, args.t2_dir, args.output_dir)
+
+    todo = [pair for pair in pairs if args.overwrite or not os.path.exists(pair[2])]
+    print('{} pairs, {} already done'.format(len(pairs), len(pairs) - len(todo)), file=sys.stderr)
+
+    params = (args.tiled, args.tile_size, args.overlap, args.batch_size, args.resampling, threshold)
+    failed = 0
+    start = time.perf_counter()
+
+    # TensorFlow doesn't survive fork, so workers are spawned
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context,
+                             initializer=backends.configure, initargs=inference) as executor:
+        futures = {
+            executor.submit(processPair, args.algorithm, t1_path, t2_path, output_path, *params): output_path
+            for t1_path, t2_path, output_path in todo
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            output_path = futures[future]
+            try:
+                seconds = future.result()
+                print('[{}/{}] {} ({:.1f} s)'.format(done, len(todo), output_path, seconds), file=sys.stderr)
+            except Exception as e:
+                failed += 1
+                print('[{}/{}] {} FAILED: {}'.format(done, len(todo), output_path, e), file=sys.stderr)
+
+    print('done in {:.1f} s, {} failed'.format(time.perf_counter() - start, failed), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+'''
+    Blending of pictures and change masks into one canvas.
+
+    Every picture is a Layer over a RasterSource with its own visibility, opacity and colour map.
+    CompositeRasterSource is a RasterSource itself, so the canvas is tiled by ImagePyramid
+    like a single picture, and every window of it is blended from windows of visible layers
+    in NumPy. Methods changing layers return the box of the canvas which has to be recomposed.
+'''
+
+import numpy as np
+from raster import RasterSource
+
+
+def _rampColormap(color):
+    '''
+        Colour map of masks: zero is transparent, 255 is opaque `color`
+    '''
+
+    lut = np.zeros((256, 4), dtype=np.uint8)
+    lut[:, :3] = color
+    lut[:, 3] = np.arange(256)
+    return lut
+
+
+def _grayColormap():
+    lut = np.empty((256, 4), dtype=np.uint8)
+    lut[:, :3] = np.arange(256)[:, None]
+    lut[:, 3] = 255
+    return lut
+
+
+def _heatColormap():
+    # black - red - yellow - white, transparency grows to zero
+    x = np.arange(256, dtype=np.float32) / 255
+    lut = np.empty((256, 4), dtype=np.uint8)
+    lut[:, 0] = np.clip(3 * x, 0, 1) * 255
+    lut[:, 1] = np.clip(3 * x - 1, 0, 1) * 255
+    lut[:, 2] = np.clip(3 * x - 2, 0, 1) * 255
+    lut[:, 3] = np.arange(256)
+    return lut
+
+
+# RGBA lookup tables for single band layers
+COLORMAPS = {
+    'gray': _grayColormap(),
+    'red': _rampColormap((255, 0, 0)),
+    'yellow': _rampColormap((255, 255, 0)),
+    'cyan': _rampColormap((0, 255, 255)),
+    'heat': _heatColormap(),
+}
+
+DEFAULT_IMAGE_COLORMAP = 'gray'
+DEFAULT_MASK_COLORMAP = 'red'
+
+
+class Layer:
+    '''
+        Picture on the canvas with its top left corner at `offset` (x, y) pixels of the canvas,
+        e.g. a result computed for a region of the pictures.
+
+        `kind` is 'image' for loaded pictures or 'mask' for results of algorithms.
+        `colormap` - name from COLORMAPS, used only for single band rasters.
+    '''
+
+    def __init__(self, source, kind='image', opacity=1.0, colormap=None, visible=True, offset=(0, 0)):
+        self.source = source
+        self.offset = offset
+        self.kind = kind
+        self.opacity = opacity
+        if colormap is None:
+            colormap = DEFAULT_MASK_COLORMAP if kind == 'mask' else DEFAULT_IMAGE_COLORMAP
+        self.colormap = colormap
+        self.visible = visible
+
+    @property
+    def width(self):
+        return self.source.width
+
+    @property
+    def height(self):
+        return self.source.height
+
+    def box(self):
+        x, y = self.offset
+        return x, y, x + self.source.width, y + self.source.height
+
+    def hasColormap(self):
+        return self.source.mode == 'L'
+
+    def colorAlpha(self, arr):
+        '''
+            Returns float32 colours (height, width, 3) and alpha (height, width)
+            of uint8 array `arr` read from the source
+        '''
+
+        if arr.ndim == 2:
+            rgba = COLORMAPS[self.colormap][arr]
+            return rgba[..., :3].astype(np.float32), rgba[..., 3] * np.float32(self.opacity / 255)
+        if arr.shape[2] == 4:
+            return arr[..., :3].astype(np.float32), arr[..., 3] * np.float32(self.opacity / 255)
+        return arr.astype(np.float32), np.full(arr.shape[:2], self.opacity, dtype=np.float32)
+
+
+class CompositeRasterSource(RasterSource):
+    '''
+        RGB raster of all visible layers blended over `background` in z-order.
+
+        `layers` keeps the order of adding, `order` is the z-order from bottom to top.
+        The canvas is as large as the largest layer, hidden layers included,
+        so toggling a layer doesn't change the size of the canvas.
+    '''
+
+    mode = 'RGB'
+
+    def __init__(self, background=(255, 255, 255)):
+        self.background = np.array(background, dtype=np.float32)
+        self.layers = []
+        self.order = []
+
+    def _updateSize(self):
+        self.width = max((layer.box()[2] for layer in self.layers), default=0)
+        self.height = max((layer.box()[3] for layer in self.layers), default=0)
+
+    def addLayer(self, layer):
+        self.layers.append(layer)
+        self.order.append(layer)
+        self._updateSize()
+        return layer.box()
+
+    def removeLayer(self, index):
+        layer = self.layers.pop(index)
+        self.order.remove(layer)
+        self._updateSize()
+        return layer.box()
+
+    def raiseLayer(self, index):
+        layer = self.layers[index]
+        if self.order[-1] is layer:
+            return None
+        self.order.remove(layer)
+        self.order.append(layer)
+        return layer.box()
+
+    def setLayerVisible(self, index, visible):
+        layer = self.layers[index]
+        if layer.visible == visible:
+            return None
+        layer.visible = visible
+        return layer.box()
+
+    def setLayerOpacity(self, index, opacity):
+        layer = self.layers[index]
+        if layer.opacity == opacity:
+            return None
+        layer.opacity = opacity
+        return layer.box() if layer.visible else None
+
+    def setLayerColormap(self, index, colormap):
+        if colormap not in COLORMAPS:
+            raise ValueError('CompositeRasterSource.setLayerColormap: unknown colour map ' + repr(colormap))
+        layer = self.layers[index]
+        if layer.colormap == colormap:
+            return None
+        layer.colormap = colormap
+        return layer.box() if layer.visible and layer.hasColormap() else None
+
+    def layerChanged(self, index):
+        '''
+            Returns the box to redraw after the raster of the layer `index` changed in place
+        '''
+
+        layer = self.layers[index]
+        return layer.box() if layer.visible else None
+
+    def composeWindow(self, box, level=0):
+        '''
+            Same as readWindow for `box` inside of the canvas, but returns uint8 array (height, width, 3)
+        '''
+
+        return self._readArray(*box, 2 ** level)
+
+    def _readArray(self, left, top, right, bottom, step):
+        level = step.bit_length() - 1
+        out = np.empty((-(-(bottom - top) // step), -(-(right - left) // step), 3), dtype=np.float32)
+        out[:] = self.background
+
+        for layer in self.order:
+            if not layer.visible or layer.opacity <= 0:
+                continue
+            layer_left, layer_top, layer_right, layer_bottom = layer.box()
+            # the first pixels of the window on the layer, on the grid of the decimated window
+            column = -(-max(0, layer_left - left) // step)
+            row = -(-max(0, layer_top - top) // step)
+            window_left, window_top = left + column * step, top + row * step
+            window_right, window_bottom = min(right, layer_right), min(bottom, layer_bottom)
+            if window_right <= window_left or window_bottom <= window_top:
+                continue
+
+            x, y = layer.offset
+            window = np.asarray(layer.source.readWindow(
+                (window_left - x, window_top - y, window_right - x, window_bottom - y), level
+            ))
+            color, alpha = layer.colorAlpha(window)
+            region = out[row:row + alpha.shape[0], column:column + alpha.shape[1]]
+            region += (color - region) * alpha[..., None]
+
+        return np.clip(np.rint(out), 0, 255).astype(np.uint8)
@@ -1,3 +1,6 @@
+import os
+import tempfile
+
 ZOOM_MIN = 0.2
 ZOOM_MAX = 5
 
@@ -6,3 +9,97 @@ WHEEL_SCALING_COEF = 1.03
 
 CURSOR_COORDS_ROUND_DIGITS = 3
 SCALING_ROUND_DIGITS = 3
+
+# zoom and pan events are applied at most once per frame
+RENDER_FRAME_MS = 16
+# high quality rendering starts after this time without zoom or pan events
+RENDER_IDLE_MS = 150
+
+TILE_SIZE = 512
+TILE_OVERLAP = 64
+
+ALGORITHM_WORKERS = 1
+# decoded pictures, results and summed-area tables of layers kept in memory, see memory.LayerMemoryManager
+LAYER_MEMORY_BUDGET = 1024 * 1024 * 1024
+# composited tiles of the canvas kept as pixmaps
+CANVAS_TILE_CACHE_BUDGET = 96 * 1024 * 1024
+# zlib level of evicted results, the fastest one compresses probability maps well
+COMPACT_RASTER_COMPRESS_LEVEL = 1
+# load the CNN and run it once in background as soon as the window is shown
+WARM_UP_ON_STARTUP = True
+
+# bytes available for one batch of model inputs
+BATCH_MEMORY_BUDGET = 512 * 1024 * 1024
+BATCH_MAX_SIZE = 32
+# memory of model activations relative to the float32 input
+BATCH_ACTIVATION_FACTOR = 8
+
+# changes are pixels with probability above the threshold, see raster.thresholdMask
+CHANGE_THRESHOLD = 0.5
+
+# default downscaling of pictures to the input size of algorithms: fast, balanced or high, see resampling.py
+RESAMPLING_QUALITY = 'balanced'
+# full resolution pixels read at once when pictures are downscaled by box averaging
+RESAMPLING_BAND_PIXELS = 1 << 22
+
+# items waiting between stages of pipeline.Pipeline
+PIPELINE_QUEUE_SIZE = 8
+# threads of the stages of tiled processing, see algorithms.iterTiledBands
+PIPELINE_READ_WORKERS = 2
+PIPELINE_PREPROCESS_WORKERS = 2
+PIPELINE_INFERENCE_WORKERS = 1
+PIPELINE_UPSAMPLE_WORKERS = 2
+
+PYRAMID_TILE_SIZE = 256
+
+# decoded chunks of tiled rasters kept in memory per file
+RASTER_CHUNK_CACHE_SIZE = 64
+
+RESULT_CACHE_MEMORY_BUDGET = 256 * 1024 * 1024
+RESULT_CACHE_DISK_BUDGET = 2 * 1024 * 1024 * 1024
+RESULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'change-detection', 'results')
+# encoder features of pictures kept in memory, see algorithms.encodePictures
+FEATURE_CACHE_MEMORY_BUDGET = 512 * 1024 * 1024
+# pictures resized to input sizes of algorithms kept in memory, see algorithms.readPreprocessed
+PREPROCESS_CACHE_MEMORY_BUDGET = 128 * 1024 * 1024
+
+# the CNN, exported to other formats by backends.py
+MODEL_PATH = 'best_model.h5'
+# keras, tflite or onnx, see backends.py
+INFERENCE_BACKEND = 'keras'
+# threads of the inference runtime, 0 - chosen by the runtime
+INFERENCE_INTRA_OP_THREADS = 0
+INFERENCE_INTER_OP_THREADS = 0
+# Unix socket of inference_server.py, used by the remote backend
+INFERENCE_SERVER_SOCKET = os.path.join(tempfile.gettempdir(), 'change-detection-inference.sock')
+# the server waits this long for requests of other clients to batch them together
+INFERENCE_SERVER_BATCH_WAIT_MS = 5
+# required fraction of equal pixels of change maps of int8 and float models
+QUANTIZATION_MIN_AGREEMENT = 0.99
+
+# tiles of exported TIFF files, see export.py
+EXPORT_TILE_SIZE = 256
+# pixels of exported PNG files compressed at once
+EXPORT_STRIP_PIXELS = 1 << 20
+EXPORT_COMPRESS_LEVEL = 6
+
+# masks larger than this are indexed for region statistics by cells of several pixels, see integral.py
+SUMMED_AREA_MAX_CELLS = 1 << 24
+SUMMED_AREA_BAND_PIXELS = 1 << 22
+# tables of thresholded results are built again in background once the threshold slider stops for this time
+SUMMED_AREA_REBUILD_MS = 300
+# side of the neighbourhood under the cursor whose changes are shown, in pixels of the picture
+REGION_STATS_NEIGHBOURHOOD = 64
+
+# pretrained per-pixel classifiers (.npz), see algorithms.PixelClassifierAlgorithm
+MODELS_DIR = 'models'
+# pixels processed at once by per-pixel classifiers
+CLASSIFIER_CHUNK_PIXELS = 1 << 18
+# pixels sampled to train per-pixel classifiers on a pair without pretrained model
+CLASSIFIER_TRAIN_SAMPLES = 20000
+CLASSIFIER_ARTMAP_TRAIN_SAMPLES = 2000
+# size of the overview of a pair used to sample training pixels
+CLASSIFIER_OVERVIEW_SIZE = 1024
+
+# recorded timing spans kept in memory, see profiling.py
+PROFILING_MAX_SPANS = 100000
@@ -0,0 +1,280 @@
+'''
+    Streaming export of rasters and change maps.
+
+    Writers take the raster as an iterator of bands of rows (any heights, top to bottom),
+    so a result is written while it is computed (see algorithms.iterTiledBands)
+    or read from a RasterSource window by window, and memory use doesn't depend on the size of the raster.
+
+    .tif/.tiff is written as tiled deflate compressed TIFF, .png as PNG with IDAT chunks
+    compressed strip by strip, 1 bit per pixel for masks. Other formats are saved by PIL at once.
+    Georeferencing of the scene the raster was made from is kept: GeoTIFF tags are copied
+    to TIFF outputs, world files and .prj files are copied next to any output.
+
+    Example:
+        exportRaster(source, 'changes.tif', reference_path='2019.tif')
+'''
+
+import math
+import os
+import shutil
+import struct
+import zlib
+import numpy as np
+from PIL import Image
+from profiling import span
+from raster import PackedMaskRasterSource, ThresholdRasterSource
+from constants import EXPORT_TILE_SIZE, EXPORT_STRIP_PIXELS, EXPORT_COMPRESS_LEVEL
+
+# ModelPixelScale, ModelTiepoint, ModelTransformation, GeoKeyDirectory, GeoDoubleParams, GeoAsciiParams,
+# GDAL_METADATA, GDAL_NODATA
+GEOREFERENCE_TAGS = (33550, 33922, 34264, 34735, 34736, 34737, 42112, 42113)
+
+# struct format of TIFF field types
+_TIFF_TYPES = {1: 'B', 2: 's', 3: 'H', 4: 'I', 5: 'I', 7: 'B', 11: 'f', 12: 'd'}
+
+_PNG_COLOR_TYPES = {'L': 0, 'RGB': 2, 'RGBA': 6}
+
+
+def sourceBands(source, rows=None):
+    '''
+        Yields the raster of RasterSource `source` as bands of `rows` full width rows
+    '''
+
+    if rows is None:
+        rows = max(1, EXPORT_STRIP_PIXELS // max(1, source.width))
+    for top in range(0, source.height, rows):
+        yield np.asarray(source.readWindow((0, top, source.width, min(top + rows, source.height))))
+
+
+def _rebanded(bands, rows):
+    '''
+        Yields arrays of exactly `rows` rows (the last one may be shorter) made of `bands`
+    '''
+
+    parts, count = [], 0
+    for band in bands:
+        parts.append(band)
+        count += band.shape[0]
+        while count >= rows:
+            joined = np.concatenate(parts) if len(parts) > 1 else parts[0]
+            yield joined[:rows]
+            parts, count = [joined[rows:]], count - rows
+    if count:
+        yield np.concatenate(parts) if len(parts) > 1 else parts[0]
+
+
+def readGeoreference(path):
+    '''
+        Returns {tag: (type, values)} of GeoTIFF tags of the TIFF file `path`, empty for other files
+    '''
+
+    if path is None or not os.path.isfile(path):
+        return {}
+    try:
+        with Image.open(path) as image:
+            if image.format != 'TIFF':
+                return {}
+            tags = image.tag_v2
+            return {tag: (tags.tagtype[tag], tags[tag]) for tag in GEOREFERENCE_TAGS if tag in tags}
+    except OSError:
+        return {}
+
+
+def worldFilePath(path):
+    '''
+        Returns the name of the world file of `path` by the usual convention, e.g. scene.tfw for scene.tif
+    '''
+
+    root, extension = os.path.splitext(path)
+    if len(extension) >= 3:
+        return root + '.' + extension[1] + extension[-1] + 'w'
+    return root + '.wld'
+
+
+def copySidecars(reference_path, output_path):
+    '''
+        Copies world file and .prj of the scene `reference_path`, if they exist, next to `output_path`
+    '''
+
+    if reference_path is None or os.path.abspath(reference_path) == os.path.abspath(output_path):
+        return
+    root, extension = os.path.splitext(reference_path)
+    output_root = os.path.splitext(output_path)[0]
+
+    for world_file in (worldFilePath(reference_path), root + extension + 'w', root + '.wld'):
+        if os.path.isfile(world_file):
+            shutil.copyfile(world_file, worldFilePath(output_path))
+            break
+    if os.path.isfile(root + '.prj'):
+        shutil.copyfile(root + '.prj', output_root + '.prj')
+
+
+def _tiffEntry(tag, field_type, values):
+    if field_type == 2:
+        data = (values if isinstance(values, str) else ''.join(values)).encode('ascii', 'replace') + b'\0'
+        return tag, field_type, len(data), data
+
+    if not isinstance(values, (tuple, list)):
+        values = (values,)
+    if field_type == 5:
+        # rationals as pairs of numerator and denominator
+        values = [part for value in values for part in (value.numerator, value.denominator)]
+        count = len(values) // 2
+    else:
+        count = len(values)
+    return tag, field_type, count, struct.pack('<{}{}'.format(len(values), _TIFF_TYPES[field_type]), *values)
+
+
+def writeTiledTiff(path, bands, width, height, mode, tags=None, tile_size=EXPORT_TILE_SIZE,
+                   level=EXPORT_COMPRESS_LEVEL):
+    '''
+        Writes uint8 `bands` of a raster of `mode` ('L', 'RGB' or 'RGBA') as tiled deflate compressed TIFF.
+        `tags` - extra {tag: (type, values)}, e.g. from readGeoreference.
+        Only one row of tiles is kept in memory.
+    '''
+
+    channels = Image.getmodebands(mode)
+    columns = math.ceil(width / tile_size)
+    offsets, counts = [], []
+
+    with open(path, 'wb') as f:
+        # the first IFD is written after the tiles, its offset is patched at the end
+        f.write(b'II*\0\0\0\0\0')
+
+        for band in _rebanded(bands, tile_size):
+            with span('export'):
+                if band.ndim == 2:
+                    band = band[:, :, None]
+                row = np.zeros((tile_size, columns * tile_size, channels), dtype=np.uint8)
+                row[:band.shape[0], :width] = band
+                for column in range(columns):
+                    tile = row[:, column * tile_size:(column + 1) * tile_size]
+                    data = zlib.compress(np.ascontiguousarray(tile).tobytes(), level)
+                    offsets.append(f.tell())
+                    counts.append(len(data))
+                    f.write(data)
+
+        if f.tell() >= 2 ** 32 - 2 ** 20:
+            raise ValueError('writeTiledTiff: the raster is too large for TIFF, use PNG')
+
+        entries = [
+            (256, 4, 1, struct.pack('<I', width)),
+            (257, 4, 1, struct.pack('<I', height)),
+            (258, 3, channels, struct.pack('<{}H'.format(channels), *[8] * channels)),
+            (259, 3, 1, struct.pack('<H', 8)),
+            (262, 3, 1, struct.pack('<H', 1 if channels == 1 else 2)),
+            (277, 3, 1, struct.pack('<H', channels)),
+            (284, 3, 1, struct.pack('<H', 1)),
+            (322, 4, 1, struct.pack('<I', tile_size)),
+            (323, 4, 1, struct.pack('<I', tile_size)),
+            (324, 4, len(offsets), struct.pack('<{}I'.format(len(offsets)), *offsets)),
+            (325, 4, len(counts), struct.pack('<{}I'.format(len(counts)), *counts)),
+        ]
+        if channels == 4:
+            # unassociated alpha
+            entries.append((338, 3, 1, struct.pack('<H', 2)))
+        for tag, (field_type, values) in (tags or {}).items():
+            if field_type in _TIFF_TYPES:
+                entries.append(_tiffEntry(tag, field_type, values))
+        entries.sort()
+
+        if f.tell() % 2:
+            f.write(b'\0')
+        ifd_offset = f.tell()
+        data_offset = ifd_offset + 2 + 12 * len(entries) + 4
+
+        ifd = [struct.pack('<H', len(entries))]
+        extra = []
+        for tag, field_type, count, data in entries:
+            if len(data) <= 4:
+                ifd.append(struct.pack('<HHI', tag, field_type, count) + data.ljust(4, b'\0'))
+            else:
+                ifd.append(struct.pack('<HHII', tag, field_type, count, data_offset))
+                extra.append(data + b'\0' * (len(data) % 2))
+                data_offset += len(extra[-1])
+        ifd.append(struct.pack('<I', 0))
+        f.write(b''.join(ifd + extra))
+
+        f.seek(4)
+        f.write(struct.pack('<I', ifd_offset))
+
+
+def _pngChunk(f, kind, data):
+    f.write(struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(data, zlib.crc32(kind))))
+
+
+def writePng(path, bands, width, height, mode, bilevel=False, level=EXPORT_COMPRESS_LEVEL):
+    '''
+        Writes uint8 `bands` of a raster of `mode` as PNG, compressing them one by one.
+        If `bilevel`, nonzero pixels are written as white with 1 bit per pixel.
+    '''
+
+    channels = Image.getmodebands(mode)
+    bit_depth = 1 if bilevel else 8
+    compressor = zlib.compressobj(level)
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        _pngChunk(f, b'IHDR', struct.pack('>IIBBBBB', width, height, bit_depth, _PNG_COLOR_TYPES[mode], 0, 0, 0))
+
+        for band in bands:
+            with span('export'):
+                if bilevel:
+                    # filter type 0 (none) before every row
+                    rows = np.packbits(band != 0, axis=1)
+                    rows = np.concatenate([np.zeros((rows.shape[0], 1), np.uint8), rows], axis=1)
+                else:
+                    # filter type 1 (sub): differences from the previous pixel of the row
+                    band = band.reshape(band.shape[0], -1)
+                    rows = np.empty((band.shape[0], band.shape[1] + 1), np.uint8)
+                    rows[:, 0] = 1
+                    rows[:, 1:channels + 1] = band[:, :channels]
+                    np.subtract(band[:, channels:], band[:, :-channels], out=rows[:, channels + 1:])
+                data = compressor.compress(rows.tobytes())
+            if data:
+                _pngChunk(f, b'IDAT', data)
+
+        _pngChunk(f, b'IDAT', compressor.flush())
+        _pngChunk(f, b'IEND', b'')
+
+
+def exportBands(bands, path, width, height, mode, reference_path=None, bilevel=False):
+    '''
+        Writes `bands` to `path` in the format given by its extension, see the module docstring.
+        The file is written under a temporary name and renamed at the end, after its sidecars are copied,
+        so a file under `path` is always complete, e.g. for the CLI which skips existing outputs.
+        Raises ValueError for unknown extensions.
+    '''
+
+    root, extension = os.path.splitext(path)
+    extension = extension.lower()
+    tmp_path = root + '.part' + extension
+
+    try:
+        if extension in ('.tif', '.tiff'):
+            writeTiledTiff(tmp_path, bands, width, height, mode, readGeoreference(reference_path))
+        elif extension == '.png':
+            writePng(tmp_path, bands, width, height, mode, bilevel)
+        else:
+            formats = Image.registered_extensions()
+            if extension not in formats:
+                raise ValueError('unknown file extension: ' + extension)
+            Image.fromarray(np.concatenate(list(bands))).save(tmp_path, format=formats[extension])
+        copySidecars(reference_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    os.replace(tmp_path, path)
+
+
+def exportRaster(source, path, reference_path=None):
+    '''
+        Writes RasterSource `source` to `path` window by window, masks as 1 bit PNG
+    '''
+
+    if reference_path is None:
+        reference_path = source.georeferencePath()
+    exportBands(sourceBands(source), path, source.width, source.height, source.mode, reference_path,
+                bilevel=isinstance(source, (PackedMaskRasterSource, ThresholdRasterSource)))
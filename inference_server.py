@@ -0,0 +1,196 @@
+'''
+    Local inference server: one process keeps the CNN loaded and serves all GUI sessions
+    and CLI workers of the host over a Unix socket.
+
+    Clients (backends.RemoteBackend) put their inputs into shared memory and send only its name
+    and layout; the outputs are small and are sent back over the socket. Requests of all clients
+    which arrive within INFERENCE_SERVER_BATCH_WAIT_MS are run as one batch.
+
+    Example:
+        python inference_server.py --backend onnx --model best_model.int8.onnx --intra-op-threads 8
+        python cli.py --backend remote --t1-dir 2019 --t2-dir 2021 --output-dir changes --workers 8
+'''
+
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Listener
+import numpy as np
+import backends
+from batching import BatchStats
+from profiling import span
+from constants import BATCH_MAX_SIZE, INFERENCE_SERVER_SOCKET, INFERENCE_SERVER_BATCH_WAIT_MS
+
+
+def _attachSharedMemory(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before Python 3.13 the segment is registered in the tracker of this process,
+        # which would unlink it at exit, but it belongs to the client
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _errorText(e):
+    return '{}: {}'.format(type(e).__name__, e)
+
+
+class _Request:
+
+    __slots__ = ('inputs', 'outputs', 'error', 'done')
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.outputs = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class InferenceServer:
+    '''
+        Serves `backend` (called as backend(inputs=[t1_batch, t2_batch])) on the Unix socket `address`.
+        Every connection is handled by its own thread, the model is called by one thread
+        with batches of up to `max_batch_size` pairs.
+    '''
+
+    def __init__(self, backend, identity, address=INFERENCE_SERVER_SOCKET, max_batch_size=BATCH_MAX_SIZE,
+                 batch_wait=INFERENCE_SERVER_BATCH_WAIT_MS / 1000):
+        self.backend = backend
+        self.identity = identity
+        self.address = address
+        self.max_batch_size = max_batch_size
+        self.batch_wait = batch_wait
+        self.stats = BatchStats()
+        self._queue = queue.Queue()
+
+    def serveForever(self):
+        if os.path.exists(self.address):
+            # left by a server which was killed
+            os.remove(self.address)
+        with Listener(self.address, family='AF_UNIX') as listener:
+            os.chmod(self.address, 0o600)
+            threading.Thread(target=self._inferenceLoop, daemon=True).start()
+            print('listening on ' + self.address, file=sys.stderr)
+            while True:
+                connection = listener.accept()
+                threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        try:
+            while True:
+                message = connection.recv()
+                try:
+                    reply = self._handle(message)
+                except Exception as e:
+                    # e.g. the shared memory of the client is gone, the connection is still usable
+                    reply = 'error', _errorText(e)
+                connection.send(reply)
+        except (EOFError, OSError):
+            pass
+        finally:
+            connection.close()
+
+    def _handle(self, message):
+        if message[0] == 'identity':
+            return 'ok', self.identity
+        if message[0] == 'infer':
+            return self._infer(*message[1:])
+        return 'error', 'unknown request ' + repr(message[0])
+
+    def _infer(self, shm_name, layout):
+        shm = _attachSharedMemory(shm_name)
+        try:
+            request = _Request([
+                np.ndarray(shape, np.dtype(dtype), buffer=shm.buf, offset=offset) for shape, dtype, offset in layout
+            ])
+            self._queue.put(request)
+            request.done.wait()
+            # views of the buffer must be released before it is closed
+            request.inputs = None
+        finally:
+            shm.close()
+
+        if request.error is not None:
+            return 'error', request.error
+        return 'ok', request.outputs
+
+    def _inferenceLoop(self):
+        while True:
+            requests = [self._queue.get()]
+            pairs = len(requests[0].inputs[0])
+            deadline = time.monotonic() + self.batch_wait
+            while pairs < self.max_batch_size:
+                try:
+                    request = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                requests.append(request)
+                pairs += len(request.inputs[0])
+            self._run(requests)
+
+    def _run(self, requests):
+        # only inputs of the same shape can be stacked
+        groups = {}
+        for request in requests:
+            groups.setdefault(tuple((x.shape[1:], x.dtype) for x in request.inputs), []).append(request)
+
+        for group in groups.values():
+            start = time.perf_counter()
+            inputs = None
+            try:
+                if len(group) == 1:
+                    inputs = group[0].inputs
+                else:
+                    inputs = [np.concatenate(parts) for parts in zip(*(request.inputs for request in group))]
+                with span('inference'):
+                    outputs = [np.asarray(x) for x in backends.outputList(self.backend(inputs=inputs))]
+
+                offset = 0
+                for request in group:
+                    count = len(request.inputs[0])
+                    request.outputs = [x[offset:offset + count] for x in outputs]
+                    offset += count
+                self.stats.add(offset, time.perf_counter() - start)
+            except Exception as e:
+                for request in group:
+                    request.error = _errorText(e)
+            finally:
+                # views of shared memory must be released before _infer closes it, also when the backend failed
+                inputs = None
+
+            for request in group:
+                request.done.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the CNN to all processes of this host over a Unix socket.')
+    parser.add_argument('--socket', default=INFERENCE_SERVER_SOCKET)
+    parser.add_argument('--backend', choices=sorted(name for name in backends.BACKENDS if name != 'remote'),
+                        default='keras')
+    parser.add_argument('--model', help='model file of the backend (default: best_model with its extension)')
+    parser.add_argument('--intra-op-threads', type=int, default=None)
+    parser.add_argument('--inter-op-threads', type=int, default=None)
+    parser.add_argument('--max-batch-size', type=int, default=BATCH_MAX_SIZE)
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    backends.configure(args.backend, args.model, args.intra_op_threads, args.inter_op_threads)
+    start = time.perf_counter()
+    backend = backends.loadBackend()
+    print('{} loaded in {:.1f} s'.format(backends.configuredPath(), time.perf_counter() - start), file=sys.stderr)
+
+    server = InferenceServer(backend, backends.configuredIdentity(), args.socket, args.max_batch_size)
+    try:
+        server.serveForever()
+    except KeyboardInterrupt:
+        print(server.stats, file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
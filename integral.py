@@ -0,0 +1,134 @@
+'''
+    Summed-area tables (integral images) of change masks for instant region statistics.
+
+    table[y, x] is the number of changed pixels above and to the left of cell (x, y),
+    so the count in any rectangle takes four lookups whatever its size.
+    Masks larger than SUMMED_AREA_MAX_CELLS pixels are indexed by cells of 2 ** level pixels,
+    then counts of rectangles not aligned to cells are interpolated at their borders.
+'''
+
+import math
+import threading
+import numpy as np
+from profiling import span
+from constants import SUMMED_AREA_MAX_CELLS, SUMMED_AREA_BAND_PIXELS
+
+
+class SummedAreaTable:
+
+    def __init__(self, table, width, height, level=0):
+        self.table = table
+        self.width = width
+        self.height = height
+        self.level = level
+
+    @classmethod
+    def fromSource(cls, source, max_cells=SUMMED_AREA_MAX_CELLS):
+        '''
+            Builds the table of a mask RasterSource (nonzero pixels are changes), reading it by bands
+        '''
+
+        width, height = source.size
+        level = 0
+        while math.ceil(width / 2 ** level) * math.ceil(height / 2 ** level) > max_cells:
+            level += 1
+        step = 2 ** level
+        columns, rows = math.ceil(width / step), math.ceil(height / step)
+
+        dtype = np.uint32 if width * height < 2 ** 32 else np.uint64
+        table = np.zeros((rows + 1, columns + 1), dtype=dtype)
+        band_rows = max(1, SUMMED_AREA_BAND_PIXELS // max(1, width * step)) * step
+
+        with span('summed_area'):
+            for top in range(0, height, band_rows):
+                # readWindow pads the window to whole cells with zeros
+                bottom = top + math.ceil((min(top + band_rows, height) - top) / step) * step
+                band = np.asarray(source.readWindow((0, top, columns * step, bottom)))
+                if band.ndim == 3:
+                    band = band[:, :, 0]
+                counts = (band != 0).reshape(-1, step, columns, step).sum(axis=(1, 3), dtype=dtype)
+
+                row = top // step
+                part = table[row + 1:row + 1 + counts.shape[0], 1:]
+                np.cumsum(counts, axis=1, dtype=dtype, out=part)
+                np.cumsum(part, axis=0, dtype=dtype, out=part)
+                part += table[row, 1:]
+
+        return cls(table, width, height, level)
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+    def _count(self, x, y):
+        '''
+            Number of changed pixels in [0, x) x [0, y), interpolated inside of cells
+        '''
+
+        step = 2 ** self.level
+        x0, y0 = min(x // step, self.table.shape[1] - 2), min(y // step, self.table.shape[0] - 2)
+        # the last cells are cut by the border of the mask
+        fx = (x - x0 * step) / min(step, self.width - x0 * step)
+        fy = (y - y0 * step) / min(step, self.height - y0 * step)
+        t = self.table
+        top = t[y0, x0] * (1 - fx) + t[y0, x0 + 1] * fx
+        bottom = t[y0 + 1, x0] * (1 - fx) + t[y0 + 1, x0 + 1] * fx
+        return float(top * (1 - fy) + bottom * fy)
+
+    def count(self, box):
+        '''
+            Returns (number of changed pixels, number of pixels) of `box` = (left, top, right, bottom)
+            clipped to the mask, exact if the mask is indexed at full resolution
+        '''
+
+        left, top = max(0, int(box[0])), max(0, int(box[1]))
+        right, bottom = min(self.width, int(math.ceil(box[2]))), min(self.height, int(math.ceil(box[3])))
+        if left >= right or top >= bottom:
+            return 0, 0
+
+        if self.level == 0:
+            t = self.table
+            changed = int(t[bottom, right]) - int(t[top, right]) - int(t[bottom, left]) + int(t[top, left])
+        else:
+            changed = round(self._count(right, bottom) - self._count(right, top)
+                            - self._count(left, bottom) + self._count(left, top))
+        return changed, (right - left) * (bottom - top)
+
+
+class LazySummedAreaTable:
+    '''
+        SummedAreaTable of a mask RasterSource, built by build() (in a worker thread, so the GUI doesn't wait for it).
+        get() returns None until it is built. evict() drops it (e.g. when the mask changes or memory is short),
+        a build running meanwhile builds it again from the changed mask.
+    '''
+
+    def __init__(self, source):
+        self.source = source
+        self._table = None
+        # incremented by evict(), so tables of masks changed during their build are thrown away
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        return self._table
+
+    def build(self):
+        while True:
+            with self._lock:
+                if self._table is not None:
+                    return self._table
+                generation = self._generation
+            table = SummedAreaTable.fromSource(self.source)
+            with self._lock:
+                if generation == self._generation:
+                    self._table = table
+                    return table
+
+    def residentBytes(self):
+        table = self._table
+        return 0 if table is None else table.nbytes
+
+    def evict(self):
+        with self._lock:
+            self._table = None
+            self._generation += 1
@@ -0,0 +1,96 @@
+import threading
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from algorithms import AlgorithmCancelled
+
+
+class AlgorithmJobSignals(QObject):
+
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+
+class AlgorithmJob(QRunnable):
+    '''
+        Runs `func(*args, progress=..., is_cancelled=..., **kwargs)` in a worker thread.
+        Results are delivered through `signals`, which are queued to the GUI thread.
+    '''
+
+    def __init__(self, name, func, *args, **kwargs):
+        super().__init__()
+        self.setAutoDelete(False)
+
+        self.name = name
+        self.signals = AlgorithmJobSignals()
+
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        self._cancel_event = threading.Event()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def isCancelled(self):
+        return self._cancel_event.is_set()
+
+    def run(self):
+        if self.isCancelled():
+            self.signals.cancelled.emit()
+            return
+
+        try:
+            result = self._func(
+                *self._args,
+                progress=self.signals.progress.emit,
+                is_cancelled=self.isCancelled,
+                **self._kwargs
+            )
+        except AlgorithmCancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+        else:
+            self.signals.finished.emit(result)
+
+
+class AlgorithmJobQueue(QObject):
+    '''
+        Queue of AlgorithmJob's running on its own thread pool.
+        `jobsChanged` is emitted when a job is queued, started or done.
+    '''
+
+    jobsChanged = pyqtSignal()
+
+    def __init__(self, max_workers):
+        super().__init__()
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max_workers)
+        self.jobs = []
+
+    def submit(self, job):
+        self.jobs.append(job)
+        job.signals.finished.connect(lambda result: self._jobDone(job))
+        job.signals.failed.connect(lambda message: self._jobDone(job))
+        job.signals.cancelled.connect(lambda: self._jobDone(job))
+        self.pool.start(job)
+        self.jobsChanged.emit()
+
+    def cancelAll(self):
+        for job in list(self.jobs):
+            job.cancel()
+            # jobs which haven't started yet are taken out of the pool at once
+            if self.pool.tryTake(job):
+                self._jobDone(job)
+
+    def count(self):
+        return len(self.jobs)
+
+    def waitForDone(self):
+        self.pool.waitForDone()
+
+    def _jobDone(self, job):
+        if job in self.jobs:
+            self.jobs.remove(job)
+            self.jobsChanged.emit()
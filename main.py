@@ -1,7 +1,9 @@
+import math
 import sys
-import numpy as np
-from PIL import Image
-from PIL.ImageQt import ImageQt
+import time
+from collections import OrderedDict
+# startup is timed from here, before the heavy imports
+_startup_start = time.perf_counter()
 from PyQt5.QtWidgets import (
     QApplication,
     QWidget,
@@ -21,39 +23,187 @@ from PyQt5.QtWidgets import (
     QFileDialog,
     QSplitter,
     QComboBox,
-    QGroupBox
+    QGroupBox,
+    QCheckBox,
+    QSpinBox,
+    QProgressBar,
+    QSlider,
+    QRubberBand
 )
-from PyQt5.QtGui import QIcon, QPixmap
-from PyQt5.QtCore import Qt, pyqtSignal
-from algorithms import algorithms, performAlgorithm
+from PyQt5.QtGui import QIcon, QPixmap, QPainter, QImage
+from PyQt5.QtCore import Qt, pyqtSignal, QSize, QRect, QRectF, QTimer, QThreadPool
+from algorithms import (
+    algorithms,
+    performAlgorithm,
+    performAlgorithmTiled,
+    performAlgorithmSeries,
+    performAlgorithms,
+    ensembleResult,
+    warmUpAlgorithms,
+    modelLoadSeconds,
+    batch_stats,
+    feature_cache,
+    SERIES_MODES
+)
+from jobs import AlgorithmJob, AlgorithmJobQueue
+from cache import ResultCache
+import profiling
+from profiling import span
+from pyramid import ImagePyramid
+from compositor import CompositeRasterSource, Layer, COLORMAPS
+from raster import openRaster, asMaskRasterSource, ThresholdRasterSource, WindowRasterSource
+from export import exportRaster
+from integral import LazySummedAreaTable
+from memory import LayerMemoryManager
 from constants import (
     ZOOM_MIN,
     ZOOM_MAX,
     TOOLBAR_BOTTOMS_ZOOM_COEF,
     WHEEL_SCALING_COEF,
     CURSOR_COORDS_ROUND_DIGITS,
-    SCALING_ROUND_DIGITS
+    SCALING_ROUND_DIGITS,
+    TILE_SIZE,
+    TILE_OVERLAP,
+    ALGORITHM_WORKERS,
+    RENDER_FRAME_MS,
+    RENDER_IDLE_MS,
+    REGION_STATS_NEIGHBOURHOOD,
+    SUMMED_AREA_REBUILD_MS,
+    CHANGE_THRESHOLD,
+    WARM_UP_ON_STARTUP,
+    CANVAS_TILE_CACHE_BUDGET
 )
 
 
-class Picture(QLabel):
+class Canvas(QWidget):
+    '''
+        Single widget showing all pictures blended by CompositeRasterSource.
+        Composited tiles are cached as pixmaps in LRU order up to CANVAS_TILE_CACHE_BUDGET bytes,
+        changes of layers drop only the tiles intersecting the changed box.
+    '''
 
-    def __init__(self, *args):
-        # args[0] - parent
-        # args[1] - path or PIL.Image
+    def __init__(self, parent):
+        super().__init__(parent)
 
-        super().__init__(args[0])
+        self.composite = CompositeRasterSource()
+        self.pyramid = ImagePyramid(self.composite)
+        self._tiles = OrderedDict()
+        self.tiles_bytes = 0
+        # LayerMemoryManager told about layers read for tiles
+        self.memory = None
+
+        # cheap rendering while a zoom or pan gesture is in progress
+        self.preview = False
 
-        if isinstance(args[1], str):
-            self._pixmap = QPixmap(args[1])
-        else:
-            self._qim = ImageQt(args[1].convert('RGB'))
-            self._pixmap = QPixmap.fromImage(self._qim)
-        self.setPixmap(self._pixmap)
         self.setMouseTracking(True)
 
-    def resizeEvent(self, e):
-        self.setPixmap(self._pixmap.scaled(self.width(), self.height(), Qt.KeepAspectRatio))
+    def sizeHint(self):
+        return QSize(self.pyramid.width, self.pyramid.height)
+
+    def addLayer(self, layer):
+        self._changed(self.composite.addLayer(layer))
+
+    def removeLayer(self, index):
+        self._changed(self.composite.removeLayer(index))
+
+    def raiseLayer(self, index):
+        self._changed(self.composite.raiseLayer(index))
+
+    def setLayerVisible(self, index, visible):
+        self._changed(self.composite.setLayerVisible(index, visible))
+
+    def setLayerOpacity(self, index, opacity):
+        self._changed(self.composite.setLayerOpacity(index, opacity))
+
+    def setLayerColormap(self, index, colormap):
+        self._changed(self.composite.setLayerColormap(index, colormap))
+
+    def updateLayer(self, index):
+        self._changed(self.composite.layerChanged(index))
+
+    def _changed(self, box):
+        if box is None:
+            return
+
+        if self.composite.size != self.pyramid.levelSize(0):
+            # tiles on the border and levels depend on the size of the canvas
+            self.pyramid = ImagePyramid(self.composite)
+            self._tiles.clear()
+            self.tiles_bytes = 0
+            self.update()
+            return
+
+        left, top, right, bottom = box
+        for key in list(self._tiles):
+            level, column, row = key
+            t = self.pyramid.tile_size * 2 ** level
+            if column * t < right and (column + 1) * t > left and row * t < bottom and (row + 1) * t > top:
+                self._dropTile(key)
+
+        if self.pyramid.width:
+            kx = self.width() / self.pyramid.width
+            ky = self.height() / self.pyramid.height
+            self.update(QRectF(left * kx, top * ky, (right - left) * kx, (bottom - top) * ky).toAlignedRect())
+
+    def _tilePixmap(self, level, column, row):
+        key = (level, column, row)
+        if key in self._tiles:
+            self._tiles.move_to_end(key)
+            return self._tiles[key]
+
+        with span('composite'):
+            tile = self.composite.composeWindow(self.pyramid.sourceBox(level, column, row), level)
+        if self.memory is not None:
+            for layer in self.composite.layers:
+                if layer.visible:
+                    self.memory.touch(layer.source)
+        with span('pixmap'):
+            # QImage over the buffer of the array without copying,
+            # the pixmap converts it to its own RGB32 format
+            image = QImage(tile.data, tile.shape[1], tile.shape[0], tile.strides[0], QImage.Format_RGB888)
+            pixmap = QPixmap.fromImage(image)
+
+        self._tiles[key] = pixmap
+        self.tiles_bytes += pixmap.width() * pixmap.height() * 4
+        while self.tiles_bytes > CANVAS_TILE_CACHE_BUDGET and len(self._tiles) > 1:
+            self._dropTile(next(iter(self._tiles)))
+        return pixmap
+
+    def _dropTile(self, key):
+        pixmap = self._tiles.pop(key)
+        self.tiles_bytes -= pixmap.width() * pixmap.height() * 4
+
+    def paintEvent(self, e):
+        with span('paint'):
+            self._paint(e)
+
+    def _paint(self, e):
+        if not self.pyramid.width or not self.pyramid.height:
+            return
+
+        # only tiles intersecting the visible part of the widget are drawn,
+        # taken from the pyramid level closest to the current size of the widget
+        level = self.pyramid.levelForScale(self.width() / self.pyramid.width)
+        if self.preview:
+            level = min(level + 1, self.pyramid.levelCount() - 1)
+        level_width, level_height = self.pyramid.levelSize(level)
+        kx = self.width() / level_width
+        ky = self.height() / level_height
+
+        rect = e.rect()
+        columns, rows = self.pyramid.tileRange(
+            level, rect.left() / kx, rect.top() / ky, (rect.right() + 1) / kx, (rect.bottom() + 1) / ky
+        )
+
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, not self.preview)
+        for row in rows:
+            for column in columns:
+                left, top, right, bottom = self.pyramid.tileBox(level, column, row)
+                target = QRectF(left * kx, top * ky, (right - left) * kx, (bottom - top) * ky)
+                painter.drawPixmap(target, self._tilePixmap(level, column, row),
+                                   QRectF(0, 0, right - left, bottom - top))
+        painter.end()
 
 
 class PicturesFrame(QFrame):
@@ -61,6 +211,10 @@ class PicturesFrame(QFrame):
     cursorCoordsChanged = pyqtSignal(float, float)
     cursorLeavesFrame = pyqtSignal()
     wheelZoom = pyqtSignal(float)
+    # (left, top, right, bottom) in pixels of pictures, emitted while the region is dragged with the right button
+    regionSelected = pyqtSignal(float, float, float, float)
+    # emitted when the selected region is cleared by a right click
+    regionCleared = pyqtSignal()
 
     def __init__(self):
         super().__init__()
@@ -70,9 +224,6 @@ class PicturesFrame(QFrame):
         self.setStyleSheet("background-color: rgb(255, 255, 255);")
         self.setMouseTracking(True)
 
-        self.pics = []
-        self.pics_sizes = []
-
         self.pos = (50, 50)
         self.prev_mouse_pos = (0, 0)
 
@@ -80,16 +231,37 @@ class PicturesFrame(QFrame):
         self.persistent_scale_array = [1]
         self.scale_index = 0
 
-    def addPicture(self, *args):
-        self.pics.append(Picture(self, *args))
-        self.pics[-1].move(*self.pos)
-        self.pics[-1].show()
+        # wheel and drag events are merged and applied once per frame,
+        # the gesture ends when there was no input for RENDER_IDLE_MS
+        self._pending_zoom = 1
+        self._pending_move = False
+        self._gesture = False
+
+        self._frame_timer = QTimer(self)
+        self._frame_timer.setSingleShot(True)
+        self._frame_timer.setInterval(RENDER_FRAME_MS)
+        self._frame_timer.timeout.connect(self._renderFrame)
+
+        self._idle_timer = QTimer(self)
+        self._idle_timer.setSingleShot(True)
+        self._idle_timer.setInterval(RENDER_IDLE_MS)
+        self._idle_timer.timeout.connect(self._finishGesture)
+
+        # all pictures are layers of one canvas
+        self.canvas = Canvas(self)
+        self.canvas.move(*self.pos)
 
-        w, h = self.pics[-1].size().width(), self.pics[-1].size().height()
-        w *= self.scale
-        h *= self.scale
-        self.pics[-1].resize(w, h)
-        self.pics_sizes.append((w, h))
+        self.rubber_band = QRubberBand(QRubberBand.Rectangle, self)
+        self._region_origin = None
+        # the last selected region in pixels of pictures, stays shown by the rubber band
+        self.region = None
+
+    def addPicture(self, source, kind='image', offset=(0, 0)):
+        self.canvas.addLayer(Layer(source, kind, offset=offset))
+        self._zoomPicturesSilent(1)
+
+    def pictureCount(self):
+        return len(self.canvas.composite.layers)
 
     def setScale(self, scale):
         '''
@@ -100,6 +272,8 @@ class PicturesFrame(QFrame):
             Otherwise does nothing.
         '''
 
+        self._flushGesture()
+
         if ZOOM_MIN <= scale <= ZOOM_MAX:
             self._zoomPicturesSilent(scale / self.scale)
 
@@ -114,12 +288,10 @@ class PicturesFrame(QFrame):
              without any additional checks and actions
         '''
 
-        for i in range(len(self.pics)):
-            w, h = self.pics_sizes[i]
-            w *= zoom
-            h *= zoom
-            self.pics[i].resize(w, h)
-            self.pics_sizes[i] = (w, h)
+        with span('zoom'):
+            scale = self.scale * zoom
+            self.canvas.resize(round(self.canvas.composite.width * scale), round(self.canvas.composite.height * scale))
+            self._placeRubberBand(scale)
 
     def zoomPictures(self, zoom):
         '''
@@ -130,6 +302,8 @@ class PicturesFrame(QFrame):
             Otherwise does nothing.
         '''
 
+        self._flushGesture()
+
         if ZOOM_MIN <= self.scale * zoom <= ZOOM_MAX:
             self._zoomPicturesSilent(zoom)
 
@@ -139,6 +313,8 @@ class PicturesFrame(QFrame):
             self.scale_index += 1
 
     def prevScale(self):
+        self._flushGesture()
+
         if self.scale_index > 0:
             prev_scale = self.scale
             self.scale_index -= 1
@@ -147,6 +323,8 @@ class PicturesFrame(QFrame):
             self._zoomPicturesSilent(self.scale / prev_scale)
 
     def nextScale(self):
+        self._flushGesture()
+
         if self.scale_index + 1 < len(self.persistent_scale_array):
             prev_scale = self.scale
             self.scale_index += 1
@@ -154,11 +332,64 @@ class PicturesFrame(QFrame):
 
             self._zoomPicturesSilent(self.scale / prev_scale)
 
+    def _scheduleFrame(self):
+        if not self._frame_timer.isActive():
+            self._frame_timer.start()
+
+    def _renderFrame(self):
+        '''
+            Applies zoom and pan accumulated since the previous frame
+            and renders pictures in preview quality until the gesture ends
+        '''
+
+        if not self._gesture:
+            self._gesture = True
+            self.canvas.preview = True
+
+        scale = min(max(self.scale * self._pending_zoom, ZOOM_MIN), ZOOM_MAX)
+        self._pending_zoom = 1
+        if scale != self.scale:
+            self._zoomPicturesSilent(scale / self.scale)
+            self.scale = scale
+            self.wheelZoom.emit(self.scale)
+
+        if self._pending_move:
+            self._pending_move = False
+            with span('pan'):
+                self.canvas.move(*self.pos)
+                self._placeRubberBand(self.scale)
+
+        self._idle_timer.start()
+
+    def _finishGesture(self):
+        '''
+            Renders pictures in full quality and records the whole gesture
+            as one entry of the scale history
+        '''
+
+        self._idle_timer.stop()
+        if not self._gesture:
+            return
+        self._gesture = False
+
+        self.canvas.preview = False
+        self.canvas.update()
+
+        if self.scale != self.persistent_scale_array[self.scale_index]:
+            self.persistent_scale_array = self.persistent_scale_array[:self.scale_index + 1]
+            self.persistent_scale_array.append(self.scale)
+            self.scale_index += 1
+
+    def _flushGesture(self):
+        if self._frame_timer.isActive():
+            self._frame_timer.stop()
+            self._renderFrame()
+        self._finishGesture()
+
     def deletePicture(self, index):
-        if 0 <= index < len(self.pics):
-            self.pics[index].deleteLater()
-            self.pics.pop(index)
-            self.pics_sizes.pop(index)
+        if 0 <= index < self.pictureCount():
+            self.canvas.removeLayer(index)
+            self._zoomPicturesSilent(1)
         else:
             raise RuntimeError('PicturesFrame.deletePicture: index out of range')
 
@@ -166,9 +397,11 @@ class PicturesFrame(QFrame):
         # move pictures
         if e.buttons() == Qt.LeftButton:
             self.pos = (self.pos[0] + e.x() - self.prev_mouse_pos[0], self.pos[1] + e.y() - self.prev_mouse_pos[1])
-            for pic in self.pics:
-                pic.move(*self.pos)
+            self._pending_move = True
+            self._scheduleFrame()
             self.prev_mouse_pos = (e.x(), e.y())
+        elif e.buttons() == Qt.RightButton and self._region_origin is not None:
+            self._selectRegion(e)
         # emit signal cursorCoordsChanged
         x = (e.x() - self.pos[0]) / self.scale
         y = (self.pos[1] - e.y()) / self.scale
@@ -177,8 +410,8 @@ class PicturesFrame(QFrame):
     def wheelEvent(self, e):
         angle = e.angleDelta().y() / 8
         # angle < 0    - на себя (zoom in)
-        self.zoomPictures(WHEEL_SCALING_COEF ** (-angle))
-        self.wheelZoom.emit(self.scale)
+        self._pending_zoom *= WHEEL_SCALING_COEF ** (-angle)
+        self._scheduleFrame()
 
     def enterEvent(self, e):
         self.setCursor(Qt.OpenHandCursor)
@@ -191,9 +424,43 @@ class PicturesFrame(QFrame):
         if e.buttons() == Qt.LeftButton:
             self.setCursor(Qt.ClosedHandCursor)
             self.prev_mouse_pos = (e.x(), e.y())
+        elif e.buttons() == Qt.RightButton:
+            self._region_origin = e.pos()
+            self.rubber_band.setGeometry(QRect(self._region_origin, QSize()))
+            self.rubber_band.show()
 
     def mouseReleaseEvent(self, e):
+        if e.button() == Qt.RightButton and self._region_origin is not None:
+            dragged = (e.pos() - self._region_origin).manhattanLength() >= QApplication.startDragDistance()
+            self._selectRegion(e)
+            self._region_origin = None
+            if not dragged:
+                self.region = None
+                self.rubber_band.hide()
+                self.regionCleared.emit()
+            return
         self.setCursor(Qt.OpenHandCursor)
+        self._flushGesture()
+
+    def _selectRegion(self, e):
+        rect = QRect(self._region_origin, e.pos()).normalized()
+        self.rubber_band.setGeometry(rect)
+        self.region = (
+            (rect.left() - self.pos[0]) / self.scale,
+            (rect.top() - self.pos[1]) / self.scale,
+            (rect.right() + 1 - self.pos[0]) / self.scale,
+            (rect.bottom() + 1 - self.pos[1]) / self.scale,
+        )
+        self.regionSelected.emit(*self.region)
+
+    def _placeRubberBand(self, scale):
+        # the selected region follows pictures when they are zoomed or moved
+        if self.region is None or self._region_origin is not None:
+            return
+        left, top, right, bottom = self.region
+        self.rubber_band.setGeometry(QRectF(
+            self.pos[0] + left * scale, self.pos[1] + top * scale, (right - left) * scale, (bottom - top) * scale
+        ).toAlignedRect())
 
 
 class PicturesList(QListWidget):
@@ -225,19 +492,41 @@ class CentralWidget(QWidget):
 
     def initUI(self):
 
-        self.pil_image_pictures = []
+        self.raster_sources = []
+        # LazySummedAreaTable of each change mask, None for pictures
+        self.summed_area_tables = []
+        # tables are built in background, id(table) -> AlgorithmJob building it
+        self.summed_area_jobs = {}
+        self.summed_area_pool = QThreadPool()
+        self.summed_area_pool.setMaxThreadCount(1)
+        self.summed_area_timer = QTimer(self)
+        self.summed_area_timer.setSingleShot(True)
+        self.summed_area_timer.setInterval(SUMMED_AREA_REBUILD_MS)
+        self.summed_area_timer.timeout.connect(self.buildSummedAreaTables)
+        # decoded pixels of pictures and results, and summed-area tables, are evicted beyond the budget
+        self.layer_memory = LayerMemoryManager()
+
+        self.result_cache = ResultCache()
+
+        self.algorithm_jobs = AlgorithmJobQueue(ALGORITHM_WORKERS)
+        self.algorithm_jobs.jobsChanged.connect(self.algorithmJobsChanged)
 
         self.makeAlgorithmsPanel()
         self.makePicturesListPanel()
         self.makeBottomPanel()
 
         self.pic_frame = PicturesFrame()
+        self.pic_frame.canvas.memory = self.layer_memory
         self.pic_frame.cursorLeavesFrame.connect(lambda: self.bottom_coords_line.setText(''))
+        self.pic_frame.cursorLeavesFrame.connect(lambda: self.bottom_changes_line.setText(''))
         self.pic_frame.cursorCoordsChanged.connect(
             lambda x, y: self.bottom_coords_line.setText(
                 str(round(x, CURSOR_COORDS_ROUND_DIGITS)) + ',' + str(round(y, CURSOR_COORDS_ROUND_DIGITS))
             )
         )
+        self.pic_frame.cursorCoordsChanged.connect(self.showNeighbourhoodChanges)
+        self.pic_frame.regionSelected.connect(self.showRegionChanges)
+        self.pic_frame.regionCleared.connect(lambda: self.bottom_region_line.setText(''))
         self.pic_frame.wheelZoom.connect(
             lambda scale: self.bottom_scale_line.setText(str(round(scale, SCALING_ROUND_DIGITS)))
         )
@@ -297,19 +586,109 @@ class CentralWidget(QWidget):
         h4.addWidget(l4)
         h4.addWidget(self.algorithm_result_picture_name_line)
 
+        h5 = QHBoxLayout()
+        self.tiled_mode_checkbox = QCheckBox('Full resolution (tiled)')
+        l5_size = QLabel()
+        l5_size.setText('Tile')
+        self.tile_size_spinbox = QSpinBox()
+        self.tile_size_spinbox.setRange(32, 4096)
+        self.tile_size_spinbox.setValue(TILE_SIZE)
+        l5_overlap = QLabel()
+        l5_overlap.setText('Overlap')
+        self.tile_overlap_spinbox = QSpinBox()
+        self.tile_overlap_spinbox.setRange(0, 2048)
+        self.tile_overlap_spinbox.setValue(TILE_OVERLAP)
+        self.region_mode_checkbox = QCheckBox('Selected region only')
+        self.region_mode_checkbox.setToolTip(
+            'Process at native resolution only the region dragged over the pictures with the right mouse button'
+        )
+        h5.addWidget(self.tiled_mode_checkbox)
+        h5.addWidget(self.region_mode_checkbox)
+        h5.addWidget(l5_size)
+        h5.addWidget(self.tile_size_spinbox)
+        h5.addWidget(l5_overlap)
+        h5.addWidget(self.tile_overlap_spinbox)
+
         self.btn_apply_algorithm = QPushButton('Apply algorithm')
         self.btn_apply_algorithm.clicked.connect(self.applyAlgorithm)
 
+        h_set = QHBoxLayout()
+        self.algorithms_set_list = QListWidget()
+        for algorithm_name in algorithms.keys():
+            item = QListWidgetItem(algorithm_name)
+            item.setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled)
+            item.setCheckState(Qt.Checked)
+            self.algorithms_set_list.addItem(item)
+        self.algorithms_set_list.setMaximumHeight(
+            self.algorithms_set_list.sizeHintForRow(0) * min(4, len(algorithms)) + 4
+        )
+        v_set = QVBoxLayout()
+        self.ensemble_checkbox = QCheckBox('Ensemble layer')
+        self.ensemble_checkbox.setToolTip('Also add the mean change probability of the checked algorithms')
+        self.btn_apply_algorithms = QPushButton('Apply checked algorithms')
+        self.btn_apply_algorithms.setToolTip('Compare the pictures by every checked algorithm in one run')
+        self.btn_apply_algorithms.clicked.connect(self.applyAlgorithms)
+        v_set.addWidget(self.ensemble_checkbox)
+        v_set.addWidget(self.btn_apply_algorithms)
+        h_set.addWidget(self.algorithms_set_list)
+        h_set.addLayout(v_set)
+
+        h_series = QHBoxLayout()
+        l_series = QLabel()
+        l_series.setText('Time series')
+        self.series_mode_combobox = QComboBox()
+        for mode in SERIES_MODES:
+            self.series_mode_combobox.addItem(mode)
+        self.btn_apply_algorithm_series = QPushButton('Apply to all pictures')
+        self.btn_apply_algorithm_series.setToolTip(
+            'Compare checked pictures in the order of the list: the first one with each next one (reference)\n'
+            'or each one with the next one (sequential)'
+        )
+        self.btn_apply_algorithm_series.clicked.connect(self.applyAlgorithmSeries)
+        h_series.addWidget(l_series)
+        h_series.addWidget(self.series_mode_combobox)
+        h_series.addWidget(self.btn_apply_algorithm_series)
+
+        h_threshold = QHBoxLayout()
+        l_threshold = QLabel()
+        l_threshold.setText('Threshold')
+        self.threshold_slider = QSlider(Qt.Horizontal)
+        self.threshold_slider.setRange(0, 100)
+        self.threshold_slider.setValue(round(CHANGE_THRESHOLD * 100))
+        self.threshold_slider.setToolTip('Change probability above which pixels of results are changes')
+        self.threshold_label = QLabel()
+        self.threshold_label.setText('{:.2f}'.format(CHANGE_THRESHOLD))
+        self.threshold_slider.valueChanged.connect(self.thresholdChanged)
+        h_threshold.addWidget(l_threshold)
+        h_threshold.addWidget(self.threshold_slider)
+        h_threshold.addWidget(self.threshold_label)
+
+        h6 = QHBoxLayout()
+        self.algorithm_jobs_label = QLabel()
+        self.algorithm_progress_bar = QProgressBar()
+        self.btn_cancel_algorithms = QPushButton('Cancel')
+        self.btn_cancel_algorithms.clicked.connect(self.algorithm_jobs.cancelAll)
+        h6.addWidget(self.algorithm_jobs_label)
+        h6.addWidget(self.algorithm_progress_bar)
+        h6.addWidget(self.btn_cancel_algorithms)
+
         vbox = QVBoxLayout()
         vbox.addLayout(h1)
         vbox.addLayout(h2)
         vbox.addLayout(h3)
         vbox.addLayout(h4)
+        vbox.addLayout(h5)
         vbox.addWidget(self.btn_apply_algorithm)
+        vbox.addLayout(h_set)
+        vbox.addLayout(h_series)
+        vbox.addLayout(h_threshold)
+        vbox.addLayout(h6)
 
         self.algorithms_panel = QGroupBox('Change detection algorithms')
         self.algorithms_panel.setLayout(vbox)
 
+        self.algorithmJobsChanged()
+
     def makePicturesListPanel(self):
 
         self.pictures_list = PicturesList()
@@ -325,8 +704,29 @@ class CentralWidget(QWidget):
         self.btn_delete_picture.setVisible(False)
         self.btn_delete_picture.clicked.connect(self.deleteSelectedPicture)
 
+        h_layer = QHBoxLayout()
+        l_opacity = QLabel()
+        l_opacity.setText('Opacity')
+        self.layer_opacity_slider = QSlider(Qt.Horizontal)
+        self.layer_opacity_slider.setRange(0, 100)
+        self.layer_opacity_slider.valueChanged.connect(self.layerOpacityChanged)
+        l_colormap = QLabel()
+        l_colormap.setText('Colours')
+        self.layer_colormap_combobox = QComboBox()
+        for colormap in COLORMAPS.keys():
+            self.layer_colormap_combobox.addItem(colormap)
+        self.layer_colormap_combobox.currentTextChanged.connect(self.layerColormapChanged)
+        h_layer.addWidget(l_opacity)
+        h_layer.addWidget(self.layer_opacity_slider)
+        h_layer.addWidget(l_colormap)
+        h_layer.addWidget(self.layer_colormap_combobox)
+        self.layer_settings = QWidget()
+        self.layer_settings.setLayout(h_layer)
+        self.layer_settings.setVisible(False)
+
         vbox = QVBoxLayout()
         vbox.addWidget(self.pictures_list)
+        vbox.addWidget(self.layer_settings)
         vbox.addWidget(self.btn_load_picture)
         vbox.addWidget(self.btn_delete_picture)
 
@@ -365,6 +765,24 @@ class CentralWidget(QWidget):
         self.bottom_scale_line.returnPressed.connect(self.scaleLineEditChangedByUser)
         hbox.addWidget(self.bottom_scale_line)
 
+        l4 = QLabel()
+        l4.setText('Changes:')
+        l4.setToolTip('Changed pixels of the top change mask around the cursor')
+        hbox.addWidget(l4)
+
+        self.bottom_changes_line = QLineEdit()
+        self.bottom_changes_line.setReadOnly(True)
+        hbox.addWidget(self.bottom_changes_line)
+
+        l5 = QLabel()
+        l5.setText('Region:')
+        l5.setToolTip('Changed pixels of the top change mask in the region dragged with the right mouse button')
+        hbox.addWidget(l5)
+
+        self.bottom_region_line = QLineEdit()
+        self.bottom_region_line.setReadOnly(True)
+        hbox.addWidget(self.bottom_region_line)
+
         self.bottom_panel = QWidget()
         self.bottom_panel.setLayout(hbox)
 
@@ -373,9 +791,12 @@ class CentralWidget(QWidget):
         path = QFileDialog.getOpenFileName(self, 'Open file')[0]
 
         if path:
-            self.pic_frame.addPicture(path)
+            source = openRaster(path)
+            self.pic_frame.addPicture(source)
 
-            self.pil_image_pictures.append(Image.open(path))
+            self.raster_sources.append(source)
+            self.summed_area_tables.append(None)
+            self.layer_memory.add(source)
 
             pic_name = path.split('/')[-1]
 
@@ -396,7 +817,7 @@ class CentralWidget(QWidget):
                 for index in range(self.pictures_list.count()):
                     if self.pictures_list.item(index).isSelected():
                         try:
-                            self.pil_image_pictures[index].convert('RGB').save(path)
+                            exportRaster(self.raster_sources[index], path)
                         except ValueError:
                             QMessageBox(
                                 QMessageBox.Warning,
@@ -404,22 +825,155 @@ class CentralWidget(QWidget):
                                 'Cannot save file because input filename is wrong.\nTry again.',
                                 QMessageBox.Ok
                             ).exec_()
+                        except OSError as e:
+                            # e.g. the format doesn't support the mode of the picture, or the disk is full
+                            QMessageBox(
+                                QMessageBox.Warning,
+                                'Cannot save file!',
+                                'Cannot save "' + path + '":\n' + str(e),
+                                QMessageBox.Ok
+                            ).exec_()
                         break
 
     def picturesListItemChanged(self):
         for index in range(self.pictures_list.count()):
             item = self.pictures_list.item(index)
-            self.pic_frame.pics[index].setVisible(item.checkState() == Qt.Checked)
+            self.pic_frame.canvas.setLayerVisible(index, item.checkState() == Qt.Checked)
+        self.enforceMemoryBudget()
+
+    def layerMemoryItems(self, index):
+        return [item for item in (self.raster_sources[index], self.summed_area_tables[index]) if item is not None]
+
+    def enforceMemoryBudget(self):
+        '''
+            Evicts memory of hidden layers, then of the least recently drawn ones, beyond LAYER_MEMORY_BUDGET
+        '''
+
+        layers = self.pic_frame.canvas.composite.layers
+        visible = [item for index in range(len(layers)) if layers[index].visible
+                   for item in self.layerMemoryItems(index)]
+        self.layer_memory.enforce(visible)
+
+    def memoryText(self):
+        return 'Layers: {}, tiles: {:.0f} MB'.format(self.layer_memory, self.pic_frame.canvas.tiles_bytes / 2 ** 20)
 
     def picturesListItemSelectionChanged(self):
         if self.pictures_list.selectedItems():
             self.btn_delete_picture.setVisible(True)
         else:
             self.btn_delete_picture.setVisible(False)
+        self.layer_settings.setVisible(False)
 
         for index in range(self.pictures_list.count()):
             if self.pictures_list.item(index).isSelected():
-                self.pic_frame.pics[index].raise_()
+                self.pic_frame.canvas.raiseLayer(index)
+
+                layer = self.pic_frame.canvas.composite.layers[index]
+                self.layer_opacity_slider.blockSignals(True)
+                self.layer_opacity_slider.setValue(round(layer.opacity * 100))
+                self.layer_opacity_slider.blockSignals(False)
+                self.layer_colormap_combobox.blockSignals(True)
+                self.layer_colormap_combobox.setCurrentText(layer.colormap)
+                self.layer_colormap_combobox.blockSignals(False)
+                self.layer_colormap_combobox.setEnabled(layer.hasColormap())
+                self.layer_settings.setVisible(True)
+
+    def selectedPictureIndex(self):
+        for index in range(self.pictures_list.count()):
+            if self.pictures_list.item(index).isSelected():
+                return index
+        return -1
+
+    def statsMaskIndex(self):
+        '''
+            Returns index of the change mask for region statistics: the selected one,
+            otherwise the top visible one, or -1 if there are no masks
+        '''
+
+        index = self.selectedPictureIndex()
+        if index >= 0 and isinstance(self.raster_sources[index], ThresholdRasterSource):
+            return index
+        layers = self.pic_frame.canvas.composite.layers
+        for layer in reversed(self.pic_frame.canvas.composite.order):
+            index = layers.index(layer)
+            if layer.visible and isinstance(self.raster_sources[index], ThresholdRasterSource):
+                return index
+        return -1
+
+    def summedAreaTable(self, index):
+        '''
+            Returns SummedAreaTable of result `index`, or None while it is being built
+        '''
+
+        table = self.summed_area_tables[index]
+        self.layer_memory.touch(table)
+        if table.get() is None:
+            self.buildSummedAreaTable(table)
+        return table.get()
+
+    def buildSummedAreaTable(self, table):
+        if id(table) in self.summed_area_jobs:
+            return
+        job = AlgorithmJob('Summed-area table', lambda progress, is_cancelled: table.build())
+        job.signals.finished.connect(lambda result: self.summed_area_jobs.pop(id(table), None))
+        job.signals.failed.connect(lambda message: self.summed_area_jobs.pop(id(table), None))
+        self.summed_area_jobs[id(table)] = job
+        self.summed_area_pool.start(job)
+
+    def buildSummedAreaTables(self):
+        for table in self.summed_area_tables:
+            if table is not None:
+                self.buildSummedAreaTable(table)
+
+    def regionChangesText(self, box):
+        index = self.statsMaskIndex()
+        if index < 0:
+            return ''
+        table = self.summedAreaTable(index)
+        if table is None:
+            return 'counting changes...'
+        x, y = self.pic_frame.canvas.composite.layers[index].offset
+        changed, total = table.count((box[0] - x, box[1] - y, box[2] - x, box[3] - y))
+        if not total:
+            return ''
+        return '{:.1f}% ({} px) {}'.format(100 * changed / total, changed, self.pictures_list.item(index).text())
+
+    def showNeighbourhoodChanges(self, x, y):
+        # y of the cursor grows upwards
+        half = REGION_STATS_NEIGHBOURHOOD / 2
+        self.bottom_changes_line.setText(self.regionChangesText((x - half, -y - half, x + half, -y + half)))
+
+    def showRegionChanges(self, left, top, right, bottom):
+        text = self.regionChangesText((left, top, right, bottom))
+        if text:
+            text = '{}x{}: '.format(round(right - left), round(bottom - top)) + text
+        self.bottom_region_line.setText(text)
+
+    def thresholdChanged(self, value):
+        '''
+            Thresholds all results again, their probability maps are kept so nothing is recomputed
+        '''
+
+        threshold = value / 100
+        self.threshold_label.setText('{:.2f}'.format(threshold))
+        for index, source in enumerate(self.raster_sources):
+            if isinstance(source, ThresholdRasterSource):
+                source.setThreshold(threshold)
+                self.summed_area_tables[index].evict()
+                self.pic_frame.canvas.updateLayer(index)
+        self.summed_area_timer.start()
+        self.bottom_changes_line.setText('')
+        self.bottom_region_line.setText('')
+
+    def layerOpacityChanged(self, value):
+        index = self.selectedPictureIndex()
+        if index >= 0:
+            self.pic_frame.canvas.setLayerOpacity(index, value / 100)
+
+    def layerColormapChanged(self, colormap):
+        index = self.selectedPictureIndex()
+        if index >= 0:
+            self.pic_frame.canvas.setLayerColormap(index, colormap)
 
     def deleteSelectedPicture(self):
 
@@ -434,7 +988,10 @@ class CentralWidget(QWidget):
 
                 self.pic_frame.deletePicture(index)
 
-                self.pil_image_pictures.pop(index)
+                for item in self.layerMemoryItems(index):
+                    self.layer_memory.remove(item)
+                self.raster_sources.pop(index).close()
+                self.summed_area_tables.pop(index)
 
                 self.pictures_list.unselectPicturesListItems()
                 break
@@ -483,24 +1040,257 @@ class CentralWidget(QWidget):
 
         if pic1_index >= 0 and pic2_index >= 0 and algorithm_name and result_picture_name:
             current_algo = algorithms[algorithm_name]
-            res_im = performAlgorithm(
-                current_algo,
-                self.pil_image_pictures[pic1_index],
-                self.pil_image_pictures[pic2_index],
+            inputs = self.algorithmInputs(pic1_index, pic2_index)
+            if inputs is None:
+                return
+            t1_source, t2_source, offset = inputs
+            # regions are always processed at native resolution
+            if self.tiled_mode_checkbox.isChecked() or self.region_mode_checkbox.isChecked():
+                tile_size = self.tile_size_spinbox.value()
+                overlap = self.tile_overlap_spinbox.value()
+                if overlap >= tile_size:
+                    QMessageBox(
+                        QMessageBox.Warning,
+                        'Wrong tiling parameters!',
+                        'Tile overlap must be less than tile size. Try again.',
+                        QMessageBox.Ok
+                    ).exec_()
+                    return
+                job = AlgorithmJob(
+                    result_picture_name,
+                    self.result_cache.perform,
+                    performAlgorithmTiled,
+                    current_algo,
+                    t1_source,
+                    t2_source,
+                    tile_size,
+                    overlap,
+                )
+            else:
+                job = AlgorithmJob(
+                    result_picture_name,
+                    self.result_cache.perform,
+                    performAlgorithm,
+                    current_algo,
+                    t1_source,
+                    t2_source,
+                )
+
+            reference_path = t1_source.georeferencePath()
+            job.signals.progress.connect(self.algorithmJobProgress)
+            job.signals.finished.connect(
+                lambda res_im: self.addAlgorithmResult(result_picture_name, res_im, reference_path, offset)
             )
+            job.signals.failed.connect(
+                lambda message: QMessageBox(
+                    QMessageBox.Warning,
+                    'Algorithm failed!',
+                    'Cannot get "' + result_picture_name + '":\n' + message,
+                    QMessageBox.Ok
+                ).exec_()
+            )
+            self.algorithm_jobs.submit(job)
+
+    def algorithmInputs(self, pic1_index, pic2_index):
+        '''
+            Returns (t1, t2, offset) of the pictures to compare and the position of their result on the canvas:
+            the whole pictures, or if 'Selected region only' is checked, their windows of the region
+            selected with the right mouse button. Shows a warning and returns None if there is no such region.
+        '''
 
-            self.pil_image_pictures.append(res_im)
+        t1_source = self.raster_sources[pic1_index]
+        t2_source = self.raster_sources[pic2_index]
+        if not self.region_mode_checkbox.isChecked():
+            return t1_source, t2_source, (0, 0)
+
+        box = None
+        if self.pic_frame.region is not None:
+            layers = self.pic_frame.canvas.composite.layers
+            boxes = [layers[pic1_index].box(), layers[pic2_index].box()]
+            left, top, right, bottom = self.pic_frame.region
+            box = (
+                max([math.floor(left)] + [b[0] for b in boxes]),
+                max([math.floor(top)] + [b[1] for b in boxes]),
+                min([math.ceil(right)] + [b[2] for b in boxes]),
+                min([math.ceil(bottom)] + [b[3] for b in boxes]),
+            )
+        if box is None or box[0] >= box[2] or box[1] >= box[3]:
+            QMessageBox(
+                QMessageBox.Warning,
+                'No region selected!',
+                'Drag a rectangle over both pictures with the right mouse button to select the region to process.',
+                QMessageBox.Ok
+            ).exec_()
+            return None
 
-            self.pic_frame.addPicture(res_im)
+        windows = []
+        for index, source in ((pic1_index, t1_source), (pic2_index, t2_source)):
+            x, y = self.pic_frame.canvas.composite.layers[index].offset
+            windows.append(WindowRasterSource(source, (box[0] - x, box[1] - y, box[2] - x, box[3] - y)))
+        return windows[0], windows[1], box[:2]
 
-            item = QListWidgetItem()
-            item.setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsDragEnabled | Qt.ItemIsEnabled | Qt.ItemIsSelectable)
-            item.setText(result_picture_name)
-            item.setCheckState(Qt.Checked)
-            self.pictures_list.addItem(item)
+    def applyAlgorithms(self):
+        pic1_index = self.pictures_combobox1.currentIndex()
+        pic2_index = self.pictures_combobox2.currentIndex()
+        result_picture_name = self.algorithm_result_picture_name_line.text()
+        algorithm_names = [
+            self.algorithms_set_list.item(index).text() for index in range(self.algorithms_set_list.count())
+            if self.algorithms_set_list.item(index).checkState() == Qt.Checked
+        ]
+        ensemble = self.ensemble_checkbox.isChecked() and len(algorithm_names) > 1
+
+        if not algorithm_names:
+            QMessageBox(
+                QMessageBox.Warning,
+                'No algorithms!',
+                'Check at least one algorithm to apply.',
+                QMessageBox.Ok
+            ).exec_()
+            return
+
+        if pic1_index >= 0 and pic2_index >= 0 and result_picture_name:
+            inputs = self.algorithmInputs(pic1_index, pic2_index)
+            if inputs is None:
+                return
+            t1_source, t2_source, offset = inputs
+            tiling = None
+            if self.tiled_mode_checkbox.isChecked() or self.region_mode_checkbox.isChecked():
+                tiling = (self.tile_size_spinbox.value(), self.tile_overlap_spinbox.value())
+                if tiling[1] >= tiling[0]:
+                    QMessageBox(
+                        QMessageBox.Warning,
+                        'Wrong tiling parameters!',
+                        'Tile overlap must be less than tile size. Try again.',
+                        QMessageBox.Ok
+                    ).exec_()
+                    return
+
+            result_cache = self.result_cache
+
+            def run(progress=None, is_cancelled=None):
+                results = performAlgorithms([algorithms[name] for name in algorithm_names], t1_source, t2_source,
+                                            tiling, progress, is_cancelled, result_cache)
+                return results, ensembleResult(results) if ensemble else None
+
+            def addResults(results, ensemble_im):
+                for algorithm_name, res_im in zip(algorithm_names, results):
+                    self.addAlgorithmResult(result_picture_name + ' ' + algorithm_name, res_im, reference_path, offset)
+                if ensemble_im is not None:
+                    self.addAlgorithmResult(result_picture_name + ' ensemble', ensemble_im, reference_path, offset)
+
+            reference_path = t1_source.georeferencePath()
+            job = AlgorithmJob(result_picture_name, run)
+            job.signals.progress.connect(self.algorithmJobProgress)
+            job.signals.finished.connect(lambda outputs: addResults(*outputs))
+            job.signals.failed.connect(
+                lambda message: QMessageBox(
+                    QMessageBox.Warning,
+                    'Algorithm failed!',
+                    'Cannot get "' + result_picture_name + '":\n' + message,
+                    QMessageBox.Ok
+                ).exec_()
+            )
+            self.algorithm_jobs.submit(job)
+
+    def applyAlgorithmSeries(self):
+        algorithm_name = self.algorithms_combobox.currentText()
+        result_picture_name = self.algorithm_result_picture_name_line.text()
+        mode = self.series_mode_combobox.currentText()
+
+        indices = [
+            index for index in range(self.pictures_list.count())
+            if self.pictures_list.item(index).checkState() == Qt.Checked
+            and self.pic_frame.canvas.composite.layers[index].kind == 'image'
+        ]
+        if len(indices) < 2:
+            QMessageBox(
+                QMessageBox.Warning,
+                'Not enough pictures!',
+                'Check at least 2 loaded pictures to compare them as a time series.',
+                QMessageBox.Ok
+            ).exec_()
+            return
+
+        if algorithm_name and result_picture_name:
+            names = [self.pictures_list.item(index).text() for index in indices]
+            reference_paths = [self.raster_sources[index].georeferencePath() for index in indices]
+            job = AlgorithmJob(
+                result_picture_name,
+                performAlgorithmSeries,
+                algorithms[algorithm_name],
+                [self.raster_sources[index] for index in indices],
+                mode,
+            )
+            job.signals.progress.connect(self.algorithmJobProgress)
+            job.signals.finished.connect(
+                lambda results: [
+                    self.addAlgorithmResult(
+                        result_picture_name + ' ' + names[i] + ' - ' + names[j], res_im, reference_paths[i]
+                    )
+                    for i, j, res_im in results
+                ]
+            )
+            job.signals.failed.connect(
+                lambda message: QMessageBox(
+                    QMessageBox.Warning,
+                    'Algorithm failed!',
+                    'Cannot get "' + result_picture_name + '":\n' + message,
+                    QMessageBox.Ok
+                ).exec_()
+            )
+            self.algorithm_jobs.submit(job)
+
+    def addAlgorithmResult(self, result_picture_name, res_im, reference_path=None, offset=(0, 0)):
+        # `res_im` holds change probabilities, shown thresholded by the slider
+        source = ThresholdRasterSource(asMaskRasterSource(res_im), self.threshold_slider.value() / 100)
+        source.reference_path = reference_path
+        self.raster_sources.append(source)
+        self.summed_area_tables.append(LazySummedAreaTable(source))
+        self.layer_memory.add(source)
+        self.layer_memory.add(self.summed_area_tables[-1])
+        self.buildSummedAreaTable(self.summed_area_tables[-1])
+
+        self.pic_frame.addPicture(source, 'mask', offset)
+
+        item = QListWidgetItem()
+        item.setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsDragEnabled | Qt.ItemIsEnabled | Qt.ItemIsSelectable)
+        item.setText(result_picture_name)
+        item.setCheckState(Qt.Checked)
+        self.pictures_list.addItem(item)
+
+        self.pictures_combobox1.addItem(result_picture_name)
+        self.pictures_combobox2.addItem(result_picture_name)
+
+    def algorithmJobProgress(self, done, total):
+        self.algorithm_progress_bar.setMaximum(total)
+        self.algorithm_progress_bar.setValue(done)
+
+    def algorithmJobsChanged(self):
+        njobs = self.algorithm_jobs.count()
+        if njobs:
+            self.algorithm_jobs_label.setText('Running: ' + self.algorithm_jobs.jobs[0].name +
+                                              (' (+' + str(njobs - 1) + ' queued)' if njobs > 1 else ''))
+        else:
+            self.algorithm_jobs_label.setText('Throughput: ' + str(batch_stats) +
+                                              '\nCache: ' + str(self.result_cache.stats) +
+                                              '\nFeatures: ' + str(feature_cache.stats))
+        self.algorithm_progress_bar.reset()
+        self.algorithm_jobs_label.setVisible(njobs > 0 or batch_stats.pairs > 0 or self.result_cache.stats.hits() > 0)
+        self.algorithm_progress_bar.setVisible(njobs > 0)
+        self.btn_cancel_algorithms.setVisible(njobs > 0)
+
+    def cancelAlgorithms(self):
+        self.algorithm_jobs.cancelAll()
+        self.algorithm_jobs.waitForDone()
+
+    def clearCaches(self):
+        '''
+            Forgets cached results, in memory and on disk, and features, e.g. to free the disk
+        '''
 
-            self.pictures_combobox1.addItem(result_picture_name)
-            self.pictures_combobox2.addItem(result_picture_name)
+        self.result_cache.clear()
+        feature_cache.clear()
+        self.algorithmJobsChanged()
 
 
 class MainWindow(QMainWindow):
@@ -511,12 +1301,14 @@ class MainWindow(QMainWindow):
 
     def initUI(self):
 
+        self.warm_up_job = None
         self.central_widget = CentralWidget()
         self.setCentralWidget(self.central_widget)
 
         self.createActions()
         self.makeMenu()
         self.makeToolbar()
+        self.makeStatusBar()
 
         self.setWindowTitle('Change detection')
         self.setWindowIcon(QIcon('project_data/icons/icon.png'))
@@ -564,6 +1356,22 @@ class MainWindow(QMainWindow):
         nextScalePicturesAction.triggered.connect(self.central_widget.nextPicturesScale)
         self.actions['next_scale'] = nextScalePicturesAction
 
+        timingAction = QAction('Record timing', self)
+        timingAction.setCheckable(True)
+        timingAction.setStatusTip('Record timing of decoding, resampling, inference and rendering')
+        timingAction.toggled.connect(self.setTimingEnabled)
+        self.actions['timing'] = timingAction
+
+        exportTraceAction = QAction('Export timing trace', self)
+        exportTraceAction.setStatusTip('Save recorded timing as Chrome trace JSON')
+        exportTraceAction.triggered.connect(self.showExportTraceDialog)
+        self.actions['export_trace'] = exportTraceAction
+
+        clearCachesAction = QAction('Clear caches', self)
+        clearCachesAction.setStatusTip('Forget cached results of algorithms and features of pictures')
+        clearCachesAction.triggered.connect(self.central_widget.clearCaches)
+        self.actions['clear_caches'] = clearCachesAction
+
     def makeMenu(self):
         menubar = self.menuBar()
 
@@ -580,6 +1388,10 @@ class MainWindow(QMainWindow):
         viewMenu.addSeparator()
         viewMenu.addAction(self.actions['prev_scale'])
         viewMenu.addAction(self.actions['next_scale'])
+        viewMenu.addSection('Diagnostics')
+        viewMenu.addAction(self.actions['timing'])
+        viewMenu.addAction(self.actions['export_trace'])
+        viewMenu.addAction(self.actions['clear_caches'])
 
     def makeToolbar(self):
         self.toolbar = self.addToolBar('Main toolbar')
@@ -592,11 +1404,95 @@ class MainWindow(QMainWindow):
         self.toolbar.addAction(self.actions['prev_scale'])
         self.toolbar.addAction(self.actions['next_scale'])
 
+    def makeStatusBar(self):
+        self.startup_label = QLabel()
+        self.statusBar().addPermanentWidget(self.startup_label)
+        self.memory_label = QLabel()
+        self.memory_label.setToolTip('Memory of decoded layers and their budget, memory of cached tiles of the view')
+        self.statusBar().addPermanentWidget(self.memory_label)
+
+        # layers are read while they are drawn, so the budget is checked periodically
+        self.memory_timer = QTimer(self)
+        self.memory_timer.setInterval(1000)
+        self.memory_timer.timeout.connect(self.updateMemory)
+        self.memory_timer.start()
+
+        self.timing_label = QLabel()
+        self.statusBar().addPermanentWidget(self.timing_label)
+
+        self.timing_timer = QTimer(self)
+        self.timing_timer.setInterval(1000)
+        self.timing_timer.timeout.connect(lambda: self.timing_label.setText(profiling.summaryText()))
+
+    def updateMemory(self):
+        self.central_widget.enforceMemoryBudget()
+        self.memory_label.setText(self.central_widget.memoryText())
+
+    def startWarmUp(self):
+        '''
+            Reports startup time and loads the models in background, so the window is usable at once
+            and the first run of an algorithm doesn't wait for the model
+        '''
+
+        startup_text = 'Started in {:.1f} s'.format(time.perf_counter() - _startup_start)
+        self.startup_label.setText(startup_text)
+        if not WARM_UP_ON_STARTUP:
+            return
+
+        self.startup_label.setText(startup_text + ', loading models...')
+        self.warm_up_job = AlgorithmJob('Warm-up', warmUpAlgorithms)
+        self.warm_up_job.signals.finished.connect(
+            lambda seconds: self.startup_label.setText(startup_text + self.warmUpText(seconds))
+        )
+        self.warm_up_job.signals.failed.connect(
+            lambda message: self.startup_label.setText(startup_text + ', models not loaded: ' + message)
+        )
+        QThreadPool.globalInstance().start(self.warm_up_job)
+
+    @staticmethod
+    def warmUpText(seconds):
+        text = ''
+        if modelLoadSeconds() is not None:
+            text += ', model loaded in {:.1f} s'.format(modelLoadSeconds())
+        return text + ', ready in {:.1f} s'.format(sum(seconds.values()))
+
+    def setTimingEnabled(self, enabled):
+        profiling.setEnabled(enabled)
+        if enabled:
+            profiling.reset()
+            self.timing_timer.start()
+        else:
+            self.timing_timer.stop()
+        self.timing_label.setText(profiling.summaryText() if enabled else '')
+
+    def showExportTraceDialog(self):
+        path = QFileDialog.getSaveFileName(self, 'Export timing trace', 'trace.json', 'Chrome trace (*.json)')[0]
+        if path:
+            try:
+                profiling.exportChromeTrace(path)
+            except OSError as e:
+                QMessageBox(
+                    QMessageBox.Warning,
+                    'Cannot export trace!',
+                    'Cannot write the trace file:\n' + str(e),
+                    QMessageBox.Ok
+                ).exec_()
+
+    def shutDown(self):
+        '''
+            Cancels the model warm-up and running algorithms before the application exits
+        '''
+
+        if self.warm_up_job is not None:
+            self.warm_up_job.cancel()
+        self.central_widget.cancelAlgorithms()
+
     def quit(self):
         reply = QMessageBox.question(self, 'Exit',
                                      "Are you sure to quit? All unsaved changes will be lost.",
                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
+            self.shutDown()
             qApp.quit()
 
     def closeEvent(self, event):
@@ -604,6 +1500,7 @@ class MainWindow(QMainWindow):
                                      "Are you sure to quit? All unsaved changes will be lost.",
                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
+            self.shutDown()
             event.accept()
         else:
             event.ignore()
@@ -612,4 +1509,6 @@ class MainWindow(QMainWindow):
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     w = MainWindow()
+    # after the first paint of the window
+    QTimer.singleShot(0, w.startWarmUp)
     sys.exit(app.exec_())
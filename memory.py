@@ -0,0 +1,81 @@
+'''
+    Memory budget of layers.
+
+    Layers hold memory which can be given back and taken again on demand: decoded pictures
+    (decoded again from their files), probability maps of results (kept compressed, see CompactArrayRasterSource),
+    summed-area tables (built again). LayerMemoryManager tracks such items in the order they were used
+    and evicts them when together they take more than the budget: hidden layers first,
+    then visible ones which were not drawn for the longest time.
+
+    An item is any object with `residentBytes()` - bytes it can release, and `evict()` which releases them.
+
+    Example:
+        memory = LayerMemoryManager(1024 ** 3)
+        memory.add(source)
+        memory.touch(source)    # on every read
+        memory.enforce(visible=[source])
+'''
+
+import threading
+from collections import OrderedDict
+from constants import LAYER_MEMORY_BUDGET
+
+
+class LayerMemoryManager:
+
+    def __init__(self, budget=LAYER_MEMORY_BUDGET):
+        self.budget = budget
+        self.evictions = 0
+        # id(item) -> item, from the least recently used
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, item):
+        with self._lock:
+            self._items[id(item)] = item
+
+    def remove(self, item):
+        with self._lock:
+            self._items.pop(id(item), None)
+
+    def touch(self, item):
+        with self._lock:
+            if id(item) in self._items:
+                self._items.move_to_end(id(item))
+
+    def residentBytes(self):
+        with self._lock:
+            items = list(self._items.values())
+        return sum(item.residentBytes() for item in items)
+
+    def enforce(self, visible=()):
+        '''
+            Evicts items until they fit into the budget: items not in `visible` first,
+            then visible ones in LRU order. The most recently used item is never evicted.
+            Returns number of bytes released.
+        '''
+
+        with self._lock:
+            items = list(self._items.values())
+        used = sum(item.residentBytes() for item in items)
+        if used <= self.budget:
+            return 0
+
+        visible_ids = set(id(item) for item in visible)
+        candidates = [item for item in items[:-1] if id(item) not in visible_ids]
+        candidates += [item for item in items[:-1] if id(item) in visible_ids]
+
+        released = 0
+        for item in candidates:
+            if used - released <= self.budget:
+                break
+            nbytes = item.residentBytes()
+            if nbytes:
+                item.evict()
+                released += nbytes - item.residentBytes()
+                self.evictions += 1
+        return released
+
+    def __str__(self):
+        return '{:.0f} of {:.0f} MB, {} evictions'.format(self.residentBytes() / 2 ** 20, self.budget / 2 ** 20,
+                                                          self.evictions)
@@ -0,0 +1,201 @@
+'''
+    Streaming pipeline of stages running concurrently in threads.
+
+    Each Stage has its own workers and takes items from a bounded queue filled by the previous
+    stage, so reading the next windows, preprocessing, inference and stitching of finished tiles
+    overlap and the wall-clock time approaches the time of the slowest stage.
+    NumPy, PIL and the inference runtimes release the GIL in their heavy parts.
+    Results are yielded in the order of input items, whatever order the workers finish in.
+
+    Example:
+        pipeline = Pipeline([Stage('read', read, workers=2), Stage('inference', infer, batch_size=8)])
+        for result in pipeline.map(boxes):
+            stitch(result)
+'''
+
+import queue
+import threading
+import time
+from constants import PIPELINE_QUEUE_SIZE
+
+# how often blocked workers check whether the pipeline is stopped
+_POLL_SECONDS = 0.1
+
+
+class Stage:
+    '''
+        Step of a Pipeline: `func(item)` returning the item of the next stage, run by `workers` threads.
+
+        If `batch_size` is given, `func` takes a list of items and returns a list of results.
+        A batch is made of items already waiting in the queue, so batches grow
+        only when the stage is the bottleneck. `batch_size` may be a callable
+        returning the size for the first item (e.g. batchSizeForBudget).
+    '''
+
+    def __init__(self, name, func, workers=1, batch_size=None):
+        if workers < 1:
+            raise ValueError('Stage: workers must be at least 1')
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.batch_size = batch_size
+
+
+class PipelineStats:
+    '''
+        Thread safe busy time and number of items of each stage.
+        Busy time divided by workers of the stage shows the bottleneck.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.items = {}
+        self.seconds = {}
+
+    def add(self, name, items, seconds):
+        with self._lock:
+            self.items[name] = self.items.get(name, 0) + items
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def reset(self):
+        with self._lock:
+            self.items.clear()
+            self.seconds.clear()
+
+    def __str__(self):
+        with self._lock:
+            return ' | '.join(
+                '{} {} items {:.0f} ms'.format(name, self.items[name], self.seconds[name] * 1000)
+                for name in self.items
+            )
+
+
+# put to the output after the last item, with the number of items
+_END = object()
+
+
+class _Failure:
+
+    __slots__ = ('exception',)
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class Pipeline:
+    '''
+        Runs items through `stages` one after another.
+        Queues between stages hold at most `queue_size` items, and at most `max_in_flight` items
+        are taken from the input before their results are yielded (by default enough
+        to keep every queue and worker busy), so memory use doesn't depend on the number of items.
+    '''
+
+    def __init__(self, stages, queue_size=PIPELINE_QUEUE_SIZE, max_in_flight=None, stats=None):
+        if not stages:
+            raise ValueError('Pipeline: no stages')
+        self.stages = stages
+        self.queue_size = queue_size
+        if max_in_flight is None:
+            max_in_flight = queue_size * len(stages) + sum(stage.workers for stage in stages)
+        self.max_in_flight = max_in_flight
+        self.stats = stats if stats is not None else PipelineStats()
+
+    def map(self, items):
+        '''
+            Yields results of the last stage for `items` in their order.
+            An exception raised by a stage or by iterating `items` stops the pipeline
+            and is raised here. Stopping the iteration early stops the workers too.
+        '''
+
+        stop = threading.Event()
+        in_flight = threading.BoundedSemaphore(self.max_in_flight)
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        output = queue.Queue()
+
+        def put(q, entry):
+            while not stop.is_set():
+                try:
+                    q.put(entry, timeout=_POLL_SECONDS)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=_POLL_SECONDS)
+                except queue.Empty:
+                    pass
+            return None
+
+        def feed():
+            count = 0
+            try:
+                for item in items:
+                    while not in_flight.acquire(timeout=_POLL_SECONDS):
+                        if stop.is_set():
+                            return
+                    if not put(queues[0], (count, item)):
+                        return
+                    count += 1
+                output.put((count, _END))
+            except Exception as e:
+                output.put((None, _Failure(e)))
+
+        def work(index, stage, batch_size):
+            target = queues[index + 1] if index + 1 < len(queues) else output
+            while True:
+                entry = get(queues[index])
+                if entry is None:
+                    return
+                entries = [entry]
+                if stage.batch_size is not None:
+                    if batch_size is None:
+                        batch_size = stage.batch_size(entry[1]) if callable(stage.batch_size) else stage.batch_size
+                    while len(entries) < batch_size:
+                        try:
+                            entries.append(queues[index].get_nowait())
+                        except queue.Empty:
+                            break
+
+                start = time.perf_counter()
+                try:
+                    if stage.batch_size is None:
+                        results = [stage.func(entry[1])]
+                    else:
+                        results = stage.func([item for _, item in entries])
+                except Exception as e:
+                    output.put((None, _Failure(e)))
+                    return
+                self.stats.add(stage.name, len(entries), time.perf_counter() - start)
+
+                for (number, _), result in zip(entries, results):
+                    if not put(target, (number, result)):
+                        return
+
+        threads = [threading.Thread(target=feed, daemon=True)]
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(target=work, args=(index, stage, None), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        try:
+            total = None
+            ready = {}
+            next_number = 0
+            while total is None or next_number < total:
+                number, result = output.get()
+                if isinstance(result, _Failure):
+                    raise result.exception
+                if result is _END:
+                    total = number
+                    continue
+                ready[number] = result
+                while next_number in ready:
+                    yield ready.pop(next_number)
+                    next_number += 1
+                    in_flight.release()
+        finally:
+            stop.set()
@@ -0,0 +1,89 @@
+'''
+    Lightweight timing spans for hot paths.
+
+    Spans are recorded only when enabled with setEnabled(True), otherwise span() returns
+    a shared no-op context manager. Recorded spans can be summarized per name
+    or exported as Chrome trace JSON (chrome://tracing, Perfetto).
+
+    Example:
+        with span('inference'):
+            model(inputs)
+'''
+
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from constants import PROFILING_MAX_SPANS
+
+_enabled = False
+_spans = deque(maxlen=PROFILING_MAX_SPANS)
+_lock = threading.Lock()
+_null_span = contextlib.nullcontext()
+
+
+def setEnabled(enabled):
+    global _enabled
+    _enabled = enabled
+
+
+class _Span:
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        with _lock:
+            _spans.append((self.name, self.start, end - self.start, threading.get_ident()))
+        return False
+
+
+def span(name):
+    return _Span(name) if _enabled else _null_span
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+
+
+def summary():
+    '''
+        Returns {name: (count, total seconds, max seconds)} of recorded spans
+    '''
+
+    result = {}
+    with _lock:
+        spans = list(_spans)
+    for name, start, duration, thread in spans:
+        count, total, longest = result.get(name, (0, 0.0, 0.0))
+        result[name] = (count + 1, total + duration, max(longest, duration))
+    return result
+
+
+def summaryText():
+    items = sorted(summary().items(), key=lambda item: -item[1][1])
+    return ' | '.join(
+        '{} {}x {:.0f} ms'.format(name, count, total * 1000) for name, (count, total, longest) in items
+    )
+
+
+def exportChromeTrace(path):
+    with _lock:
+        spans = list(_spans)
+    pid = os.getpid()
+    events = [
+        {'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': duration * 1e6, 'pid': pid, 'tid': thread}
+        for name, start, duration, thread in spans
+    ]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
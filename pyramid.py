@@ -0,0 +1,69 @@
+import math
+from constants import PYRAMID_TILE_SIZE
+
+
+class ImagePyramid:
+    '''
+        Multi-resolution pyramid of a RasterSource split into square tiles.
+
+        Level 0 is the raster itself, each next level is 2 times smaller,
+        the last level fits into one tile.
+        Levels are not stored: tiles are read from the source with decimation on request.
+    '''
+
+    def __init__(self, source, tile_size=PYRAMID_TILE_SIZE):
+        self.source = source
+        self.tile_size = tile_size
+
+        self.level_sizes = [source.size]
+        while max(self.level_sizes[-1]) > tile_size:
+            level = len(self.level_sizes)
+            self.level_sizes.append((math.ceil(source.width / 2 ** level), math.ceil(source.height / 2 ** level)))
+
+    @property
+    def width(self):
+        return self.source.width
+
+    @property
+    def height(self):
+        return self.source.height
+
+    def levelCount(self):
+        return len(self.level_sizes)
+
+    def levelSize(self, level):
+        return self.level_sizes[level]
+
+    def levelForScale(self, scale):
+        '''
+            Returns the smallest level which still has at least `scale` pixels per pixel of level 0
+        '''
+
+        if scale >= 1:
+            return 0
+        return min(int(math.log2(1 / scale)), len(self.level_sizes) - 1)
+
+    def tileRange(self, level, left, top, right, bottom):
+        '''
+            Returns ranges of tile columns and rows intersecting the rectangle given in pixels of `level`
+        '''
+
+        width, height = self.level_sizes[level]
+        t = self.tile_size
+        columns = range(max(0, int(left // t)), min(math.ceil(width / t), int(right // t) + 1))
+        rows = range(max(0, int(top // t)), min(math.ceil(height / t), int(bottom // t) + 1))
+        return columns, rows
+
+    def tileBox(self, level, column, row):
+        width, height = self.level_sizes[level]
+        t = self.tile_size
+        return column * t, row * t, min((column + 1) * t, width), min((row + 1) * t, height)
+
+    def sourceBox(self, level, column, row):
+        '''
+            Returns the box of the tile in pixels of the source
+        '''
+
+        k = 2 ** level
+        left, top, right, bottom = self.tileBox(level, column, row)
+        return left * k, top * k, min(right * k, self.width), min(bottom * k, self.height)
@@ -0,0 +1,577 @@
+import math
+import threading
+import zlib
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+from profiling import span
+from constants import RASTER_CHUNK_CACHE_SIZE, CHANGE_THRESHOLD, COMPACT_RASTER_COMPRESS_LEVEL
+
+
+class RasterSource:
+    '''
+        Read-only access to windows of a raster without keeping it decoded in memory.
+
+        readWindow(box, level) returns PIL image of the window `box` = (left, upper, right, lower)
+        given in full resolution pixels, decimated 2 ** level times.
+        Every source decimates the same way: it takes every 2 ** level-th pixel of every 2 ** level-th row
+        starting at (left, upper), without averaging, so levels are cheap to read and pixels of all sources
+        line up. Callers which need averaging reduce level 0 windows themselves, see resampling.boxReduce.
+        Parts of the window outside of the raster are filled with zeros, like in Image.crop.
+        Subclasses implement _readArray for windows inside of the raster.
+    '''
+
+    mode = None
+    width = 0
+    height = 0
+    # file the raster was opened from, if any
+    path = None
+    # scene the raster was computed from, e.g. for change maps, see georeferencePath
+    reference_path = None
+    # reduced-resolution images of the same raster from the largest, e.g. TIFF overviews
+    overviews = ()
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    def readWindow(self, box, level=0):
+        step = 2 ** level
+        left, top, right, bottom = box
+        out_width = max(0, math.ceil((right - left) / step))
+        out_height = max(0, math.ceil((bottom - top) / step))
+
+        # the first pixels inside the raster which are on the grid of the decimated window
+        inner_left = left + math.ceil(max(0, -left) / step) * step
+        inner_top = top + math.ceil(max(0, -top) / step) * step
+        inner_right = min(right, self.width)
+        inner_bottom = min(bottom, self.height)
+
+        channels = Image.getmodebands(self.mode)
+        shape = (out_height, out_width) if channels == 1 else (out_height, out_width, channels)
+        if (inner_left, inner_top, inner_right, inner_bottom) == (left, top, right, bottom):
+            return Image.fromarray(np.ascontiguousarray(self._readArray(left, top, right, bottom, step)))
+
+        result = np.zeros(shape, dtype=np.uint8)
+        if inner_left < inner_right and inner_top < inner_bottom:
+            arr = self._readArray(inner_left, inner_top, inner_right, inner_bottom, step)
+            x = (inner_left - left) // step
+            y = (inner_top - top) // step
+            result[y:y + arr.shape[0], x:x + arr.shape[1]] = arr
+        return Image.fromarray(result)
+
+    def readImage(self, level=0):
+        return self.readWindow((0, 0, self.width, self.height), level)
+
+    def levelForSize(self, size):
+        '''
+            Returns the highest level at which the whole raster is still not smaller than `size`
+        '''
+
+        level = 0
+        while (math.ceil(self.width / 2 ** (level + 1)) >= size[0]
+               and math.ceil(self.height / 2 ** (level + 1)) >= size[1]):
+            level += 1
+        return level
+
+    def georeferencePath(self):
+        '''
+            Returns file whose georeferencing applies to the raster, or None
+        '''
+
+        return self.path if self.path is not None else self.reference_path
+
+    def readReduced(self, size):
+        '''
+            Returns PIL image of the whole raster not smaller than `size`, decoded at reduced resolution
+            by the format itself, or None if the format can't do that (see resampling.readResized)
+        '''
+
+        # the smallest overview still not smaller than `size`
+        for overview in reversed(self.overviews):
+            if overview.width >= size[0] and overview.height >= size[1]:
+                return overview.readImage()
+        return None
+
+    def residentBytes(self):
+        '''
+            Returns bytes of decoded pixels which evict() would release, see memory.LayerMemoryManager
+        '''
+
+        return 0
+
+    def evict(self):
+        '''
+            Releases decoded pixels, they are restored on the next read
+        '''
+
+        pass
+
+    def _readArray(self, left, top, right, bottom, step):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ArrayRasterSource(RasterSource):
+    '''
+        Raster over uint8 array of shape (height, width) or (height, width, channels),
+        which may be a numpy.memmap of an uncompressed file.
+    '''
+
+    def __init__(self, array):
+        self._array = array
+        self.height, self.width = array.shape[:2]
+        channels = 1 if array.ndim == 2 else array.shape[2]
+        self.mode = {1: 'L', 3: 'RGB', 4: 'RGBA'}[channels]
+
+    def _readArray(self, left, top, right, bottom, step):
+        return np.array(self._array[top:bottom:step, left:right:step])
+
+
+class CompactArrayRasterSource(ArrayRasterSource):
+    '''
+        Raster over uint8 array in memory, which evict() replaces by its compressed bytes,
+        e.g. for results of algorithms which can't be read again from a file.
+        The array is decompressed on the next read.
+    '''
+
+    def __init__(self, array):
+        super().__init__(array)
+        self._shape = array.shape
+        self._compressed = None
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        array = self._array
+        return array.nbytes if array is not None else len(self._compressed)
+
+    def residentBytes(self):
+        array = self._array
+        return 0 if array is None else array.nbytes
+
+    def evict(self):
+        with self._lock:
+            if self._array is None:
+                return
+            if self._compressed is None:
+                # the array never changes, so it is compressed once
+                with span('compress'):
+                    self._compressed = zlib.compress(self._array.tobytes(), COMPACT_RASTER_COMPRESS_LEVEL)
+            self._array = None
+
+    def _readArray(self, left, top, right, bottom, step):
+        array = self._array
+        if array is None:
+            with self._lock:
+                if self._array is None:
+                    with span('decompress'):
+                        self._array = np.frombuffer(bytearray(zlib.decompress(self._compressed)), np.uint8)
+                        self._array = self._array.reshape(self._shape)
+                array = self._array
+        return np.array(array[top:bottom:step, left:right:step])
+
+
+class PilRasterSource(RasterSource):
+    '''
+        Raster over PIL image for formats without random access.
+        The image is decoded on the first read.
+    '''
+
+    def __init__(self, image):
+        self._image = image
+        self._lock = threading.Lock()
+        self._decoded = False
+        self.format = image.format
+        self.width, self.height = image.size
+        if image.mode in ('L', 'RGB', 'RGBA'):
+            self.mode = image.mode
+        elif 'A' in image.getbands() or 'transparency' in image.info:
+            self.mode = 'RGBA'
+        elif image.mode in ('1', 'I', 'I;16', 'F'):
+            self.mode = 'L'
+        else:
+            self.mode = 'RGB'
+
+    def _loaded(self):
+        with self._lock:
+            with span('decode'):
+                if self._image.mode != self.mode:
+                    self._image = self._image.convert(self.mode)
+                self._image.load()
+                self._decoded = True
+            return self._image
+
+    def residentBytes(self):
+        if not self._decoded or self.path is None:
+            return 0
+        return self.width * self.height * Image.getmodebands(self.mode)
+
+    def evict(self):
+        # pictures opened from files are decoded again from them,
+        # readers which already took the decoded image keep their reference
+        with self._lock:
+            if self._decoded and self.path is not None:
+                self._image = Image.open(self.path)
+                self._decoded = False
+
+    def readWindow(self, box, level=0):
+        if level:
+            return super().readWindow(box, level)
+        # Image.crop fills parts outside of the image with zeros too
+        return self._loaded().crop(box)
+
+    def _readArray(self, left, top, right, bottom, step):
+        return np.asarray(self._loaded().crop((left, top, right, bottom)))[::step, ::step]
+
+    def readReduced(self, size):
+        # JPEG decodes at 1/2, 1/4 or 1/8 of the size in the DCT, but once the picture
+        # is decoded at full resolution, reducing it in memory is cheaper than decoding again
+        if self.format != 'JPEG' or self.path is None or self._decoded:
+            return None
+        if reduceSize(self.size, size) == self.size:
+            return None
+
+        with span('decode'), Image.open(self.path) as image:
+            image.draft(self.mode if self.mode in ('L', 'RGB') else 'RGB', size)
+            return image.convert(self.mode)
+
+    def close(self):
+        self._image.close()
+
+
+class TiffChunkedRasterSource(RasterSource):
+    '''
+        Raster over striped or tiled TIFF with uncompressed or deflate compressed 8 bit chunks.
+        Only chunks intersecting the requested window are read and decoded,
+        the last RASTER_CHUNK_CACHE_SIZE decoded chunks are cached.
+    '''
+
+    COMPRESSIONS = (1, 8, 32946)
+
+    def __init__(self, path, image):
+        tags = image.tag_v2
+
+        self.path = path
+        self.width, self.height = image.size
+        self.compression = tags.get(259, 1)
+        self.predictor = tags.get(317, 1)
+        samples = tags.get(277, 1)
+        bits = tags.get(258, (8,))
+        if isinstance(bits, int):
+            bits = (bits,)
+
+        if self.compression not in self.COMPRESSIONS or self.predictor not in (1, 2) or tags.get(284, 1) != 1 \
+                or any(b != 8 for b in bits) or samples not in (1, 3, 4) or tags.get(262, 1) not in (1, 2):
+            raise ValueError('TiffChunkedRasterSource: unsupported TIFF layout')
+
+        self.samples = samples
+        self.mode = {1: 'L', 3: 'RGB', 4: 'RGBA'}[samples]
+
+        if 322 in tags:
+            self.chunk_width, self.chunk_height = tags[322], tags[323]
+            self.offsets, self.counts = tags[324], tags[325]
+        else:
+            self.chunk_width, self.chunk_height = self.width, min(tags.get(278, self.height), self.height)
+            self.offsets, self.counts = tags[273], tags[279]
+        self.columns = math.ceil(self.width / self.chunk_width)
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _chunk(self, column, row):
+        index = row * self.columns + column
+        with self._lock:
+            if index in self._cache:
+                self._cache.move_to_end(index)
+                return self._cache[index]
+
+        with span('decode'), open(self.path, 'rb') as f:
+            f.seek(self.offsets[index])
+            data = f.read(self.counts[index])
+            if self.compression != 1:
+                data = zlib.decompress(data)
+
+        chunk = np.frombuffer(data, dtype=np.uint8)
+        chunk = chunk[:chunk.size - chunk.size % (self.chunk_width * self.samples)]
+        chunk = chunk.reshape(-1, self.chunk_width, self.samples)
+        if self.predictor == 2:
+            chunk = np.cumsum(chunk, axis=1, dtype=np.uint8)
+
+        with self._lock:
+            self._cache[index] = chunk
+            while len(self._cache) > RASTER_CHUNK_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return chunk
+
+    def _readArray(self, left, top, right, bottom, step):
+        result = np.zeros((math.ceil((bottom - top) / step), math.ceil((right - left) / step), self.samples), np.uint8)
+
+        for row in range(top // self.chunk_height, (bottom - 1) // self.chunk_height + 1):
+            chunk_top = row * self.chunk_height
+            # the first row of the chunk which is on the grid of the decimated window
+            y0 = max(top, chunk_top)
+            y0 += (top - y0) % step
+            y1 = min(bottom, chunk_top + self.chunk_height)
+            if y0 >= y1:
+                continue
+
+            for column in range(left // self.chunk_width, (right - 1) // self.chunk_width + 1):
+                chunk_left = column * self.chunk_width
+                x0 = max(left, chunk_left)
+                x0 += (left - x0) % step
+                x1 = min(right, chunk_left + self.chunk_width)
+                if x0 >= x1:
+                    continue
+
+                chunk = self._chunk(column, row)
+                part = chunk[y0 - chunk_top:y1 - chunk_top:step, x0 - chunk_left:x1 - chunk_left:step]
+                ry = (y0 - top) // step
+                rx = (x0 - left) // step
+                result[ry:ry + part.shape[0], rx:rx + part.shape[1]] = part
+
+        return result[:, :, 0] if self.samples == 1 else result
+
+
+# rawmode of PIL decoder: (mode, bytes per pixel, order of channels in file)
+_RAW_MODES = {
+    'L': ('L', 1, [0]),
+    'RGB': ('RGB', 3, [0, 1, 2]),
+    'RGBA': ('RGBA', 4, [0, 1, 2, 3]),
+    'RGBX': ('RGB', 4, [0, 1, 2]),
+    'BGR': ('RGB', 3, [2, 1, 0]),
+    'BGRX': ('RGB', 4, [2, 1, 0]),
+    'BGRA': ('RGBA', 4, [2, 1, 0, 3]),
+}
+
+
+class PackedMaskRasterSource(RasterSource):
+    '''
+        Binary mask with 8 pixels per byte, packed along rows by numpy.packbits.
+        Reads return 0/255 windows, only bytes of the window are unpacked.
+    '''
+
+    mode = 'L'
+
+    def __init__(self, bits, width, height):
+        self.bits = bits
+        self.width = width
+        self.height = height
+
+    @classmethod
+    def fromArray(cls, mask):
+        '''
+            Packs array of shape (height, width), nonzero values are changes
+        '''
+
+        height, width = mask.shape
+        return cls(np.packbits(mask != 0, axis=1), width, height)
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def _readArray(self, left, top, right, bottom, step):
+        first = left % 8
+        bits = np.unpackbits(self.bits[top:bottom:step, left // 8:(right + 7) // 8], axis=1)
+        return bits[:, first:first + right - left:step] * np.uint8(255)
+
+
+def reduceSize(image_size, size):
+    '''
+        Returns size of the smallest JPEG DCT scaling (1/2, 1/4, 1/8) of `image_size` not smaller than `size`
+    '''
+
+    for scale in (8, 4, 2):
+        reduced = (math.ceil(image_size[0] / scale), math.ceil(image_size[1] / scale))
+        if reduced[0] >= size[0] and reduced[1] >= size[1]:
+            return reduced
+    return tuple(image_size)
+
+
+def _tiffOverviews(path, image):
+    '''
+        Returns memory mapped or chunked RasterSource for each reduced-resolution image (NewSubfileType 1)
+        following the main image of the file, e.g. internal overviews written by GDAL.
+        Overviews which can't be read without decoding whole are skipped.
+    '''
+
+    overviews = []
+    for frame in range(1, getattr(image, 'n_frames', 1)):
+        image.seek(frame)
+        if not image.tag_v2.get(254, 0) & 1:
+            continue
+        overview = _memmapRaster(path, image)
+        if overview is None:
+            try:
+                overview = TiffChunkedRasterSource(path, image)
+            except (ValueError, KeyError):
+                continue
+        overviews.append(overview)
+    image.seek(0)
+    return sorted(overviews, key=lambda overview: -overview.width)
+
+
+class ThresholdRasterSource(RasterSource):
+    '''
+        0/255 mask of the single band probability map `source` (probability * 255),
+        thresholded when windows are read, so the threshold can be changed at any time
+        without touching the map.
+    '''
+
+    mode = 'L'
+
+    def __init__(self, source, threshold=CHANGE_THRESHOLD):
+        self.source = source
+        self.threshold = threshold
+        self.width = source.width
+        self.height = source.height
+
+    def setThreshold(self, threshold):
+        self.threshold = threshold
+
+    def residentBytes(self):
+        return self.source.residentBytes()
+
+    def evict(self):
+        self.source.evict()
+
+    def _readArray(self, left, top, right, bottom, step):
+        return thresholdMask(np.asarray(self.source.readWindow((left, top, right, bottom), step.bit_length() - 1)),
+                             self.threshold)
+
+    def close(self):
+        self.source.close()
+
+
+class WindowRasterSource(RasterSource):
+    '''
+        Window `box` = (left, top, right, bottom) of `source` as a raster of its own, at native resolution.
+        Only the window is ever read from `source`, so algorithms run on it cost as much as its area.
+    '''
+
+    def __init__(self, source, box):
+        self.source = source
+        self.box = box
+        self.mode = source.mode
+        self.width = box[2] - box[0]
+        self.height = box[3] - box[1]
+
+    def _readArray(self, left, top, right, bottom, step):
+        x, y = self.box[:2]
+        return np.asarray(self.source.readWindow((left + x, top + y, right + x, bottom + y), step.bit_length() - 1))
+
+
+def thresholdMask(probabilities, threshold=CHANGE_THRESHOLD):
+    '''
+        Returns 0/255 uint8 mask of pixels of uint8 `probabilities` (probability * 255) above `threshold`
+    '''
+
+    return np.where(np.asarray(probabilities) > threshold * 255, np.uint8(255), np.uint8(0))
+
+
+def isBinaryMask(arr):
+    return arr.ndim == 2 and arr.dtype == np.uint8 and not np.any((arr != 0) & (arr != 255))
+
+
+def _memmapRaster(path, image):
+    '''
+        Returns ArrayRasterSource over memory map of the file if PIL reads it
+        as one contiguous block of raw pixels (BMP, PPM, uncompressed striped TIFF, ...), otherwise None.
+    '''
+
+    tiles = sorted(image.tile, key=lambda tile: tile[1][1])
+    if not tiles or any(tile[0] != 'raw' for tile in tiles):
+        return None
+
+    rawmode, stride, orientation = (tuple(tiles[0][3]) + (0, 1))[:3]
+    if rawmode not in _RAW_MODES or any(tuple(tile[3])[:1] != (rawmode,) for tile in tiles):
+        return None
+    mode, pixel_bytes, channels = _RAW_MODES[rawmode]
+
+    width, height = image.size
+    stride = stride or width * pixel_bytes
+    offset = tiles[0][2]
+    for tile in tiles:
+        x0, y0, x1, y1 = tile[1]
+        if (x0, x1) != (0, width) or tile[2] != offset + y0 * stride:
+            return None
+    if tiles[0][1][1] != 0 or tiles[-1][1][3] != height:
+        return None
+
+    data = np.memmap(path, dtype=np.uint8, mode='r', offset=offset, shape=(height, stride))
+    arr = np.lib.stride_tricks.as_strided(data, shape=(height, width, pixel_bytes), strides=(stride, pixel_bytes, 1))
+    if orientation < 0:
+        arr = arr[::-1]
+    if channels != list(range(pixel_bytes)):
+        # basic indexing keeps the memory map, but only for a continuous range of channels
+        if channels == list(range(len(channels))):
+            arr = arr[:, :, :len(channels)]
+        else:
+            return _ReorderedArrayRasterSource(arr, channels)
+    return ArrayRasterSource(arr[:, :, 0] if mode == 'L' else arr)
+
+
+class _ReorderedArrayRasterSource(ArrayRasterSource):
+
+    def __init__(self, array, channels):
+        super().__init__(array[:, :, :len(channels)])
+        self._array = array
+        self._channels = channels
+
+    def _readArray(self, left, top, right, bottom, step):
+        return np.array(self._array[top:bottom:step, left:right:step][:, :, self._channels])
+
+
+def openRaster(path):
+    '''
+        Returns the cheapest RasterSource for the file:
+        memory map for uncompressed files, lazily decoded chunks for TIFF,
+        PilRasterSource for the rest.
+    '''
+
+    if path.lower().endswith('.npy'):
+        source = ArrayRasterSource(np.load(path, mmap_mode='r'))
+        source.path = path
+        return source
+
+    image = Image.open(path)
+    source = _memmapRaster(path, image)
+    if source is None and image.format == 'TIFF':
+        try:
+            source = TiffChunkedRasterSource(path, image)
+        except (ValueError, KeyError):
+            source = None
+    if source is None:
+        source = PilRasterSource(image)
+    else:
+        if image.format == 'TIFF':
+            source.overviews = _tiffOverviews(path, image)
+        image.close()
+
+    source.path = path
+    return source
+
+
+def asRasterSource(pic):
+    if isinstance(pic, RasterSource):
+        return pic
+    if isinstance(pic, np.ndarray):
+        return ArrayRasterSource(pic)
+    return PilRasterSource(pic)
+
+
+def asMaskRasterSource(pic):
+    '''
+        Same as asRasterSource, but 0/255 masks are bit-packed
+        and other rasters are kept by CompactArrayRasterSource
+    '''
+
+    if isinstance(pic, RasterSource):
+        return pic
+    arr = np.asarray(pic)
+    if isBinaryMask(arr):
+        return PackedMaskRasterSource.fromArray(arr)
+    return CompactArrayRasterSource(arr)
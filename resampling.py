@@ -0,0 +1,88 @@
+'''
+    Downscaling of whole rasters to the input size of algorithms by the cheapest correct route:
+    reduced decoding where the format supports it (JPEG draft mode, TIFF overviews),
+    then integer-factor box averaging (Image.reduce) band by band,
+    and only then a final filter from an image at most a few times larger than the target.
+
+    Qualities, chosen per algorithm by Algorithm.getResamplingQuality:
+        'fast' - decimation by pyramid level (no averaging) and bilinear filter,
+        'balanced' - box averaging to within 2x of the target and bicubic filter,
+        'high' - box averaging to within 3x of the target and Lanczos filter,
+                 practically the same as Lanczos from full resolution.
+'''
+
+import numpy as np
+from PIL import Image
+from profiling import span
+from constants import RESAMPLING_QUALITY, RESAMPLING_BAND_PIXELS
+
+QUALITIES = ('fast', 'balanced', 'high')
+
+# the image is reduced by integer factors while it stays at least this many times larger than the target
+_REDUCING_GAPS = {'fast': 1, 'balanced': 2, 'high': 3}
+_FILTERS = {'fast': Image.BILINEAR, 'balanced': Image.BICUBIC, 'high': Image.LANCZOS}
+
+
+def checkQuality(quality):
+    if quality not in QUALITIES:
+        raise ValueError('unknown resampling quality ' + repr(quality) + ', expected one of ' + ', '.join(QUALITIES))
+
+
+def reduceFactor(image_size, size, gap=1):
+    '''
+        Returns the largest integer factor which keeps `image_size` at least `gap` times larger than `size`
+    '''
+
+    return max(1, int(min(image_size[0] / (size[0] * gap), image_size[1] / (size[1] * gap))))
+
+
+def boxReduce(source, factor):
+    '''
+        Returns the whole raster of RasterSource `source` averaged over blocks of `factor` x `factor` pixels.
+        Read by bands of about RESAMPLING_BAND_PIXELS pixels, so the full resolution raster
+        is never in memory at once.
+    '''
+
+    if factor == 1:
+        return source.readImage()
+
+    rows = max(1, RESAMPLING_BAND_PIXELS // (source.width * factor)) * factor
+    bands = []
+    for top in range(0, source.height, rows):
+        band = source.readWindow((0, top, source.width, min(top + rows, source.height)))
+        with span('resample'):
+            bands.append(np.asarray(band.reduce(factor)))
+    return Image.fromarray(np.concatenate(bands))
+
+
+def resizeImage(image, size, quality=RESAMPLING_QUALITY):
+    '''
+        Resizes PIL image to `size`, reducing it by an integer factor first if it is much larger
+    '''
+
+    checkQuality(quality)
+    with span('resample'):
+        if quality != 'fast':
+            factor = reduceFactor(image.size, size, _REDUCING_GAPS[quality])
+            if factor > 1:
+                image = image.reduce(factor)
+        if image.size == size:
+            return image
+        return image.resize(size, _FILTERS[quality])
+
+
+def readResized(source, size, quality=RESAMPLING_QUALITY):
+    '''
+        Reads the whole raster of RasterSource `source` resized to `size`
+    '''
+
+    checkQuality(quality)
+    gap = _REDUCING_GAPS[quality]
+
+    image = source.readReduced((size[0] * gap, size[1] * gap))
+    if image is None:
+        if quality == 'fast':
+            image = source.readImage(source.levelForSize(size))
+        else:
+            image = boxReduce(source, reduceFactor(source.size, size, gap))
+    return resizeImage(image, size, quality)
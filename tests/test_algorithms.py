@@ -0,0 +1,28 @@
+import numpy as np
+from PIL import Image
+from algorithms import Algorithm, performAlgorithm
+
+
+class DifferenceAlgorithm(Algorithm):
+
+    def getInputSize(self):
+        return (16, 16)
+
+    def performImpl(self, t1, t2):
+        return np.abs(t1.astype(np.int16) - t2.astype(np.int16)).max(axis=2).astype(np.uint8)
+
+
+def test_perform_algorithm_on_pil_images():
+    t1 = Image.new('RGB', (40, 30), (10, 20, 30))
+    t2 = Image.new('RGB', (40, 30), (10, 20, 30))
+    t2.paste((200, 20, 30), (0, 0, 20, 30))
+
+    result = performAlgorithm(DifferenceAlgorithm(), t1, t2)
+
+    assert result.mode == 'L'
+    assert result.size == (40, 30)
+    arr = np.asarray(result)
+    assert arr[15, 2] == 190
+    assert arr[15, 37] == 0
+    # the same images again come from the feature cache
+    assert np.array_equal(np.asarray(performAlgorithm(DifferenceAlgorithm(), t1, t2)), arr)
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from cache import ResultCache, sourceDigest
+from raster import (
+    ArrayRasterSource,
+    CompactArrayRasterSource,
+    PackedMaskRasterSource,
+    PilRasterSource,
+    ThresholdRasterSource,
+    TiffChunkedRasterSource,
+    WindowRasterSource,
+    openRaster
+)
+
+
+def randomPicture(seed, shape=(37, 53, 3)):
+    return np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+
+
+def fileSha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+@pytest.mark.parametrize('name, options, source_class', [
+    ('picture.bmp', {}, ArrayRasterSource),
+    ('picture.tif', {'compression': 'tiff_adobe_deflate'}, TiffChunkedRasterSource),
+    ('picture.png', {}, PilRasterSource),
+])
+def test_digest_of_opened_file_is_hash_of_file(tmp_path, name, options, source_class):
+    path = str(tmp_path / name)
+    Image.fromarray(randomPicture(0)).save(path, **options)
+
+    source = openRaster(path)
+
+    assert isinstance(source, source_class)
+    assert sourceDigest(source) == fileSha256(path)
+    # PIL images opened from the file are hashed the same way
+    with Image.open(path) as image:
+        assert sourceDigest(image) == fileSha256(path)
+
+
+def test_digest_of_npy_file_is_hash_of_file(tmp_path):
+    path = str(tmp_path / 'picture.npy')
+    np.save(path, randomPicture(0))
+
+    source = openRaster(path)
+
+    assert isinstance(source, ArrayRasterSource)
+    assert sourceDigest(source) == fileSha256(path)
+
+
+def test_digest_of_in_memory_rasters_depends_only_on_pixels():
+    arr = randomPicture(1)
+    digests = {
+        sourceDigest(ArrayRasterSource(arr)),
+        sourceDigest(CompactArrayRasterSource(arr.copy())),
+        sourceDigest(PilRasterSource(Image.fromarray(arr))),
+        sourceDigest(Image.fromarray(arr)),
+        sourceDigest(WindowRasterSource(ArrayRasterSource(np.pad(arr, ((1, 0), (2, 0), (0, 0)))), (2, 1, 55, 38))),
+    }
+    assert len(digests) == 1
+
+    assert sourceDigest(ArrayRasterSource(randomPicture(2))) not in digests
+    # same bytes in another shape are another picture
+    assert sourceDigest(ArrayRasterSource(arr.reshape(53, 37, 3))) not in digests
+
+
+def test_digest_of_evicted_compact_raster_is_unchanged():
+    arr = randomPicture(3)
+    expected = sourceDigest(ArrayRasterSource(arr))
+    source = CompactArrayRasterSource(arr)
+    source.evict()
+
+    assert sourceDigest(source) == expected
+
+
+def test_digest_of_packed_mask_equals_digest_of_its_pixels():
+    mask = np.where(randomPicture(4, (37, 53)) > 127, np.uint8(255), np.uint8(0))
+
+    assert sourceDigest(PackedMaskRasterSource.fromArray(mask)) == sourceDigest(ArrayRasterSource(mask))
+
+
+def test_digest_of_thresholded_map_follows_threshold():
+    probabilities = ArrayRasterSource(randomPicture(5, (37, 53)))
+    source = ThresholdRasterSource(probabilities, 0.5)
+
+    at_half = sourceDigest(source)
+    assert sourceDigest(ThresholdRasterSource(probabilities, 0.5)) == at_half
+    assert at_half != sourceDigest(probabilities)
+
+    source.setThreshold(0.25)
+    assert sourceDigest(source) != at_half
+    source.setThreshold(0.5)
+    assert sourceDigest(source) == at_half
+
+
+def probabilityMap(seed, size=64):
+    return Image.fromarray(randomPicture(seed, (size, size)))
+
+
+def test_result_cache_evicts_least_recently_used_from_memory():
+    cache = ResultCache(memory_budget=int(2.5 * 64 * 64), disk_dir=None)
+    for name in 'abc':
+        cache.put(name, probabilityMap(ord(name)))
+
+    assert cache.get('a') is None
+    assert np.array_equal(np.asarray(cache.get('b')), np.asarray(probabilityMap(ord('b'))))
+    cache.put('d', probabilityMap(ord('d')))
+
+    assert cache.get('c') is None
+    assert cache.get('b') is not None and cache.get('d') is not None
+    assert (cache.stats.memory_hits, cache.stats.misses) == (3, 2)
+
+
+def test_result_cache_keeps_masks_packed_in_memory():
+    mask = np.where(randomPicture(6, (80, 80)) > 127, np.uint8(255), np.uint8(0))
+    cache = ResultCache(memory_budget=80 * 80 // 8, disk_dir=None)
+    cache.put('mask', Image.fromarray(mask))
+
+    assert np.array_equal(np.asarray(cache.get('mask')), mask)
+
+
+def test_result_cache_evicts_least_recently_used_from_disk(tmp_path):
+    disk_dir = str(tmp_path)
+    cache = ResultCache(memory_budget=0, disk_dir=disk_dir, disk_budget=10 ** 6)
+    cache.put('a', probabilityMap(1))
+    cache.put('b', probabilityMap(2))
+    file_size = os.path.getsize(os.path.join(disk_dir, 'a.png'))
+    # mtimes far apart, so the order doesn't depend on the file system's timestamp resolution
+    os.utime(os.path.join(disk_dir, 'a.png'), (1000, 1000))
+    os.utime(os.path.join(disk_dir, 'b.png'), (2000, 2000))
+
+    cache.disk_budget = int(2.5 * file_size)
+    # a read touches the file, so 'b' is now the least recently used
+    assert np.array_equal(np.asarray(cache.get('a')), np.asarray(probabilityMap(1)))
+    cache.put('c', probabilityMap(3))
+
+    assert sorted(os.listdir(disk_dir)) == ['a.png', 'c.png']
+    assert cache.get('b') is None
+    assert cache.stats.disk_hits == 1
+
+
+def test_result_cache_reads_disk_tier_of_another_instance(tmp_path):
+    mask = np.where(randomPicture(7, (30, 45)) > 127, np.uint8(255), np.uint8(0))
+    ResultCache(disk_dir=str(tmp_path)).put('mask', Image.fromarray(mask))
+
+    cache = ResultCache(disk_dir=str(tmp_path))
+    first = cache.get('mask')
+    second = cache.get('mask')
+
+    assert first.mode == 'L' and np.array_equal(np.asarray(first), mask)
+    assert np.array_equal(np.asarray(second), mask)
+    assert (cache.stats.disk_hits, cache.stats.memory_hits) == (1, 1)
+
+
+def test_result_cache_clear_removes_both_tiers(tmp_path):
+    cache = ResultCache(disk_dir=str(tmp_path))
+    cache.put('a', probabilityMap(1))
+    cache.clear()
+
+    assert cache.get('a') is None
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,51 @@
+import os
+import numpy as np
+import pytest
+from PIL import Image
+import export
+from cli import seriesOutputPath, writeResult
+
+
+def probabilities():
+    return Image.fromarray(np.random.default_rng(0).integers(0, 256, (30, 40), dtype=np.uint8))
+
+
+@pytest.fixture
+def scene(tmp_path):
+    path = str(tmp_path / 'scene.png')
+    Image.new('RGB', (40, 30)).save(path)
+    with open(str(tmp_path / 'scene.pgw'), 'w') as f:
+        f.write('1\n0\n0\n-1\n500000\n4000000\n')
+    with open(str(tmp_path / 'scene.prj'), 'w') as f:
+        f.write('PROJCS["test"]')
+    return path
+
+
+def test_write_result_writes_mask_with_sidecars(tmp_path, scene):
+    output_path = seriesOutputPath(str(tmp_path / 'out'), [scene, scene], 0, 1)
+    writeResult(probabilities(), output_path, scene, threshold=0.5)
+
+    assert sorted(os.listdir(str(tmp_path / 'out'))) == ['000-001__scene__scene.pgw', '000-001__scene__scene.png',
+                                                         '000-001__scene__scene.prj']
+    with Image.open(output_path) as image:
+        assert image.mode == '1'
+        assert np.array_equal(np.asarray(image.convert('L')),
+                              np.where(np.asarray(probabilities()) > 127.5, 255, 0))
+
+
+@pytest.mark.parametrize('failing', ['writePng', 'copySidecars'])
+def test_interrupted_write_result_leaves_no_output(tmp_path, scene, monkeypatch, failing):
+    original = getattr(export, failing)
+
+    def interrupted(*args, **kwargs):
+        original(*args, **kwargs)
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(export, failing, interrupted)
+    output_path = str(tmp_path / 'out' / 'result.png')
+    with pytest.raises(KeyboardInterrupt):
+        writeResult(probabilities(), output_path, scene)
+
+    # a resumed run would take an existing output as done
+    assert not os.path.exists(output_path)
+    assert not any(name.endswith('.png') for name in os.listdir(str(tmp_path / 'out')))
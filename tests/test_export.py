@@ -0,0 +1,93 @@
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from export import exportRaster, writePng, writeTiledTiff
+from raster import ArrayRasterSource, PackedMaskRasterSource, TiffChunkedRasterSource, openRaster
+
+WIDTH, HEIGHT = 45, 38
+SHAPES = {'L': (HEIGHT, WIDTH), 'RGB': (HEIGHT, WIDTH, 3), 'RGBA': (HEIGHT, WIDTH, 4)}
+
+
+def picture(mode):
+    return np.random.default_rng(0).integers(0, 256, SHAPES[mode], dtype=np.uint8)
+
+
+def mask():
+    return np.where(picture('L') > 127, np.uint8(255), np.uint8(0))
+
+
+def unevenBands(arr):
+    '''
+        Yields `arr` as bands of varying heights, which writers must join and split themselves
+    '''
+
+    top = 0
+    for rows in (1, 7, 3, 16, 100):
+        yield arr[top:top + rows]
+        top += rows
+
+
+@pytest.mark.parametrize('mode', ['L', 'RGB', 'RGBA'])
+def test_tiled_tiff_round_trip(tmp_path, mode):
+    path = str(tmp_path / 'result.tif')
+    arr = picture(mode)
+    writeTiledTiff(path, unevenBands(arr), WIDTH, HEIGHT, mode, tile_size=16)
+
+    with Image.open(path) as image:
+        assert image.mode == mode
+        assert image.tag_v2[322] == 16 and image.tag_v2[259] == 8
+        assert np.array_equal(np.asarray(image), arr)
+    source = openRaster(path)
+    assert isinstance(source, TiffChunkedRasterSource)
+    assert np.array_equal(np.asarray(source.readWindow((5, 7, 40, 30))), arr[7:30, 5:40])
+
+
+def test_tiled_tiff_keeps_georeference_tags(tmp_path):
+    path = str(tmp_path / 'result.tif')
+    tags = {33550: (12, (10.0, 10.0, 0.0)), 33922: (12, (0.0, 0.0, 0.0, 500000.0, 4000000.0, 0.0)),
+            42113: (2, '0')}
+    writeTiledTiff(path, unevenBands(picture('L')), WIDTH, HEIGHT, 'L', tags)
+
+    with Image.open(path) as image:
+        assert image.tag_v2[33550] == (10.0, 10.0, 0.0)
+        assert image.tag_v2[33922] == (0.0, 0.0, 0.0, 500000.0, 4000000.0, 0.0)
+        assert image.tag_v2[42113] == '0'
+
+
+@pytest.mark.parametrize('mode', ['L', 'RGB', 'RGBA'])
+def test_png_round_trip(tmp_path, mode):
+    path = str(tmp_path / 'result.png')
+    arr = picture(mode)
+    writePng(path, unevenBands(arr), WIDTH, HEIGHT, mode)
+
+    with Image.open(path) as image:
+        assert image.mode == mode
+        assert np.array_equal(np.asarray(image), arr)
+
+
+def test_bilevel_png_round_trip(tmp_path):
+    path = str(tmp_path / 'result.png')
+    writePng(path, unevenBands(mask()), WIDTH, HEIGHT, 'L', bilevel=True)
+
+    with Image.open(path) as image:
+        assert image.mode == '1'
+        assert np.array_equal(np.asarray(image.convert('L')), mask())
+
+
+@pytest.mark.parametrize('extension, mode', [('.png', '1'), ('.tif', 'L'), ('.bmp', 'L')])
+def test_export_mask(tmp_path, extension, mode):
+    path = str(tmp_path / ('result' + extension))
+    exportRaster(PackedMaskRasterSource.fromArray(mask()), path)
+
+    assert os.listdir(str(tmp_path)) == ['result' + extension]
+    with Image.open(path) as image:
+        assert image.mode == mode
+        assert np.array_equal(np.asarray(image.convert('L')), mask())
+
+
+def test_export_to_unknown_format_leaves_no_file(tmp_path):
+    with pytest.raises(ValueError):
+        exportRaster(ArrayRasterSource(picture('L')), str(tmp_path / 'result.unknown'))
+
+    assert os.listdir(str(tmp_path)) == []
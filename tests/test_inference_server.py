@@ -0,0 +1,63 @@
+import os
+import threading
+import time
+from multiprocessing.connection import Client
+import numpy as np
+import pytest
+from backends import RemoteBackend
+from inference_server import InferenceServer
+
+
+def sumOrFail(inputs):
+    t1, t2 = inputs
+    if np.any(t1 < 0):
+        raise ValueError('negative input')
+    return (t1 + t2).sum(axis=(1, 2, 3))
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    path = str(tmp_path / 'server.sock')
+    server = InferenceServer(sumOrFail, 'test-model', path, batch_wait=0)
+    threading.Thread(target=server.serveForever, daemon=True).start()
+    deadline = time.monotonic() + 5
+    while not os.path.exists(path):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return path
+
+
+def pair(value, count=2):
+    return [np.full((count, 4, 4, 3), value, np.float32), np.ones((count, 4, 4, 3), np.float32)]
+
+
+def test_remote_backend_runs_batches(socket_path):
+    backend = RemoteBackend(socket_path)
+    try:
+        assert np.array_equal(backend(pair(2)), [144, 144])
+    finally:
+        backend.close()
+
+
+def test_backend_error_is_reported_and_connection_kept(socket_path):
+    backend = RemoteBackend(socket_path)
+    try:
+        with pytest.raises(RuntimeError, match='ValueError: negative input'):
+            backend(pair(-1))
+        # the shared memory was released by the server, so the same buffer is used again
+        assert np.array_equal(backend(pair(0, 3)), [48, 48, 48])
+    finally:
+        backend.close()
+
+
+def test_bad_request_is_reported_and_connection_kept(socket_path):
+    with Client(socket_path, family='AF_UNIX') as connection:
+        connection.send(('infer', 'no-such-shared-memory', [((1, 4, 4, 3), '<f4', 0)]))
+        status, message = connection.recv()
+        assert status == 'error' and 'FileNotFoundError' in message
+
+        connection.send(('infer',))
+        assert connection.recv()[0] == 'error'
+
+        connection.send(('identity',))
+        assert connection.recv() == ('ok', 'test-model')
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+from integral import LazySummedAreaTable, SummedAreaTable
+from raster import ArrayRasterSource, PackedMaskRasterSource, ThresholdRasterSource
+
+WIDTH, HEIGHT = 53, 37
+
+
+def mask():
+    return np.where(np.random.default_rng(0).random((HEIGHT, WIDTH)) > 0.7, np.uint8(255), np.uint8(0))
+
+
+def bruteForceCount(arr, box):
+    left, top, right, bottom = box
+    window = arr[max(0, top):max(0, bottom), max(0, left):max(0, right)]
+    return int(np.count_nonzero(window)), window.size
+
+
+BOXES = [
+    (0, 0, WIDTH, HEIGHT),
+    (3, 5, 40, 31),
+    (17, 2, 18, 3),
+    (-10, -4, 12, 9),
+    (40, 30, WIDTH + 20, HEIGHT + 20),
+    (8, 8, 8, 20),
+]
+
+
+@pytest.mark.parametrize('box', BOXES)
+@pytest.mark.parametrize('source', [ArrayRasterSource, PackedMaskRasterSource.fromArray])
+def test_count_at_level_0_is_exact(source, box):
+    table = SummedAreaTable.fromSource(source(mask()))
+
+    assert table.level == 0
+    assert table.count(box) == bruteForceCount(mask(), box)
+
+
+def test_count_of_thresholded_probabilities():
+    probabilities = (np.random.default_rng(1).random((HEIGHT, WIDTH)) * 255).astype(np.uint8)
+    table = SummedAreaTable.fromSource(ThresholdRasterSource(ArrayRasterSource(probabilities), 0.5))
+
+    assert table.count((0, 0, WIDTH, HEIGHT))[0] == np.count_nonzero(probabilities > 127.5)
+
+
+@pytest.mark.parametrize('level', [1, 2, 3])
+def test_count_at_higher_levels(level):
+    step = 2 ** level
+    max_cells = -(-WIDTH // step) * -(-HEIGHT // step)
+    table = SummedAreaTable.fromSource(ArrayRasterSource(mask()), max_cells=max_cells)
+    assert table.level == level
+    assert table.nbytes < SummedAreaTable.fromSource(ArrayRasterSource(mask())).nbytes
+
+    # exact for boxes aligned to cells, also for the cells cut by the border
+    for box in [(0, 0, WIDTH, HEIGHT), (step, 0, 4 * step, 2 * step), (0, step, WIDTH, HEIGHT)]:
+        assert table.count(box) == bruteForceCount(mask(), box)
+
+    # otherwise as if the changes were spread evenly within each cell
+    density = cellDensity(mask(), step)
+    for box in BOXES:
+        changed, pixels = table.count(box)
+        expected = density[max(0, box[1]):max(0, box[3]), max(0, box[0]):max(0, box[2])].sum()
+        assert pixels == bruteForceCount(mask(), box)[1]
+        assert abs(changed - expected) <= 0.5 + 1e-6
+
+
+def cellDensity(arr, step):
+    '''
+        Returns fraction of changed pixels of the cell of each pixel, cells cut by the border included
+    '''
+
+    density = np.zeros(arr.shape)
+    for top in range(0, arr.shape[0], step):
+        for left in range(0, arr.shape[1], step):
+            density[top:top + step, left:left + step] = np.mean(arr[top:top + step, left:left + step] != 0)
+    return density
+
+
+class EvictingSource(ArrayRasterSource):
+    '''
+        Mask which is changed (and its table evicted) while the table is built for the first time
+    '''
+
+    def __init__(self, array, replacement):
+        super().__init__(array)
+        self.replacement = replacement
+        self.table = None
+
+    def readWindow(self, box, level=0):
+        if self.replacement is not None:
+            self._array, self.replacement = self.replacement, None
+            self.table.evict()
+        return super().readWindow(box, level)
+
+
+def test_lazy_table_is_built_again_when_evicted_during_build():
+    replacement = np.zeros((HEIGHT, WIDTH), np.uint8)
+    source = EvictingSource(mask(), replacement)
+    table = LazySummedAreaTable(source)
+    source.table = table
+
+    assert table.get() is None and table.residentBytes() == 0
+    built = table.build()
+
+    assert table.get() is built
+    assert built.count((0, 0, WIDTH, HEIGHT)) == (0, WIDTH * HEIGHT)
+    assert table.residentBytes() == built.nbytes
+
+    table.evict()
+    assert table.get() is None and table.residentBytes() == 0
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from PIL import Image
+from raster import (
+    ArrayRasterSource,
+    CompactArrayRasterSource,
+    PackedMaskRasterSource,
+    PilRasterSource,
+    TiffChunkedRasterSource,
+    openRaster
+)
+
+WIDTH, HEIGHT = 45, 38
+
+
+def expectedWindow(arr, box, level):
+    '''
+        Every 2 ** level-th pixel of `box` of zero padded `arr`
+    '''
+
+    left, top, right, bottom = box
+    pad = max(0, -left, -top, right - arr.shape[1], bottom - arr.shape[0])
+    padded = np.pad(arr, ((pad, pad), (pad, pad)) + ((0, 0),) * (arr.ndim - 2))
+    step = 2 ** level
+    return padded[top + pad:bottom + pad:step, left + pad:right + pad:step]
+
+
+def picture():
+    return np.random.default_rng(0).integers(0, 256, (HEIGHT, WIDTH, 3), dtype=np.uint8)
+
+
+def mask():
+    return np.where(picture()[:, :, 0] > 127, np.uint8(255), np.uint8(0))
+
+
+@pytest.fixture(params=['array', 'compact', 'pil', 'png', 'bmp', 'tiff', 'packed'])
+def source_and_pixels(request, tmp_path):
+    arr = mask() if request.param == 'packed' else picture()
+    if request.param == 'array':
+        return ArrayRasterSource(arr), arr
+    if request.param == 'compact':
+        source = CompactArrayRasterSource(arr.copy())
+        source.evict()
+        return source, arr
+    if request.param == 'pil':
+        return PilRasterSource(Image.fromarray(arr)), arr
+    if request.param == 'packed':
+        return PackedMaskRasterSource.fromArray(arr), arr
+
+    path = str(tmp_path / ('picture.' + request.param))
+    if request.param == 'tiff':
+        Image.fromarray(arr).save(path, compression='tiff_adobe_deflate', tile=(16, 16))
+    else:
+        Image.fromarray(arr).save(path)
+    source = openRaster(path)
+    if request.param == 'tiff':
+        assert isinstance(source, TiffChunkedRasterSource)
+    return source, arr
+
+
+@pytest.mark.parametrize('box', [
+    (0, 0, WIDTH, HEIGHT),
+    (3, 5, 40, 31),
+    (-7, -3, 20, 17),
+    (30, 25, WIDTH + 9, HEIGHT + 6),
+])
+@pytest.mark.parametrize('level', [0, 1, 2])
+def test_all_sources_decimate_the_same_way(source_and_pixels, box, level):
+    source, arr = source_and_pixels
+
+    window = np.asarray(source.readWindow(box, level))
+
+    assert np.array_equal(window, expectedWindow(arr, box, level))
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from PIL import Image
+import resampling
+from raster import ArrayRasterSource, PilRasterSource, openRaster
+from resampling import boxReduce, readResized, reduceFactor, resizeImage
+
+WIDTH, HEIGHT = 203, 151
+
+
+def picture():
+    # smooth gradients, so differently decoded pictures stay comparable
+    y, x = np.mgrid[0:HEIGHT, 0:WIDTH]
+    return np.stack([x * 255 // WIDTH, y * 255 // HEIGHT, (x + y) * 255 // (WIDTH + HEIGHT)], axis=2).astype(np.uint8)
+
+
+def test_reduce_factor_keeps_the_gap():
+    assert reduceFactor((1000, 800), (100, 100)) == 8
+    assert reduceFactor((1000, 800), (100, 100), gap=2) == 4
+    assert reduceFactor((90, 90), (100, 100)) == 1
+
+
+@pytest.mark.parametrize('factor', [1, 2, 3, 8])
+def test_box_reduce_by_bands_equals_reduce_at_once(monkeypatch, factor):
+    # bands of a few rows, so the picture is read in several of them
+    monkeypatch.setattr(resampling, 'RESAMPLING_BAND_PIXELS', WIDTH * 10)
+
+    reduced = boxReduce(ArrayRasterSource(picture()), factor)
+
+    assert np.array_equal(np.asarray(reduced), np.asarray(Image.fromarray(picture()).reduce(factor)))
+
+
+@pytest.mark.parametrize('quality', ['fast', 'balanced', 'high'])
+def test_read_resized_is_close_to_resizing_at_full_resolution(quality):
+    size = (50, 37)
+    expected = np.asarray(Image.fromarray(picture()).resize(size, Image.LANCZOS), dtype=np.float32)
+
+    resized = readResized(ArrayRasterSource(picture()), size, quality)
+
+    assert resized.size == size
+    assert np.abs(np.asarray(resized, dtype=np.float32) - expected).mean() < 2
+
+
+def test_read_resized_uses_tiff_overviews(tmp_path):
+    path = str(tmp_path / 'scene.tif')
+    image = Image.fromarray(picture())
+    # inverted overviews, so the test can tell which image was read
+    overviews = [Image.fromarray(255 - np.asarray(image.reduce(factor))) for factor in (2, 4)]
+    # Pillow writes the tags to every image, the first one is the main image whatever its NewSubfileType
+    image.save(path, save_all=True, append_images=overviews, tiffinfo={254: 1})
+    source = openRaster(path)
+    assert [overview.size for overview in source.overviews] == [(102, 76), (51, 38)]
+
+    assert np.array_equal(np.asarray(source.readReduced((50, 37))), np.asarray(overviews[1]))
+    assert np.array_equal(np.asarray(source.readReduced((60, 37))), np.asarray(overviews[0]))
+    assert source.readReduced((150, 37)) is None
+    resized = readResized(source, (50, 37), 'fast')
+    assert np.array_equal(np.asarray(resized), np.asarray(overviews[1].resize((50, 37), Image.BILINEAR)))
+
+
+def test_read_resized_decodes_jpeg_at_reduced_size(tmp_path):
+    path = str(tmp_path / 'scene.jpg')
+    Image.fromarray(picture()).save(path, quality=95)
+    source = openRaster(path)
+    assert isinstance(source, PilRasterSource)
+
+    reduced = source.readReduced((50, 37))
+    assert reduced.size == (51, 38)
+    # already decoded pictures are reduced in memory instead
+    source.readImage()
+    assert source.readReduced((50, 37)) is None
+
+    assert readResized(openRaster(path), (50, 37), 'balanced').size == (50, 37)
+
+
+def test_resize_image_to_its_own_size_is_unchanged():
+    image = Image.fromarray(picture())
+
+    assert np.array_equal(np.asarray(resizeImage(image, image.size, 'high')), picture())
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+from PIL import Image
+from algorithms import Algorithm, blendingWindow, performAlgorithmTiled, readTile, tileOrigins
+from raster import ArrayRasterSource
+
+
+class FirstBandAlgorithm(Algorithm):
+    '''
+        Returns the first band of the first picture, so stitched tiles must give the picture back
+    '''
+
+    def __init__(self, tile_size):
+        self.tile_size = tile_size
+
+    def getInputSize(self):
+        return (self.tile_size, self.tile_size)
+
+    def performImpl(self, t1, t2):
+        return t1[:, :, 0]
+
+
+@pytest.mark.parametrize('length, tile_size, stride', [
+    (1000, 256, 256),
+    (1000, 256, 192),
+    (512, 256, 256),
+    (257, 256, 128),
+    (100, 256, 192),
+    (256, 256, 1),
+])
+def test_tiles_cover_the_axis(length, tile_size, stride):
+    origins = tileOrigins(length, tile_size, stride)
+
+    assert origins[0] == 0
+    assert origins == sorted(set(origins))
+    assert all(b - a <= stride for a, b in zip(origins, origins[1:]))
+    assert origins[-1] == max(0, length - tile_size)
+
+
+def test_tiles_without_overlap_are_adjacent_until_the_last_one():
+    assert tileOrigins(1000, 256, 256) == [0, 256, 512, 744]
+    assert tileOrigins(1024, 256, 256) == [0, 256, 512, 768]
+
+
+def test_scene_smaller_than_tile_is_one_tile():
+    assert tileOrigins(100, 256, 192) == [0]
+
+
+def test_blending_window_without_overlap_is_flat():
+    assert np.array_equal(blendingWindow(8, 0), np.ones((8, 8)))
+
+
+def test_blending_window_fades_within_overlap():
+    weights = blendingWindow(10, 3)
+
+    assert np.allclose(weights[5, :5], [0.25, 0.5, 0.75, 1, 1])
+    assert np.array_equal(weights, weights[::-1]) and np.array_equal(weights, weights.T)
+    assert weights.min() > 0 and weights.max() == 1
+
+
+def test_tile_outside_of_scene_is_mirrored():
+    arr = np.arange(12, dtype=np.uint8).reshape(3, 4)
+
+    tile = np.asarray(readTile(ArrayRasterSource(arr), (-1, 0, 5, 4)))
+
+    assert np.array_equal(tile[:3], np.pad(arr, ((0, 0), (1, 1)), mode='symmetric'))
+    assert np.array_equal(tile[3], tile[2])
+
+
+@pytest.mark.parametrize('width, height, tile_size, overlap', [
+    (100, 70, 32, 0),
+    (100, 70, 32, 8),
+    (64, 64, 32, 0),
+    (20, 13, 32, 8),
+])
+def test_stitched_tiles_give_the_scene_back(width, height, tile_size, overlap):
+    arr = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    picture = Image.fromarray(arr)
+
+    result = performAlgorithmTiled(FirstBandAlgorithm(tile_size), picture, picture, tile_size, overlap)
+
+    assert result.size == (width, height)
+    assert np.array_equal(np.asarray(result), arr[:, :, 0])